@@ -2,7 +2,11 @@
 # Copyright (c) Alibaba, Inc. and its affiliates.
 import logging
 import collections
+import os
+import sys
+from multiprocessing.pool import ThreadPool
 
+import six
 import tensorflow as tf
 
 from easy_rec.python.builders import hyperparams_builder
@@ -19,12 +23,147 @@ else:
   min_max_variable_partitioner = tf.min_max_variable_partitioner
 
 
+# vocab_path => vocabulary size, shared by all parsers in the process
+_VOCAB_SIZE_CACHE = {}
+_READ_BLOCK_SIZE = 1 << 20
+_MAX_VOCAB_READ_THREADS = 8
+# num_buckets => boundaries of values normalized into [0, 1]
+_NORMALIZED_BOUNDS_CACHE = {}
+
+
+def _intern(name):
+  """Intern feature names, which are used as dict keys many times."""
+  if six.PY2:
+    # intern in python2 does not accept unicode
+    return name
+  return sys.intern(name)
+
+
+def _normalized_bounds(num_buckets):
+  """Boundaries splitting [0, 1] into num_buckets equal buckets."""
+  if num_buckets not in _NORMALIZED_BOUNDS_CACHE:
+    _NORMALIZED_BOUNDS_CACHE[num_buckets] = tuple(
+        x / float(num_buckets) for x in range(0, num_buckets))
+  return _NORMALIZED_BOUNDS_CACHE[num_buckets]
+
+
+def _count_lines(fin):
+  """Count lines of a binary file object, same as sum(1 for _ in fin)."""
+  num_lines = 0
+  last_block = b''
+  while True:
+    block = fin.read(_READ_BLOCK_SIZE)
+    if not block:
+      break
+    num_lines += block.count(b'\n')
+    last_block = block
+  # the last line may not end with a line break
+  if last_block and not last_block.endswith(b'\n'):
+    num_lines += 1
+  return num_lines
+
+
+def get_vocab_size(vocab_path):
+  """Get the number of lines in vocab_path.
+
+  Vocab files are scanned by block, the result is cached in the process,
+  so the train, eval and export graphs do not scan the same file again.
+
+  Args:
+    vocab_path: path of the vocab file, one word per line.
+
+  Returns:
+    vocabulary size
+  """
+  if vocab_path in _VOCAB_SIZE_CACHE:
+    return _VOCAB_SIZE_CACHE[vocab_path]
+  if os.path.isfile(vocab_path):
+    with open(vocab_path, 'rb') as fin:
+      vocabulary_size = _count_lines(fin)
+  else:
+    with tf.gfile.GFile(vocab_path, 'rb') as fin:
+      vocabulary_size = _count_lines(fin)
+  _VOCAB_SIZE_CACHE[vocab_path] = vocabulary_size
+  return vocabulary_size
+
+
+def prefetch_vocab_sizes(vocab_paths):
+  """Count lines of vocab files concurrently, to fill the vocab size cache.
+
+  Reading vocab files is io bound and releases the GIL, so files
+  (especially remote ones) are read in a thread pool.
+
+  Args:
+    vocab_paths: collection of vocab file paths
+  """
+  vocab_paths = [x for x in set(vocab_paths) if x not in _VOCAB_SIZE_CACHE]
+  if len(vocab_paths) <= 1:
+    return
+  pool = ThreadPool(min(len(vocab_paths), _MAX_VOCAB_READ_THREADS))
+  try:
+    pool.map(get_vocab_size, vocab_paths)
+  finally:
+    pool.close()
+    pool.join()
+
+
+# (feature configs, wide_deep_dict, ...) => FeatureColumnParser
+_PARSER_CACHE_SIZE = 8
+_PARSER_CACHE = {}
+
+
+def get_feature_column_parser(feature_configs,
+                              wide_deep_dict={},
+                              wide_output_dim=-1,
+                              use_embedding_variable=False):
+  """Get a FeatureColumnParser, reuse the one built for the same arguments.
+
+  The estimator rebuilds the graph for train, eval and export, the
+  feature columns only keep graph states in the collections of the
+  default graph, so they could be safely reused across graphs.
+  The returned parser is shared by all callers with the same arguments,
+  it must not be modified.
+
+  Args:
+    feature_configs: same as FeatureColumnParser
+    wide_deep_dict: same as FeatureColumnParser
+    wide_output_dim: same as FeatureColumnParser
+    use_embedding_variable: same as FeatureColumnParser
+
+  Returns:
+    FeatureColumnParser
+  """
+  cache_key = (tuple([x.SerializeToString() for x in feature_configs]),
+               tuple(sorted(wide_deep_dict.items())), wide_output_dim,
+               use_embedding_variable)
+  if cache_key not in _PARSER_CACHE:
+    if len(_PARSER_CACHE) >= _PARSER_CACHE_SIZE:
+      _PARSER_CACHE.clear()
+    _PARSER_CACHE[cache_key] = FeatureColumnParser(
+        feature_configs,
+        wide_deep_dict,
+        wide_output_dim,
+        use_embedding_variable=use_embedding_variable)
+  return _PARSER_CACHE[cache_key]
+
+
 class FeatureKeyError(KeyError):
 
   def __init__(self, feature_name):
     super(FeatureKeyError, self).__init__(feature_name)
 
 
+# per config metadata resolved once in FeatureColumnParser.__init__,
+# is_wide and is_deep are None if feature_name is not in wide_deep_dict,
+# bounds are the sorted bucket boundaries of raw(sequence) features,
+# set_fields are the names of fields set in the config,
+# initializer_key is the serialized initializer, b'' if not set
+FeatureMeta = collections.namedtuple('FeatureMeta', [
+    'feature_name', 'is_wide', 'is_deep', 'embed_key', 'bounds', 'set_fields',
+    'initializer_key'
+])
+
+
 class SharedEmbedding(object):
    def __init__(self, embedding_name, index, sequence_combiner=None):
      self.embedding_name = embedding_name
@@ -35,6 +174,17 @@ class SharedEmbedding(object):
 class FeatureColumnParser(object):
   """Parse and generate feature columns."""
 
+  # feature_type => name of the method generating its columns
+  _PARSERS = {
+      FeatureConfig.IdFeature: 'parse_id_feature',
+      FeatureConfig.TagFeature: 'parse_tag_feature',
+      FeatureConfig.RawFeature: 'parse_raw_feature',
+      FeatureConfig.ComboFeature: 'parse_combo_feature',
+      FeatureConfig.LookupFeature: 'parse_lookup_feature',
+      FeatureConfig.SequenceFeature: 'parse_sequence_feature',
+      FeatureConfig.ExprFeature: 'parse_expr_feature'
+  }
+
   def __init__(self,
                feature_configs,
                wide_deep_dict={},
@@ -52,55 +202,86 @@ class FeatureColumnParser(object):
       wide_output_dim: output dimension for wide columns
       use_embedding_variable: use EmbeddingVariable, which is provided by pai-tf
     """
+    assert all([isinstance(x, FeatureConfig) for x in feature_configs])
     self._feature_configs = feature_configs
     self._wide_output_dim = wide_output_dim
-    self._wide_deep_dict = wide_deep_dict
+    self._wide_deep_dict = {
+        _intern(k): v for k, v in wide_deep_dict.items()
+    }
+    self._wide_names = set([
+        k for k, v in self._wide_deep_dict.items()
+        if v in (WideOrDeep.WIDE, WideOrDeep.WIDE_AND_DEEP)
+    ])
+    # DEEP or WIDE_AND_DEEP
+    self._deep_names = set([
+        k for k, v in self._wide_deep_dict.items()
+        if v in (WideOrDeep.DEEP, WideOrDeep.WIDE_AND_DEEP)
+    ])
     self._deep_columns = {}
     self._wide_columns = {}
     self._sequence_columns = {}
 
-    self._share_embed_names = {}
-    self._share_embed_infos = {}
-
     self._use_embedding_variable = use_embedding_variable
-    self._vocab_size = {}
+    # serialized initializer proto => tf initializer
+    self._initializers = {}
+    # max_partitions => partitioner
+    self._partitioners = {}
+
+    self._feature_metas = [
+        self._classify(config) for config in self._feature_configs
+    ]
 
-    for config in self._feature_configs:
-      if not config.HasField('embedding_name'):
+    embed_nums = collections.Counter()
+    # embed_name => (config, meta) of the first config using it
+    embed_firsts = {}
+    for config, meta in zip(self._feature_configs, self._feature_metas):
+      embed_key = meta.embed_key
+      if embed_key is None:
         continue
       embed_name = config.embedding_name
-      embed_info = {
-          'embedding_dim':
-              config.embedding_dim,
-          'combiner':
-              config.combiner,
-          'initializer':
-              config.initializer if config.HasField('initializer') else None,
-          'max_partitions':
-              config.max_partitions
-      }
-      if embed_name in self._share_embed_names:
-        assert embed_info == self._share_embed_infos[embed_name], \
+      embed_nums[embed_name] += 1
+      if embed_name in embed_firsts:
+        first_key = embed_firsts[embed_name][1].embed_key
+        assert embed_key == first_key, \
             'shared embed info of [%s] is not matched [%s] vs [%s]' % (
-                embed_name, embed_info, self._share_embed_infos[embed_name])
-        self._share_embed_names[embed_name] += 1
+                embed_name, self._get_embed_info(embed_key),
+                self._get_embed_info(first_key))
       else:
-        self._share_embed_names[embed_name] = 1
-        self._share_embed_infos[embed_name] = embed_info
+        embed_firsts[embed_name] = (config, meta)
 
-    # remove not shared embedding names
-    not_shared = [
-        x for x in self._share_embed_names if self._share_embed_names[x] == 1
-    ]
-    for embed_name in not_shared:
-      del self._share_embed_names[embed_name]
-      del self._share_embed_infos[embed_name]
+    # keep only the embedding names shared by more than one config
+    self._share_embed_names = {
+        embed_name: num for embed_name, num in embed_nums.items() if num > 1
+    }
+    self._share_embed_keys = {
+        embed_name: embed_firsts[embed_name][1].embed_key
+        for embed_name in self._share_embed_names
+    }
+    self._share_embed_infos = {
+        embed_name: self._get_embed_info(embed_key)
+        for embed_name, embed_key in self._share_embed_keys.items()
+    }
+    # initializer proto of the first config of each shared embedding
+    self._share_embed_initializers = {
+        embed_name: embed_firsts[embed_name][0].initializer
+        for embed_name in self._share_embed_names
+        if 'initializer' in embed_firsts[embed_name][1].set_fields
+    }
 
-    logging.info('shared embeddings[num=%d]' % len(self._share_embed_names))
-    for embed_name in self._share_embed_names:
-      logging.info('\t%s: share_num[%d], share_info[%s]' %
-                   (embed_name, self._share_embed_names[embed_name],
-                    self._share_embed_infos[embed_name]))
+    if logging.getLogger().isEnabledFor(logging.INFO):
+      logging.info(
+          'shared embeddings[num=%d]%s', len(self._share_embed_names),
+          ''.join([
+              '\n\t%s: share_num[%d]' % (embed_name, share_num)
+              for embed_name, share_num in self._share_embed_names.items()
+          ]))
+      if logging.getLogger().isEnabledFor(logging.DEBUG):
+        # share_info holds the serialized initializer, only log it in debug
+        logging.debug(
+            'shared embedding infos:%s', ''.join([
+                '\n\t%s: share_info[%s]' % (embed_name, embed_info)
+                for embed_name, embed_info in self._share_embed_infos.items()
+            ]))
     self._deep_share_embed_columns = {
         embed_name: [] for embed_name in self._share_embed_names
     }
@@ -108,45 +289,55 @@ class FeatureColumnParser(object):
         embed_name: [] for embed_name in self._share_embed_names
     }
 
-    for config in self._feature_configs:
-      assert isinstance(config, FeatureConfig)
+    used_configs = [
+        (config, meta)
+        for config, meta in zip(self._feature_configs, self._feature_metas)
+        # features not used by any feature group are skipped
+        if meta.is_wide is not None or
+        config.feature_type == config.SequenceFeature
+    ]
+    prefetch_vocab_sizes([
+        config.vocab_file
+        for config, _ in used_configs
+        if config.vocab_file and not config.vocab_list and
+        config.hash_bucket_size <= 0
+    ])
+
+    parsers = {
+        feature_type: getattr(self, parser_name)
+        for feature_type, parser_name in self._PARSERS.items()
+    }
+    for config, meta in used_configs:
+      parser = parsers.get(config.feature_type, None)
+      assert parser is not None, \
+          'invalid feature type: %s' % config.feature_type
       try:
-        if config.feature_type == config.IdFeature:
-          self.parse_id_feature(config)
-        elif config.feature_type == config.TagFeature:
-          self.parse_tag_feature(config)
-        elif config.feature_type == config.RawFeature:
-          self.parse_raw_feature(config)
-        elif config.feature_type == config.ComboFeature:
-          self.parse_combo_feature(config)
-        elif config.feature_type == config.LookupFeature:
-          self.parse_lookup_feature(config)
-        elif config.feature_type == config.SequenceFeature:
-          self.parse_sequence_feature(config)
-        elif config.feature_type == config.ExprFeature:
-          self.parse_expr_feature(config)
-        else:
-          assert False, 'invalid feature type: %s' % config.feature_type
+        parser(config, meta)
       except FeatureKeyError:
         pass
 
+    # shared embeddings with the same embed key get the same initializer
+    # and partitioner objects, but each embed_name still needs its own
+    # shared_embedding_columns call as it owns a separate variable
     for embed_name in self._share_embed_names:
       initializer = None
-      if self._share_embed_infos[embed_name]['initializer']:
-        initializer = hyperparams_builder.build_initializer(
-            self._share_embed_infos[embed_name]['initializer'])
+      if embed_name in self._share_embed_initializers:
+        initializer = self._build_initializer(
+            self._share_embed_initializers[embed_name],
+            self._share_embed_keys[embed_name][2])
       partitioner = self._build_partitioner(
           self._share_embed_infos[embed_name]['max_partitions'])
       # for handling share embedding columns
-      share_embed_fcs = feature_column.shared_embedding_columns(
-          self._deep_share_embed_columns[embed_name],
-          self._share_embed_infos[embed_name]['embedding_dim'],
-          initializer=initializer,
-          shared_embedding_collection_name=embed_name,
-          combiner=self._share_embed_infos[embed_name]['combiner'],
-          partitioner=partitioner,
-          use_embedding_variable=self._use_embedding_variable)
-      self._deep_share_embed_columns[embed_name] = share_embed_fcs
+      if len(self._deep_share_embed_columns[embed_name]) > 0:
+        self._deep_share_embed_columns[embed_name] = \
+            feature_column.shared_embedding_columns(
+                self._deep_share_embed_columns[embed_name],
+                self._share_embed_infos[embed_name]['embedding_dim'],
+                initializer=initializer,
+                shared_embedding_collection_name=embed_name,
+                combiner=self._share_embed_infos[embed_name]['combiner'],
+                partitioner=partitioner,
+                use_embedding_variable=self._use_embedding_variable)
       # for handling wide share embedding columns
       if len(self._wide_share_embed_columns[embed_name]) == 0:
         continue
@@ -160,19 +351,17 @@ class FeatureColumnParser(object):
           use_embedding_variable=self._use_embedding_variable)
       self._wide_share_embed_columns[embed_name] = share_embed_fcs
 
-    for fc_name in self._deep_columns:
-      fc = self._deep_columns[fc_name]
+    # replacing values of existing keys never resizes the dicts
+    for fc_name, fc in self._deep_columns.items():
       if isinstance(fc, SharedEmbedding):
         self._deep_columns[fc_name] = self._get_shared_embedding_column(fc)
 
-    for fc_name in self._wide_columns:
-      fc = self._wide_columns[fc_name]
+    for fc_name, fc in self._wide_columns.items():
       if isinstance(fc, SharedEmbedding):
         self._wide_columns[fc_name] = self._get_shared_embedding_column(
             fc, deep=False)
 
-    for fc_name in self._sequence_columns:
-      fc = self._sequence_columns[fc_name]
+    for fc_name, fc in self._sequence_columns.items():
       if isinstance(fc, SharedEmbedding):
         self._sequence_columns[fc_name] = self._get_shared_embedding_column(fc)
 
@@ -188,38 +377,79 @@ class FeatureColumnParser(object):
   def sequence_columns(self):
     return self._sequence_columns
 
-  def is_wide(self, config):
-    if config.HasField('feature_name'):
-      feature_name = config.feature_name
-    else:
-      feature_name = config.input_names[0]
-    if feature_name not in self._wide_deep_dict:
-      raise FeatureKeyError(feature_name)
-    return self._wide_deep_dict[feature_name] in [
-        WideOrDeep.WIDE, WideOrDeep.WIDE_AND_DEEP
-    ]
+  def is_wide(self, meta):
+    if meta.is_wide is None:
+      raise FeatureKeyError(meta.feature_name)
+    return meta.is_wide
 
-  def is_deep(self, config):
-    if config.HasField('feature_name'):
-      feature_name = config.feature_name
-    else:
-      feature_name = config.input_names[0]
-    # DEEP or WIDE_AND_DEEP
-    if feature_name not in self._wide_deep_dict:
-      raise FeatureKeyError(feature_name)
-    return self._wide_deep_dict[feature_name] in [
-        WideOrDeep.DEEP, WideOrDeep.WIDE_AND_DEEP
-    ]
+  def is_deep(self, meta):
+    if meta.is_deep is None:
+      raise FeatureKeyError(meta.feature_name)
+    return meta.is_deep
 
-  def _get_vocab_size(self, vocab_path):
-    if vocab_path in self._vocab_size:
-      return self._vocab_size[vocab_path]
-    with tf.gfile.GFile(vocab_path, 'r') as fin:
-      vocabulary_size = sum(1 for _ in fin)
-      self._vocab_size[vocab_path] = vocabulary_size
-      return vocabulary_size
+  def _classify(self, config):
+    """Resolve feature_name, wide/deep flags and shared embedding key once.
+
+    Args:
+      config: instance of easy_rec.python.protos.feature_config_pb2.FeatureConfig
+
+    Returns:
+      FeatureMeta
+    """
+    # a single ListFields call instead of a HasField call per field
+    set_fields = frozenset([field.name for field, _ in config.ListFields()])
+    if 'feature_name' in set_fields:
+      feature_name = _intern(config.feature_name)
+    else:
+      feature_name = _intern(config.input_names[0])
+    is_wide, is_deep = None, None
+    if feature_name in self._wide_deep_dict:
+      is_wide = feature_name in self._wide_names
+      is_deep = feature_name in self._deep_names
+    initializer_key = b''
+    if 'initializer' in set_fields:
+      initializer_key = config.initializer.SerializeToString()
+    embed_key = None
+    if 'embedding_name' in set_fields:
+      # compare a flat tuple instead of building and comparing a dict
+      # for every config sharing the embedding
+      embed_key = (config.embedding_dim, config.combiner, initializer_key,
+                   config.max_partitions)
+    bounds = None
+    if config.feature_type == config.RawFeature or (
+        config.feature_type == config.SequenceFeature and
+        config.sub_feature_type == config.RawFeature and
+        config.hash_bucket_size <= 0):
+      bounds = self._get_bounds(config, feature_name)
+    return FeatureMeta(feature_name, is_wide, is_deep, embed_key, bounds,
+                       set_fields, initializer_key)
+
+  def _get_bounds(self, config, feature_name):
+    """Sorted bucket boundaries, None if not bucketized."""
+    if config.boundaries:
+      return sorted(config.boundaries)
+    elif config.num_buckets > 1 and config.max_val > config.min_val:
+      # the feature values are already normalized into [0, 1]
+      if config.feature_type == config.SequenceFeature:
+        logging.info('sequence feature discrete %s into %d buckets',
+                     feature_name, config.num_buckets)
+      else:
+        logging.info('discrete %s into %d buckets', feature_name,
+                     config.num_buckets)
+      return _normalized_bounds(config.num_buckets)
+    return None
+
+  def _get_embed_info(self, embed_key):
+    embedding_dim, combiner, initializer, max_partitions = embed_key
+    return {
+        'embedding_dim': embedding_dim,
+        'combiner': combiner,
+        # serialized initializer proto
+        'initializer': initializer if initializer else None,
+        'max_partitions': max_partitions
+    }
 
-  def parse_id_feature(self, config):
+  def parse_id_feature(self, config, meta):
     """Generate id feature columns.
 
     if hash_bucket_size or vocab_list or vocab_file is set,
@@ -228,6 +458,7 @@ class FeatureColumnParser(object):
 
     Args:
       config: instance of easy_rec.python.protos.feature_config_pb2.FeatureConfig
+      meta: FeatureMeta of config, built by _classify
     """
     hash_bucket_size = config.hash_bucket_size
     if hash_bucket_size > 0:
@@ -243,17 +474,17 @@ class FeatureColumnParser(object):
           config.input_names[0],
           default_value=0,
           vocabulary_file=config.vocab_file,
-          vocabulary_size=self._get_vocab_size(config.vocab_file))
+          vocabulary_size=get_vocab_size(config.vocab_file))
     else:
       fc = feature_column.categorical_column_with_identity(
           config.input_names[0], config.num_buckets, default_value=0)
 
-    if self.is_wide(config):
-      self._add_wide_embedding_column(fc, config)
-    if self.is_deep(config):
-      self._add_deep_embedding_column(fc, config)
+    if self.is_wide(meta):
+      self._add_wide_embedding_column(fc, config, meta)
+    if self.is_deep(meta):
+      self._add_deep_embedding_column(fc, config, meta)
 
-  def parse_tag_feature(self, config):
+  def parse_tag_feature(self, config, meta):
     """Generate tag feature columns.
 
     if hash_bucket_size is set, will accept input of SparseTensor of string,
@@ -262,9 +493,10 @@ class FeatureColumnParser(object):
 
     Args:
       config: instance of easy_rec.python.protos.feature_config_pb2.FeatureConfig
+      meta: FeatureMeta of config, built by _classify
     """
     hash_bucket_size = config.hash_bucket_size
-    if config.HasField('hash_bucket_size'):
+    if 'hash_bucket_size' in meta.set_fields:
       tag_fc = feature_column.categorical_column_with_hash_bucket(
           config.input_names[0], hash_bucket_size, dtype=tf.string)
     elif config.vocab_list:
@@ -277,7 +509,7 @@ class FeatureColumnParser(object):
           config.input_names[0],
           default_value=0,
           vocabulary_file=config.vocab_file,
-          vocabulary_size=self._get_vocab_size(config.vocab_file))
+          vocabulary_size=get_vocab_size(config.vocab_file))
     else:
       tag_fc = feature_column.categorical_column_with_identity(
           config.input_names[0], config.num_buckets, default_value=0)
@@ -285,41 +517,30 @@ class FeatureColumnParser(object):
     if len(config.input_names) > 1:
       tag_fc = feature_column.weighted_categorical_column(
           tag_fc, weight_feature_key=config.input_names[1], dtype=tf.float32)
-    elif config.HasField('kv_separator'):
+    elif 'kv_separator' in meta.set_fields:
       wgt_name = config.input_names[0] + '_WEIGHT'
       tag_fc = feature_column.weighted_categorical_column(
           tag_fc, weight_feature_key=wgt_name, dtype=tf.float32)
 
-    if self.is_wide(config):
-      self._add_wide_embedding_column(tag_fc, config)
-    if self.is_deep(config):
-      self._add_deep_embedding_column(tag_fc, config)
+    if self.is_wide(meta):
+      self._add_wide_embedding_column(tag_fc, config, meta)
+    if self.is_deep(meta):
+      self._add_deep_embedding_column(tag_fc, config, meta)
 
-  def parse_raw_feature(self, config):
+  def parse_raw_feature(self, config, meta):
     """Generate raw features columns.
 
     if boundaries is set, will be converted to category_column first.
 
     Args:
       config: instance of easy_rec.python.protos.feature_config_pb2.FeatureConfig
+      meta: FeatureMeta of config, built by _classify
     """
-    feature_name = config.feature_name if config.HasField('feature_name') \
-        else config.input_names[0]
+    feature_name = meta.feature_name
     fc = feature_column.numeric_column(
         config.input_names[0], shape=(config.raw_input_dim,))
 
-    bounds = None
-    if config.boundaries:
-      bounds = list(config.boundaries)
-      bounds.sort()
-    elif config.num_buckets > 1 and config.max_val > config.min_val:
-      # the feature values are already normalized into [0, 1]
-      bounds = [
-          x / float(config.num_buckets) for x in range(0, config.num_buckets)
-      ]
-      logging.info('discrete %s into %d buckets' %
-                   (feature_name, config.num_buckets))
-
+    bounds = meta.bounds
     if bounds:
       try:
         fc = feature_column.bucketized_column(fc, bounds)
@@ -327,10 +548,10 @@ class FeatureColumnParser(object):
         tf.logging.error('bucketized_column [%s] with bounds %s error' %
                          (fc.name, str(bounds)))
         raise e
-      if self.is_wide(config):
-        self._add_wide_embedding_column(fc, config)
-      if self.is_deep(config):
-        self._add_deep_embedding_column(fc, config)
+      if self.is_wide(meta):
+        self._add_wide_embedding_column(fc, config, meta)
+      if self.is_deep(meta):
+        self._add_deep_embedding_column(fc, config, meta)
     else:
       tmp_id_col = feature_column.categorical_column_with_identity(
           config.input_names[0] + '_raw_proj_id',
@@ -340,78 +561,79 @@ class FeatureColumnParser(object):
           tmp_id_col,
           weight_feature_key=config.input_names[0] + '_raw_proj_val',
           dtype=tf.float32)
-      if self.is_wide(config):
-        self._add_wide_embedding_column(wgt_fc, config)
-      if self.is_deep(config):
+      if self.is_wide(meta):
+        self._add_wide_embedding_column(wgt_fc, config, meta)
+      if self.is_deep(meta):
         if config.embedding_dim > 0:
-          self._add_deep_embedding_column(wgt_fc, config)
+          self._add_deep_embedding_column(wgt_fc, config, meta)
         else:
           self._deep_columns[feature_name] = fc
 
-  def parse_expr_feature(self, config):
+  def parse_expr_feature(self, config, meta):
     """Generate raw features columns.
 
     if boundaries is set, will be converted to category_column first.
 
     Args:
       config: instance of easy_rec.python.protos.feature_config_pb2.FeatureConfig
+      meta: FeatureMeta of config, built by _classify
     """
-    feature_name = config.feature_name if config.HasField('feature_name') \
-        else config.input_names[0]
+    feature_name = meta.feature_name
     fc = feature_column.numeric_column(
         feature_name, shape=(1,))
-    if self.is_wide(config):
-        self._add_wide_embedding_column(fc, config)
-    if self.is_deep(config):
+    if self.is_wide(meta):
+        self._add_wide_embedding_column(fc, config, meta)
+    if self.is_deep(meta):
         self._deep_columns[feature_name] = fc
 
 
-  def parse_combo_feature(self, config):
+  def parse_combo_feature(self, config, meta):
     """Generate combo feature columns.
 
     Args:
       config: instance of easy_rec.python.protos.feature_config_pb2.FeatureConfig
+      meta: FeatureMeta of config, built by _classify
     """
     assert len(config.input_names) >= 2
     fc = feature_column.crossed_column(
         config.input_names, config.hash_bucket_size, hash_key=None)
 
-    if self.is_wide(config):
-      self._add_wide_embedding_column(fc, config)
-    if self.is_deep(config):
-      self._add_deep_embedding_column(fc, config)
+    if self.is_wide(meta):
+      self._add_wide_embedding_column(fc, config, meta)
+    if self.is_deep(meta):
+      self._add_deep_embedding_column(fc, config, meta)
 
-  def parse_lookup_feature(self, config):
+  def parse_lookup_feature(self, config, meta):
     """Generate lookup feature columns.
 
     Args:
       config: instance of easy_rec.python.protos.feature_config_pb2.FeatureConfig
+      meta: FeatureMeta of config, built by _classify
     """
-    feature_name = config.feature_name if config.HasField('feature_name') \
-        else config.input_names[0]
-    assert config.HasField('hash_bucket_size')
+    feature_name = meta.feature_name
+    assert 'hash_bucket_size' in meta.set_fields
     hash_bucket_size = config.hash_bucket_size
     fc = feature_column.categorical_column_with_hash_bucket(
         feature_name, hash_bucket_size, dtype=tf.string)
 
-    if self.is_wide(config):
-      self._add_wide_embedding_column(fc, config)
-    if self.is_deep(config):
-      self._add_deep_embedding_column(fc, config)
+    if self.is_wide(meta):
+      self._add_wide_embedding_column(fc, config, meta)
+    if self.is_deep(meta):
+      self._add_deep_embedding_column(fc, config, meta)
 
-  def parse_sequence_feature(self, config):
+  def parse_sequence_feature(self, config, meta):
     """Generate sequence feature columns.
 
     Args:
       config: instance of easy_rec.python.protos.feature_config_pb2.FeatureConfig
+      meta: FeatureMeta of config, built by _classify
     """
-    feature_name = config.feature_name if config.HasField('feature_name') \
-        else config.input_names[0]
+    feature_name = meta.feature_name
     sub_feature_type = config.sub_feature_type
     assert sub_feature_type in [config.IdFeature, config.RawFeature], \
         'Current sub_feature_type only support IdFeature and RawFeature.'
     if sub_feature_type == config.IdFeature:
-      if config.HasField('hash_bucket_size'):
+      if 'hash_bucket_size' in meta.set_fields:
         hash_bucket_size = config.hash_bucket_size
         fc = sequence_feature_column.sequence_categorical_column_with_hash_bucket(
             config.input_names[0], hash_bucket_size, dtype=tf.string)
@@ -425,7 +647,7 @@ class FeatureColumnParser(object):
             config.input_names[0],
             default_value=0,
             vocabulary_file=config.vocab_file,
-            vocabulary_size=self._get_vocab_size(config.vocab_file))
+            vocabulary_size=get_vocab_size(config.vocab_file))
       else:
         fc = sequence_feature_column.sequence_categorical_column_with_identity(
             config.input_names[0], config.num_buckets, default_value=0)
@@ -437,16 +659,8 @@ class FeatureColumnParser(object):
         hash_bucket_size = config.hash_bucket_size
         assert sub_feature_type == config.IdFeature, \
             'You should set sub_feature_type to IdFeature to use hash_bucket_size.'
-      elif config.boundaries:
-        bounds = list(config.boundaries)
-        bounds.sort()
-      elif config.num_buckets > 1 and config.max_val > config.min_val:
-        # the feature values are already normalized into [0, 1]
-        bounds = [
-            x / float(config.num_buckets) for x in range(0, config.num_buckets)
-        ]
-        logging.info('sequence feature discrete %s into %d buckets' %
-                     (feature_name, config.num_buckets))
+      else:
+        bounds = meta.bounds
       if bounds:
         try:
           fc = sequence_feature_column.sequence_numeric_column_with_bucketized_column(
@@ -472,20 +686,37 @@ class FeatureColumnParser(object):
               fc, config.sequence_length)
 
     if config.embedding_dim > 0:
-      self._add_deep_embedding_column(fc, config)
+      self._add_deep_embedding_column(fc, config, meta)
     else:
       self._sequence_columns[feature_name] = fc
 
   def _build_partitioner(self, max_partitions):
     if max_partitions > 1:
-      if self._use_embedding_variable:
-        # pai embedding_variable should use fixed_size_partitioner
-        return tf.fixed_size_partitioner(num_shards=max_partitions)
-      else:
-        return min_max_variable_partitioner(max_partitions=max_partitions)
+      # partitioners are stateless, reuse the one built for max_partitions
+      if max_partitions not in self._partitioners:
+        if self._use_embedding_variable:
+          # pai embedding_variable should use fixed_size_partitioner
+          partitioner = tf.fixed_size_partitioner(num_shards=max_partitions)
+        else:
+          partitioner = min_max_variable_partitioner(
+              max_partitions=max_partitions)
+        self._partitioners[max_partitions] = partitioner
+      return self._partitioners[max_partitions]
     else:
       return None
 
+  def _build_initializer(self, initializer, init_key):
+    """Build tf initializer, reuse the one built for the same proto.
+
+    Args:
+      initializer: easy_rec.python.protos.hyperparams_pb2.Initializer
+      init_key: initializer serialized to string
+    """
+    if init_key not in self._initializers:
+      self._initializers[init_key] = hyperparams_builder.build_initializer(
+          initializer)
+    return self._initializers[init_key]
+
   def _add_shared_embedding_column(self, embedding_name, fc, deep=True):
     curr_id = len(self._deep_share_embed_columns[embedding_name])
     if deep:
@@ -503,22 +734,22 @@ class FeatureColumnParser(object):
     tmp.sequence_combiner = fc_handle.sequence_combiner
     return tmp
 
-  def _add_wide_embedding_column(self, fc, config):
+  def _add_wide_embedding_column(self, fc, config, meta):
     """Generate wide feature columns.
 
     We use embedding to simulate wide column, which is more efficient than indicator column for
     sparse features
     """
-    feature_name = config.feature_name if config.HasField('feature_name') \
-        else config.input_names[0]
+    feature_name = meta.feature_name
     assert self._wide_output_dim > 0, 'wide_output_dim is not set'
     if config.embedding_name in self._wide_share_embed_columns:
       wide_fc = self._add_shared_embedding_column(
           config.embedding_name, fc, deep=False)
     else:
       initializer = None
-      if config.HasField('initializer'):
-        initializer = hyperparams_builder.build_initializer(config.initializer)
+      if 'initializer' in meta.set_fields:
+        initializer = self._build_initializer(config.initializer,
+                                              meta.initializer_key)
       wide_fc = feature_column.embedding_column(
           fc,
           self._wide_output_dim,
@@ -528,17 +759,17 @@ class FeatureColumnParser(object):
           use_embedding_variable=self._use_embedding_variable)
     self._wide_columns[feature_name] = wide_fc
 
-  def _add_deep_embedding_column(self, fc, config):
+  def _add_deep_embedding_column(self, fc, config, meta):
     """Generate deep feature columns."""
-    feature_name = config.feature_name if config.HasField('feature_name') \
-        else config.input_names[0]
+    feature_name = meta.feature_name
     assert config.embedding_dim > 0, 'embedding_dim is not set for %s' % feature_name
     if config.embedding_name in self._deep_share_embed_columns:
       fc = self._add_shared_embedding_column(config.embedding_name, fc)
     else:
       initializer = None
-      if config.HasField('initializer'):
-        initializer = hyperparams_builder.build_initializer(config.initializer)
+      if 'initializer' in meta.set_fields:
+        initializer = self._build_initializer(config.initializer,
+                                              meta.initializer_key)
       fc = feature_column.embedding_column(
           fc,
           config.embedding_dim,
@@ -549,6 +780,6 @@ class FeatureColumnParser(object):
     if config.feature_type != config.SequenceFeature:
       self._deep_columns[feature_name] = fc
     else:
-      if config.HasField('sequence_combiner'):
+      if 'sequence_combiner' in meta.set_fields:
         fc.sequence_combiner = config.sequence_combiner
       self._sequence_columns[feature_name] = fc
@@ -130,8 +130,6 @@ class CSVInput(Input):
     dataset = dataset.map(
         map_func=self._preprocess, num_parallel_calls=num_parallel_calls)
 
-    dataset = dataset.prefetch(buffer_size=self._prefetch_size)
-
     if mode != tf.estimator.ModeKeys.PREDICT:
       dataset = dataset.map(lambda x:
                             (self._get_features(x), self._get_labels(x)))
@@ -50,7 +50,6 @@ class CSVInputV2(Input):
 
     dataset = dataset.prefetch(buffer_size=self._prefetch_size)
     dataset = dataset.map(map_func=self._preprocess, num_parallel_calls=8)
-    dataset = dataset.prefetch(buffer_size=self._prefetch_size)
 
     if mode != tf.estimator.ModeKeys.PREDICT:
       dataset = dataset.map(lambda x:
@@ -9,6 +9,7 @@ import tensorflow as tf
 
 from easy_rec.python.core import sampler as sampler_lib
 from easy_rec.python.protos.dataset_pb2 import DatasetConfig
+from easy_rec.python.protos.feature_config_pb2 import FeatureConfig
 from easy_rec.python.utils import config_util
 from easy_rec.python.utils import constant
 from easy_rec.python.utils.expr_util import get_expression
@@ -18,12 +19,77 @@ from easy_rec.python.utils.load_class import get_register_class_meta
 if tf.__version__ >= '2.0':
   tf = tf.compat.v1
 
+_TF_TYPE_MAP = {
+    DatasetConfig.INT32: tf.int32,
+    DatasetConfig.INT64: tf.int64,
+    DatasetConfig.STRING: tf.string,
+    DatasetConfig.BOOL: tf.bool,
+    DatasetConfig.FLOAT: tf.float32,
+    DatasetConfig.DOUBLE: tf.double
+}
+
+
+def _grid_indices(shape):
+  """Indices of all the elements of a dense tensor, in row major order.
+
+  Args:
+    shape: list of dimension sizes, python ints or int64 scalar tensors.
+
+  Returns:
+    int64 tensor of shape [prod(shape), len(shape)].
+  """
+  ranges = [tf.range(dim, dtype=tf.int64) for dim in shape]
+  grids = tf.meshgrid(*ranges, indexing='ij')
+  return tf.stack([tf.reshape(x, [-1]) for x in grids], axis=1)
+
+
+def _make_proj_sparse(values, dims):
+  """Project dense raw values to sparse ids and values.
+
+  Every element of values becomes one entry of the two SparseTensors, its id
+  is its position in the second dimension, which is the sequence position
+  or the raw dim.
+
+  Args:
+    values: dense tensor of shape dims.
+    dims: list of dimension sizes, [sample_num, ...].
+
+  Returns:
+    (sparse_id, sparse_val): two SparseTensors of dense shape dims.
+  """
+  indices = _grid_indices(dims)
+  sparse_id = tf.SparseTensor(
+      indices=indices, values=indices[:, 1], dense_shape=dims)
+  sparse_val = tf.SparseTensor(
+      indices=indices, values=tf.reshape(values, [-1]), dense_shape=dims)
+  return sparse_id, sparse_val
+
+
+def _min_max_normalize(values, min_val, max_val):
+  """Compute (values - min_val) / (max_val - min_val) as one multiply-add.
+
+  The scale and offset are folded into python floats at graph build time.
+  """
+  scale = 1.0 / (max_val - min_val)
+  return values * scale + (-min_val * scale)
+
+
 _INPUT_CLASS_MAP = {}
 _meta_type = get_register_class_meta(_INPUT_CLASS_MAP, have_abstract_class=True)
 
 
 class Input(six.with_metaclass(_meta_type, object)):
 
+  # feature_type => name of the method preprocessing its inputs
+  _FEATURE_PREPROCESSORS = {
+      FeatureConfig.TagFeature: '_preprocess_tag_feature',
+      FeatureConfig.LookupFeature: '_preprocess_lookup_feature',
+      FeatureConfig.SequenceFeature: '_preprocess_sequence_feature',
+      FeatureConfig.RawFeature: '_preprocess_raw_feature',
+      FeatureConfig.IdFeature: '_preprocess_id_feature',
+      FeatureConfig.ExprFeature: '_preprocess_expr_feature'
+  }
+
   def __init__(self,
                data_config,
                feature_configs,
@@ -51,6 +117,9 @@ class Input(six.with_metaclass(_meta_type, object)):
     self._input_fields = [x.input_name for x in data_config.input_fields]
     self._input_dims = [x.input_dim for x in data_config.input_fields]
     self._input_field_types = [x.input_type for x in data_config.input_fields]
+    self._input_field_tf_types = [
+        self.get_tf_type(x) for x in self._input_field_types
+    ]
     self._input_field_defaults = [
         x.default_val for x in data_config.input_fields
     ]
@@ -70,7 +139,10 @@ class Input(six.with_metaclass(_meta_type, object)):
     self._input_path = input_path
 
     # findout effective fields
-    self._effective_fields = []
+    input_fids = {}
+    for fid, x in enumerate(self._input_fields):
+      input_fids.setdefault(x, fid)
+    effective_fields = OrderedDict()
 
     # for multi value inputs, the types maybe different
     # from the types defined in input_fields
@@ -79,10 +151,9 @@ class Input(six.with_metaclass(_meta_type, object)):
 
     for fc in self._feature_configs:
       for input_name in fc.input_names:
-        assert input_name in self._input_fields, 'invalid input_name in %s' % str(
+        assert input_name in input_fids, 'invalid input_name in %s' % str(
             fc)
-        if input_name not in self._effective_fields:
-          self._effective_fields.append(input_name)
+        effective_fields[input_name] = None
 
       if fc.feature_type in [fc.TagFeature, fc.SequenceFeature]:
         if fc.hash_bucket_size > 0:
@@ -97,23 +168,54 @@ class Input(six.with_metaclass(_meta_type, object)):
 
     # add sample weight to effective fields
     if self._data_config.HasField('sample_weight'):
-      self._effective_fields.append(self._data_config.sample_weight)
+      effective_fields[self._data_config.sample_weight] = None
 
-    self._effective_fids = [
-        self._input_fields.index(x) for x in self._effective_fields
-    ]
     # sort fids from small to large
-    self._effective_fids = list(set(self._effective_fids))
+    self._effective_fids = sorted(
+        set(input_fids[x] for x in effective_fields))
     self._effective_fields = [
         self._input_fields[x] for x in self._effective_fids
     ]
 
     self._label_fids = [self._input_fields.index(x) for x in self._label_fields]
+    # (label name, label dim, label separator) of each label,
+    # the separator is only needed by labels with label_dim > 1
+    self._label_plan = [
+        (x, self._label_dim[i],
+         self._label_sep[i] if i < len(self._label_sep) else None)
+        for i, x in enumerate(self._label_fields)
+    ]
+
+    # fields exported when inputs are not filtered: all fields
+    # except labels and sample weight
+    excluded_fields = set(self._label_fields)
+    if self._data_config.HasField('sample_weight'):
+      excluded_fields.add(self._data_config.sample_weight)
+    self._non_label_fids = [
+        fid for fid, x in enumerate(self._input_fields)
+        if x not in excluded_fields
+    ]
 
     # virtual fields generated by self._preprocess
     # which will be inputs to feature columns
     self._appended_fields = []
 
+    # resolve the preprocess method of each feature once,
+    # instead of walking the feature_type branches on every call
+    self._preprocess_plan = [
+        (fc, self._get_preprocess_fn(fc)) for fc in self._feature_configs
+    ]
+
+    # expressions of expr features are translated and compiled once
+    self._expr_codes = {}
+    for fc in self._feature_configs:
+      if fc.feature_type == fc.ExprFeature:
+        expression = get_expression(
+            fc.expression, fc.input_names, prefix='expr_')
+        logging.info('expression: %s' % expression)
+        self._expr_codes[fc.feature_name] = compile(expression,
+                                                    '<expr>', 'eval')
+
     # sampler
     self._sampler = None
     if input_path is not None:
@@ -130,16 +232,8 @@ class Input(six.with_metaclass(_meta_type, object)):
       return None
 
   def get_tf_type(self, field_type):
-    type_map = {
-        DatasetConfig.INT32: tf.int32,
-        DatasetConfig.INT64: tf.int64,
-        DatasetConfig.STRING: tf.string,
-        DatasetConfig.BOOL: tf.bool,
-        DatasetConfig.FLOAT: tf.float32,
-        DatasetConfig.DOUBLE: tf.double
-    }
-    assert field_type in type_map, 'invalid type: %s' % field_type
-    return type_map[field_type]
+    assert field_type in _TF_TYPE_MAP, 'invalid type: %s' % field_type
+    return _TF_TYPE_MAP[field_type]
 
   def create_multi_placeholders(self, export_config):
     """Create multiply placeholders on export, one for each feature.
@@ -155,17 +249,10 @@ class Input(six.with_metaclass(_meta_type, object)):
       export_fields_name = None
     placeholder_named_by_input = export_config.placeholder_named_by_input
 
-    sample_weight_field = ""
-    if self._data_config.HasField('sample_weight'):
-      sample_weight_field = self._data_config.sample_weight
-
     if export_config.filter_inputs:
       effective_fids = list(self._effective_fids)
     else:
-      effective_fids = [
-          fid for fid in range(len(self._input_fields))
-          if self._input_fields[fid] not in self._label_fields  and self._input_fields[fid] != sample_weight_field
-      ]
+      effective_fids = list(self._non_label_fids)
 
     inputs = {}
     for fid in effective_fids:
@@ -176,61 +263,89 @@ class Input(six.with_metaclass(_meta_type, object)):
         placeholder_name = 'input_%d' % fid
       if input_name in export_fields_name:
         tf_type = self._multi_value_types[input_name]
-        logging.info('multi value input_name: %s, dtype: %s' %
-                     (input_name, tf_type))
+        logging.info('multi value input_name: %s, dtype: %s', input_name,
+                     tf_type)
         finput = tf.placeholder(tf_type, [None, None], name=placeholder_name)
       else:
-        ftype = self._input_field_types[fid]
-        tf_type = self.get_tf_type(ftype)
-        logging.info('input_name: %s, dtype: %s' % (input_name, tf_type))
+        tf_type = self._input_field_tf_types[fid]
+        logging.info('input_name: %s, dtype: %s', input_name, tf_type)
         finput = tf.placeholder(tf_type, [None], name=placeholder_name)
       inputs[input_name] = finput
-    features = {x: inputs[x] for x in inputs}
-    features = self._preprocess(features)
+    # _preprocess may update its input dict, so pass it a shallow copy
+    features = self._preprocess(dict(inputs))
     return inputs, features
 
   def create_placeholders(self, export_config):
     self._mode = tf.estimator.ModeKeys.PREDICT
     inputs_placeholder = tf.placeholder(tf.string, [None], name='features')
-    input_vals = tf.string_split(
-        inputs_placeholder, self._data_config.separator,
-        skip_empty=False).values
-
-    sample_weight_field = ""
-    if self._data_config.HasField('sample_weight'):
-      sample_weight_field = self._data_config.sample_weight
 
     if export_config.filter_inputs:
       effective_fids = list(self._effective_fids)
-      logging.info('number of effective inputs:%d, total number inputs: %d' %
-                   (len(effective_fids), len(self._input_fields)))
+      logging.info('number of effective inputs:%d, total number inputs: %d',
+                   len(effective_fids), len(self._input_fields))
     else:
-      effective_fids = [
-          fid for fid in range(len(self._input_fields))
-          if self._input_fields[fid] not in self._label_fields and self._input_fields[fid] != sample_weight_field
-      ]
+      effective_fids = list(self._non_label_fids)
       logging.info(
-          'will not filter any input[except labels], total number inputs:%d' %
+          'will not filter any input[except labels], total number inputs:%d',
           len(effective_fids))
+    features = self._parse_placeholder_features(inputs_placeholder,
+                                                effective_fids)
+    features = self._preprocess(features)
+    return {'features': inputs_placeholder}, features
+
+  def _parse_placeholder_features(self, inputs_placeholder, effective_fids):
+    """Split the separator joined input strings into feature columns.
+
+    Numeric columns are converted to numbers, other columns are kept as
+    strings. Numeric values are required, an empty value is an error.
+    """
+    numeric_types = [tf.float32, tf.double, tf.int32, tf.int64]
+    for fid in effective_fids:
+      ftype = self._input_field_types[fid]
+      tf_type = self._input_field_tf_types[fid]
+      if tf_type not in numeric_types and ftype not in [DatasetConfig.STRING]:
+        logging.warning('unexpected field type: ftype=%s tf_type=%s', ftype,
+                        tf_type)
+
+    if len(self._data_config.separator) == 1:
+      # all columns are parsed by one decode_csv op, an empty default
+      # makes the numeric columns required
+      record_defaults = []
+      for fid in effective_fids:
+        tf_type = self._input_field_tf_types[fid]
+        if tf_type in numeric_types:
+          record_defaults.append(tf.constant([], dtype=tf_type))
+        else:
+          record_defaults.append('')
+      input_vals = tf.decode_csv(
+          inputs_placeholder,
+          record_defaults=record_defaults,
+          field_delim=self._data_config.separator,
+          use_quote_delim=False,
+          name='input_decode_csv')
+      return {
+          self._input_fields[fid]: input_vals[tmp_id]
+          for tmp_id, fid in enumerate(effective_fids)
+      }
+
+    # decode_csv needs a single character delimiter
+    input_vals = tf.string_split(
+        inputs_placeholder, self._data_config.separator,
+        skip_empty=False).values
     input_vals = tf.reshape(
         input_vals, [-1, len(effective_fids)], name='input_reshape')
     features = {}
     for tmp_id, fid in enumerate(effective_fids):
-      ftype = self._input_field_types[fid]
-      tf_type = self.get_tf_type(ftype)
+      tf_type = self._input_field_tf_types[fid]
       input_name = self._input_fields[fid]
-      if tf_type in [tf.float32, tf.double, tf.int32, tf.int64]:
-        features[input_name] = tf.string_to_number(
+      if tf_type in numeric_types:
+        features[input_name] = tf.strings.to_number(
             input_vals[:, tmp_id],
             tf_type,
             name='input_str_to_%s' % tf_type.name)
       else:
-        if ftype not in [DatasetConfig.STRING]:
-          logging.warning('unexpected field type: ftype=%s tf_type=%s' %
-                          (ftype, tf_type))
         features[input_name] = input_vals[:, tmp_id]
-    features = self._preprocess(features)
-    return {'features': inputs_placeholder}, features
+    return features
 
   def _get_features(self, fields):
     field_dict = {x: fields[x] for x in self._effective_fields if x in fields}
@@ -264,6 +379,9 @@ class Input(six.with_metaclass(_meta_type, object)):
       output_dict: some of the tensors are transformed into sparse tensors,
           such as input tensors of tag features and lookup features
     """
+    # the estimator may call input_fn, and so trace _preprocess, several
+    # times on the same input, start every trace with no appended fields
+    self._appended_fields = []
     parsed_dict = {}
     if self._sampler is not None:
       sampler_type = self._data_config.WhichOneof('sampler')
@@ -286,306 +404,27 @@ class Input(six.with_metaclass(_meta_type, object)):
           parsed_dict[k] = v
           self._appended_fields.append(k)
 
-    print("[input] all feature names: {}".format([fc.feature_name for fc in self._feature_configs]))
-    for fc in self._feature_configs:
-      feature_name = fc.feature_name
-      feature_type = fc.feature_type
-      input_0 = fc.input_names[0]
-      if feature_type == fc.TagFeature:
-        input_0 = fc.input_names[0]
-        field = field_dict[input_0]
-        # Construct the output of TagFeature according to the dimension of field_dict.
-        # When the input field exceeds 2 dimensions, convert TagFeature to 2D output.
-        if len(field.get_shape()) < 2 or field.get_shape()[-1] == 1:
-          if len(field.get_shape()) == 0:
-            field = tf.expand_dims(field, axis=0)
-          elif len(field.get_shape()) == 2:
-            field = tf.squeeze(field, axis=-1)
-          parsed_dict[input_0] = tf.string_split(field, fc.separator)
-          if fc.HasField('kv_separator'):
-            indices = parsed_dict[input_0].indices
-            tmp_kvs = parsed_dict[input_0].values
-            tmp_kvs = tf.string_split(
-                tmp_kvs, fc.kv_separator, skip_empty=False)
-            tmp_kvs = tf.reshape(tmp_kvs.values, [-1, 2])
-            tmp_ks, tmp_vs = tmp_kvs[:, 0], tmp_kvs[:, 1]
-            tmp_vs = tf.string_to_number(
-                tmp_vs, tf.float32, name='kv_tag_wgt_str_2_flt_%s' % input_0)
-            parsed_dict[input_0] = tf.sparse.SparseTensor(
-                indices, tmp_ks, parsed_dict[input_0].dense_shape)
-            input_wgt = input_0 + '_WEIGHT'
-            parsed_dict[input_wgt] = tf.sparse.SparseTensor(
-                indices, tmp_vs, parsed_dict[input_0].dense_shape)
-            self._appended_fields.append(input_wgt)
-          if not fc.HasField('hash_bucket_size'):
-            vals = tf.string_to_number(
-                parsed_dict[input_0].values,
-                tf.int32,
-                name='tag_fea_%s' % input_0)
-            parsed_dict[input_0] = tf.sparse.SparseTensor(
-                parsed_dict[input_0].indices, vals,
-                parsed_dict[input_0].dense_shape)
-          if len(fc.input_names) > 1:
-            input_1 = fc.input_names[1]
-            field = field_dict[input_1]
-            if len(field.get_shape()) == 0:
-              field = tf.expand_dims(field, axis=0)
-            field = tf.string_split(field, fc.separator)
-            field_vals = tf.string_to_number(
-                field.values, tf.float32, name='tag_wgt_str_2_flt_%s' % input_1)
-            assert_op = tf.assert_equal(
-                tf.shape(field_vals)[0],
-                tf.shape(parsed_dict[input_0].values)[0],
-                message='tag_feature_kv_size_not_eq_%s' % input_0)
-            with tf.control_dependencies([assert_op]):
-              field = tf.sparse.SparseTensor(field.indices,
-                                             tf.identity(field_vals),
-                                             field.dense_shape)
-            parsed_dict[input_1] = field
-        else:
-          parsed_dict[input_0] = field_dict[input_0]
-          if len(fc.input_names) > 1:
-            input_1 = fc.input_names[1]
-            parsed_dict[input_1] = field_dict[input_1]
-      elif feature_type == fc.LookupFeature:
-        assert feature_name is not None and feature_name != ''
-        assert len(fc.input_names) == 2
-        parsed_dict[feature_name] = self._lookup_preprocess(fc, field_dict)
-      elif feature_type == fc.SequenceFeature:
-        input_0 = fc.input_names[0]
-        field = field_dict[input_0]
-        sub_feature_type = fc.sub_feature_type
-        # Construct the output of SeqFeature according to the dimension of field_dict.
-        # When the input field exceeds 2 dimensions, convert SeqFeature to 2D output.
-        if len(field.get_shape()) < 2:
-          parsed_dict[input_0] = tf.strings.split(field, fc.separator)
-          if fc.HasField('seq_multi_sep'):
-            indices = parsed_dict[input_0].indices
-            values = parsed_dict[input_0].values
-            multi_vals = tf.string_split(values, fc.seq_multi_sep)
-            indices_1 = multi_vals.indices
-            indices = tf.gather(indices, indices_1[:, 0])
-            out_indices = tf.concat([indices, indices_1[:, 1:]], axis=1)
-            # 3 dimensional sparse tensor
-            out_shape = tf.concat(
-                [parsed_dict[input_0].dense_shape, multi_vals.dense_shape[1:]],
-                axis=0)
-            parsed_dict[input_0] = tf.sparse.SparseTensor(
-                out_indices, multi_vals.values, out_shape)
-          if (fc.num_buckets > 1 and fc.max_val == fc.min_val):
-            parsed_dict[input_0] = tf.sparse.SparseTensor(
-                parsed_dict[input_0].indices,
-                tf.string_to_number(
-                    parsed_dict[input_0].values,
-                    tf.int64,
-                    name='sequence_str_2_int_%s' % input_0),
-                parsed_dict[input_0].dense_shape)
-          elif sub_feature_type == fc.RawFeature:
-            parsed_dict[input_0] = tf.sparse.SparseTensor(
-                parsed_dict[input_0].indices,
-                tf.string_to_number(
-                    parsed_dict[input_0].values,
-                    tf.float32,
-                    name='sequence_str_2_float_%s' % input_0),
-                parsed_dict[input_0].dense_shape)
-          if fc.num_buckets > 1 and fc.max_val > fc.min_val:
-            normalized_values = (parsed_dict[input_0].values - fc.min_val) / (
-                fc.max_val - fc.min_val)
-            parsed_dict[input_0] = tf.sparse.SparseTensor(
-                parsed_dict[input_0].indices, normalized_values,
-                parsed_dict[input_0].dense_shape)
-        else:
-          parsed_dict[input_0] = field
-        if not fc.boundaries and fc.num_buckets <= 1 and fc.hash_bucket_size <= 0 and \
-            self._data_config.sample_weight != input_0 and sub_feature_type == fc.RawFeature and \
-            fc.raw_input_dim == 1:
-          # may need by wide model and deep model to project
-          # raw values to a vector, it maybe better implemented
-          # by a ProjectionColumn later
-          logging.info(
-              'Not set boundaries or num_buckets or hash_bucket_size, %s will process as two dimentsion raw feature'
-              % input_0)
-          parsed_dict[input_0] = tf.sparse_to_dense(
-              parsed_dict[input_0].indices,
-              [tf.shape(parsed_dict[input_0])[0], fc.sequence_length],
-              parsed_dict[input_0].values)
-          sample_num = tf.to_int64(tf.shape(parsed_dict[input_0])[0])
-          indices_0 = tf.range(sample_num, dtype=tf.int64)
-          indices_1 = tf.range(fc.sequence_length, dtype=tf.int64)
-          indices_0 = indices_0[:, None]
-          indices_1 = indices_1[None, :]
-          indices_0 = tf.tile(indices_0, [1, fc.sequence_length])
-          indices_1 = tf.tile(indices_1, [sample_num, 1])
-          indices_0 = tf.reshape(indices_0, [-1, 1])
-          indices_1 = tf.reshape(indices_1, [-1, 1])
-          indices = tf.concat([indices_0, indices_1], axis=1)
-          parsed_dict[input_0 + '_raw_proj_id'] = tf.SparseTensor(
-              indices=indices,
-              values=indices_1[:, 0],
-              dense_shape=[sample_num, fc.sequence_length])
-          parsed_dict[input_0 + '_raw_proj_val'] = tf.SparseTensor(
-              indices=indices,
-              values=tf.reshape(parsed_dict[input_0], [-1]),
-              dense_shape=[sample_num, fc.sequence_length])
-          self._appended_fields.append(input_0 + '_raw_proj_id')
-          self._appended_fields.append(input_0 + '_raw_proj_val')
-        elif not fc.boundaries and fc.num_buckets <= 1 and fc.hash_bucket_size <= 0 and \
-            self._data_config.sample_weight != input_0 and sub_feature_type == fc.RawFeature and \
-            fc.raw_input_dim > 1:
-          # for 3 dimension sequence feature input.
-          # may need by wide model and deep model to project
-          # raw values to a vector, it maybe better implemented
-          # by a ProjectionColumn later
-          logging.info(
-              'Not set boundaries or num_buckets or hash_bucket_size, %s will process as three dimentsion raw feature'
-              % input_0)
-          parsed_dict[input_0] = tf.sparse_to_dense(
-              parsed_dict[input_0].indices, [
-                  tf.shape(parsed_dict[input_0])[0], fc.sequence_length,
-                  fc.raw_input_dim
-              ], parsed_dict[input_0].values)
-          sample_num = tf.to_int64(tf.shape(parsed_dict[input_0])[0])
-          indices_0 = tf.range(sample_num, dtype=tf.int64)
-          indices_1 = tf.range(fc.sequence_length, dtype=tf.int64)
-          indices_2 = tf.range(fc.raw_input_dim, dtype=tf.int64)
-          indices_0 = indices_0[:, None, None]
-          indices_1 = indices_1[None, :, None]
-          indices_2 = indices_2[None, None, :]
-          indices_0 = tf.tile(indices_0,
-                              [1, fc.sequence_length, fc.raw_input_dim])
-          indices_1 = tf.tile(indices_1, [sample_num, 1, fc.raw_input_dim])
-          indices_2 = tf.tile(indices_2, [sample_num, fc.sequence_length, 1])
-          indices_0 = tf.reshape(indices_0, [-1, 1])
-          indices_1 = tf.reshape(indices_1, [-1, 1])
-          indices_2 = tf.reshape(indices_2, [-1, 1])
-          indices = tf.concat([indices_0, indices_1, indices_2], axis=1)
-
-          parsed_dict[input_0 + '_raw_proj_id'] = tf.SparseTensor(
-              indices=indices,
-              values=indices_1[:, 0],
-              dense_shape=[sample_num, fc.sequence_length, fc.raw_input_dim])
-          parsed_dict[input_0 + '_raw_proj_val'] = tf.SparseTensor(
-              indices=indices,
-              values=tf.reshape(parsed_dict[input_0], [-1]),
-              dense_shape=[sample_num, fc.sequence_length, fc.raw_input_dim])
-          self._appended_fields.append(input_0 + '_raw_proj_id')
-          self._appended_fields.append(input_0 + '_raw_proj_val')
-      elif feature_type == fc.RawFeature:
-        input_0 = fc.input_names[0]
-        if field_dict[input_0].dtype == tf.string:
-          if fc.raw_input_dim > 1:
-            tmp_fea = tf.string_split(field_dict[input_0], fc.separator)
-            tmp_vals = tf.string_to_number(
-                tmp_fea.values,
-                tf.float32,
-                name='multi_raw_fea_to_flt_%s' % input_0)
-            parsed_dict[input_0] = tf.sparse_to_dense(
-                tmp_fea.indices,
-                [tf.shape(field_dict[input_0])[0], fc.raw_input_dim],
-                tmp_vals,
-                default_value=0)
-          else:
-            parsed_dict[input_0] = tf.string_to_number(field_dict[input_0],
-                                                       tf.float32)
-        elif field_dict[input_0].dtype in [
-            tf.int32, tf.int64, tf.double, tf.float32
-        ]:
-          parsed_dict[input_0] = tf.to_float(field_dict[input_0])
-        else:
-          assert False, 'invalid dtype[%s] for raw feature' % str(
-              field_dict[input_0].dtype)
-        if fc.max_val > fc.min_val:
-          parsed_dict[input_0] = (parsed_dict[input_0] - fc.min_val) /\
-                                 (fc.max_val - fc.min_val)
-        if not fc.boundaries and fc.num_buckets <= 1 and \
-            self._data_config.sample_weight != input_0:
-          # may need by wide model and deep model to project
-          # raw values to a vector, it maybe better implemented
-          # by a ProjectionColumn later
-          sample_num = tf.to_int64(tf.shape(parsed_dict[input_0])[0])
-          indices_0 = tf.range(sample_num, dtype=tf.int64)
-          indices_1 = tf.range(fc.raw_input_dim, dtype=tf.int64)
-          indices_0 = indices_0[:, None]
-          indices_1 = indices_1[None, :]
-          indices_0 = tf.tile(indices_0, [1, fc.raw_input_dim])
-          indices_1 = tf.tile(indices_1, [sample_num, 1])
-          indices_0 = tf.reshape(indices_0, [-1, 1])
-          indices_1 = tf.reshape(indices_1, [-1, 1])
-          indices = tf.concat([indices_0, indices_1], axis=1)
-
-          parsed_dict[input_0 + '_raw_proj_id'] = tf.SparseTensor(
-              indices=indices,
-              values=indices_1[:, 0],
-              dense_shape=[sample_num, fc.raw_input_dim])
-          parsed_dict[input_0 + '_raw_proj_val'] = tf.SparseTensor(
-              indices=indices,
-              values=tf.reshape(parsed_dict[input_0], [-1]),
-              dense_shape=[sample_num, fc.raw_input_dim])
-          self._appended_fields.append(input_0 + '_raw_proj_id')
-          self._appended_fields.append(input_0 + '_raw_proj_val')
-      elif feature_type == fc.IdFeature:
-        input_0 = fc.input_names[0]
-        parsed_dict[input_0] = field_dict[input_0]
-        if fc.HasField('hash_bucket_size'):
-          if field_dict[input_0].dtype != tf.string:
-            if field_dict[input_0].dtype in [tf.float32, tf.double]:
-              assert fc.precision > 0, 'it is dangerous to convert float or double to string due to ' \
-                                       'precision problem, it is suggested to convert them into string ' \
-                                       'format during feature generalization before using EasyRec; ' \
-                                       'if you really need to do so, please set precision (the number of ' \
-                                       'decimal digits) carefully.'
-            precision = None
-            if field_dict[input_0].dtype in [tf.float32, tf.double]:
-              if fc.precision > 0:
-                precision = fc.precision
-            # convert to string
-            if 'as_string' in dir(tf.strings):
-              parsed_dict[input_0] = tf.strings.as_string(
-                  field_dict[input_0], precision=precision)
-            else:
-              parsed_dict[input_0] = tf.as_string(
-                  field_dict[input_0], precision=precision)
-        elif fc.num_buckets > 0:
-          if parsed_dict[input_0].dtype == tf.string:
-            parsed_dict[input_0] = tf.string_to_number(
-                parsed_dict[input_0], tf.int32, name='%s_str_2_int' % input_0)
-
-      elif feature_type == fc.ExprFeature:
-        fea_name = fc.feature_name
-        prefix = "expr_"
-        for input_name in fc.input_names:
-            new_input_name = prefix + input_name
-            if field_dict[input_name].dtype == tf.string:
-                parsed_dict[new_input_name] = tf.string_to_number(
-                    field_dict[input_name], tf.float64, name='%s_str_2_int_for_expr' % new_input_name)
-            elif field_dict[input_name].dtype in [tf.int32, tf.int64, tf.double, tf.float32]:
-                parsed_dict[new_input_name] = tf.cast(field_dict[input_name], tf.float64)
-            else:
-                assert False, 'invalid input dtype[%s] for expr feature' % str(field_dict[input_name].dtype)
-
-        expression = get_expression(fc.expression, fc.input_names, prefix=prefix)
-        logging.info("expression: %s" % expression)
-        parsed_dict[fea_name] = eval(expression)
-        self._appended_fields.append(fea_name)
+    if logging.getLogger().isEnabledFor(logging.DEBUG):
+      logging.debug('[input] all feature names: %s' %
+                    [fc.feature_name for fc in self._feature_configs])
+    for fc, preprocess_fn in self._preprocess_plan:
+      getattr(self, preprocess_fn)(fc, field_dict, parsed_dict)
 
-      else:
-        for input_name in fc.input_names:
-          parsed_dict[input_name] = field_dict[input_name]
-
-    for input_id, input_name in enumerate(self._label_fields):
+    for input_name, label_dim, label_sep in self._label_plan:
       if input_name not in field_dict:
         continue
       if field_dict[input_name].dtype == tf.string:
-        if self._label_dim[input_id] > 1:
-          logging.info('will split labels[%d]=%s' % (input_id, input_name))
-          parsed_dict[input_name] = tf.string_split(
-              field_dict[input_name], self._label_sep[input_id]).values
-          parsed_dict[input_name] = tf.reshape(parsed_dict[input_name],
-                                               [-1, self._label_dim[input_id]])
+        if label_dim > 1:
+          logging.info('will split labels %s' % input_name)
+          # string_split skips the empty value after a trailing separator
+          label_vals = tf.string_split(field_dict[input_name],
+                                       label_sep).values
+          label_vals = tf.reshape(label_vals, [-1, label_dim])
+          parsed_dict[input_name] = tf.strings.to_number(
+              label_vals, tf.float32, name=input_name)
         else:
-          parsed_dict[input_name] = field_dict[input_name]
-        parsed_dict[input_name] = tf.string_to_number(
-            parsed_dict[input_name], tf.float32, name=input_name)
+          parsed_dict[input_name] = tf.strings.to_number(
+              field_dict[input_name], tf.float32, name=input_name)
       else:
         assert field_dict[input_name].dtype in [
             tf.float32, tf.double, tf.int32, tf.int64
@@ -598,6 +437,240 @@ class Input(six.with_metaclass(_meta_type, object)):
             self._data_config.sample_weight]
     return parsed_dict
 
+  def _get_preprocess_fn(self, fc):
+    """Name of the method used to preprocess feature config fc."""
+    input_0 = fc.input_names[0]
+    if fc.feature_type == fc.SequenceFeature:
+      if not fc.boundaries and fc.num_buckets <= 1 and fc.hash_bucket_size <= 0 and \
+          self._data_config.sample_weight != input_0 and \
+          fc.sub_feature_type == fc.RawFeature and fc.raw_input_dim >= 1:
+        return '_preprocess_projected_sequence_feature'
+    elif fc.feature_type == fc.RawFeature:
+      if not fc.boundaries and fc.num_buckets <= 1 and \
+          self._data_config.sample_weight != input_0:
+        return '_preprocess_projected_raw_feature'
+    return self._FEATURE_PREPROCESSORS.get(fc.feature_type,
+                                           '_preprocess_other_feature')
+
+  def _preprocess_tag_feature(self, fc, field_dict, parsed_dict):
+    """Preprocess tag features: split into SparseTensors."""
+    input_0 = fc.input_names[0]
+    field = field_dict[input_0]
+    # Construct the output of TagFeature according to the dimension of field_dict.
+    # When the input field exceeds 2 dimensions, convert TagFeature to 2D output.
+    if len(field.get_shape()) < 2 or field.get_shape()[-1] == 1:
+      if len(field.get_shape()) == 0:
+        field = tf.expand_dims(field, axis=0)
+      elif len(field.get_shape()) == 2:
+        field = tf.squeeze(field, axis=-1)
+      tags = tf.string_split(field, fc.separator)
+      indices, values, dense_shape = tags.indices, tags.values, tags.dense_shape
+      if fc.HasField('kv_separator'):
+        tmp_kvs = tf.string_split(values, fc.kv_separator, skip_empty=False)
+        tmp_kvs = tf.reshape(tmp_kvs.values, [-1, 2])
+        values, tmp_vs = tmp_kvs[:, 0], tmp_kvs[:, 1]
+        tmp_vs = tf.strings.to_number(
+            tmp_vs, tf.float32, name='kv_tag_wgt_str_2_flt_%s' % input_0)
+        input_wgt = input_0 + '_WEIGHT'
+        parsed_dict[input_wgt] = tf.sparse.SparseTensor(
+            indices, tmp_vs, dense_shape)
+        self._appended_fields.append(input_wgt)
+      if not fc.HasField('hash_bucket_size'):
+        values = tf.strings.to_number(
+            values, tf.int32, name='tag_fea_%s' % input_0)
+      parsed_dict[input_0] = tf.sparse.SparseTensor(indices, values,
+                                                    dense_shape)
+      if len(fc.input_names) > 1:
+        input_1 = fc.input_names[1]
+        field = field_dict[input_1]
+        if len(field.get_shape()) == 0:
+          field = tf.expand_dims(field, axis=0)
+        field = tf.string_split(field, fc.separator)
+        field_vals = tf.strings.to_number(
+            field.values, tf.float32, name='tag_wgt_str_2_flt_%s' % input_1)
+        assert_op = tf.assert_equal(
+            tf.shape(field_vals)[0],
+            tf.shape(values)[0],
+            message='tag_feature_kv_size_not_eq_%s' % input_0)
+        with tf.control_dependencies([assert_op]):
+          field = tf.sparse.SparseTensor(field.indices,
+                                         tf.identity(field_vals),
+                                         field.dense_shape)
+        parsed_dict[input_1] = field
+    else:
+      parsed_dict[input_0] = field_dict[input_0]
+      if len(fc.input_names) > 1:
+        input_1 = fc.input_names[1]
+        parsed_dict[input_1] = field_dict[input_1]
+
+  def _preprocess_lookup_feature(self, fc, field_dict, parsed_dict):
+    """Preprocess lookup features."""
+    feature_name = fc.feature_name
+    assert feature_name is not None and feature_name != ''
+    assert len(fc.input_names) == 2
+    parsed_dict[feature_name] = self._lookup_preprocess(fc, field_dict)
+
+  def _preprocess_sequence_feature(self, fc, field_dict, parsed_dict):
+    """Preprocess sequence features."""
+    input_0 = fc.input_names[0]
+    field = field_dict[input_0]
+    sub_feature_type = fc.sub_feature_type
+    # Construct the output of SeqFeature according to the dimension of field_dict.
+    # When the input field exceeds 2 dimensions, convert SeqFeature to 2D output.
+    if len(field.get_shape()) < 2:
+      seq = tf.strings.split(field, fc.separator)
+      indices, values, dense_shape = seq.indices, seq.values, seq.dense_shape
+      if fc.HasField('seq_multi_sep'):
+        multi_vals = tf.string_split(values, fc.seq_multi_sep)
+        # 3 dimensional sparse tensor
+        indices = tf.gather(indices, multi_vals.indices[:, 0])
+        indices = tf.concat([indices, multi_vals.indices[:, 1:]], axis=1)
+        values = multi_vals.values
+        dense_shape = tf.concat([dense_shape, multi_vals.dense_shape[1:]],
+                                axis=0)
+      if (fc.num_buckets > 1 and fc.max_val == fc.min_val):
+        values = tf.strings.to_number(
+            values, tf.int64, name='sequence_str_2_int_%s' % input_0)
+      elif sub_feature_type == fc.RawFeature:
+        values = tf.strings.to_number(
+            values, tf.float32, name='sequence_str_2_float_%s' % input_0)
+      if fc.num_buckets > 1 and fc.max_val > fc.min_val:
+        values = _min_max_normalize(values, fc.min_val, fc.max_val)
+      parsed_dict[input_0] = tf.sparse.SparseTensor(indices, values,
+                                                    dense_shape)
+    else:
+      parsed_dict[input_0] = field
+
+  def _preprocess_projected_sequence_feature(self, fc, field_dict,
+                                             parsed_dict):
+    """Preprocess raw sequence features which are projected to vectors."""
+    self._preprocess_sequence_feature(fc, field_dict, parsed_dict)
+    input_0 = fc.input_names[0]
+    # may need by wide model and deep model to project
+    # raw values to a vector, it maybe better implemented
+    # by a ProjectionColumn later
+    sample_num = parsed_dict[input_0].dense_shape[0]
+    if fc.raw_input_dim == 1:
+      logging.info(
+          'Not set boundaries or num_buckets or hash_bucket_size, %s will process as two dimentsion raw feature'
+          % input_0)
+      dims = [sample_num, fc.sequence_length]
+    else:
+      # for 3 dimension sequence feature input.
+      logging.info(
+          'Not set boundaries or num_buckets or hash_bucket_size, %s will process as three dimentsion raw feature'
+          % input_0)
+      dims = [sample_num, fc.sequence_length, fc.raw_input_dim]
+    parsed_dict[input_0] = tf.scatter_nd(parsed_dict[input_0].indices,
+                                         parsed_dict[input_0].values,
+                                         tf.stack(dims))
+    self._add_raw_projection(input_0, dims, parsed_dict)
+
+  def _preprocess_raw_feature(self, fc, field_dict, parsed_dict):
+    """Preprocess raw features: convert to float and normalize."""
+    input_0 = fc.input_names[0]
+    if field_dict[input_0].dtype == tf.string:
+      if fc.raw_input_dim > 1:
+        tmp_fea = tf.string_split(field_dict[input_0], fc.separator)
+        tmp_vals = tf.strings.to_number(
+            tmp_fea.values,
+            tf.float32,
+            name='multi_raw_fea_to_flt_%s' % input_0)
+        parsed_dict[input_0] = tf.scatter_nd(
+            tmp_fea.indices, tmp_vals,
+            tf.stack([tmp_fea.dense_shape[0], fc.raw_input_dim]))
+      else:
+        parsed_dict[input_0] = tf.strings.to_number(field_dict[input_0],
+                                                    tf.float32)
+    elif field_dict[input_0].dtype in [
+        tf.int32, tf.int64, tf.double, tf.float32
+    ]:
+      parsed_dict[input_0] = tf.cast(field_dict[input_0], tf.float32)
+    else:
+      assert False, 'invalid dtype[%s] for raw feature' % str(
+          field_dict[input_0].dtype)
+    if fc.max_val > fc.min_val:
+      parsed_dict[input_0] = _min_max_normalize(parsed_dict[input_0],
+                                                fc.min_val, fc.max_val)
+
+  def _preprocess_projected_raw_feature(self, fc, field_dict, parsed_dict):
+    """Preprocess raw features which are projected to vectors."""
+    self._preprocess_raw_feature(fc, field_dict, parsed_dict)
+    input_0 = fc.input_names[0]
+    # may need by wide model and deep model to project
+    # raw values to a vector, it maybe better implemented
+    # by a ProjectionColumn later
+    # item fields have more rows than user fields with a negative sampler,
+    # so the batch size is not shared between raw features
+    sample_num = tf.shape(parsed_dict[input_0], out_type=tf.int64)[0]
+    self._add_raw_projection(input_0, [sample_num, fc.raw_input_dim],
+                             parsed_dict)
+
+  def _add_raw_projection(self, input_0, dims, parsed_dict):
+    """Add the projection id and value SparseTensors of a dense raw input.
+
+    Args:
+      input_0: name of the raw input, its dense values are parsed_dict[input_0]
+      dims: dense shape of the values, [sample_num, ...]
+      parsed_dict: the preprocess output dict
+    """
+    proj_id, proj_val = _make_proj_sparse(parsed_dict[input_0], dims)
+    parsed_dict[input_0 + '_raw_proj_id'] = proj_id
+    parsed_dict[input_0 + '_raw_proj_val'] = proj_val
+    self._appended_fields.append(input_0 + '_raw_proj_id')
+    self._appended_fields.append(input_0 + '_raw_proj_val')
+
+  def _preprocess_id_feature(self, fc, field_dict, parsed_dict):
+    """Preprocess id features: convert to string or int."""
+    input_0 = fc.input_names[0]
+    parsed_dict[input_0] = field_dict[input_0]
+    if fc.HasField('hash_bucket_size'):
+      if field_dict[input_0].dtype != tf.string:
+        if field_dict[input_0].dtype in [tf.float32, tf.double]:
+          assert fc.precision > 0, 'it is dangerous to convert float or double to string due to ' \
+                                   'precision problem, it is suggested to convert them into string ' \
+                                   'format during feature generalization before using EasyRec; ' \
+                                   'if you really need to do so, please set precision (the number of ' \
+                                   'decimal digits) carefully.'
+        precision = None
+        if field_dict[input_0].dtype in [tf.float32, tf.double]:
+          if fc.precision > 0:
+            precision = fc.precision
+        # convert to string
+        if 'as_string' in dir(tf.strings):
+          parsed_dict[input_0] = tf.strings.as_string(
+              field_dict[input_0], precision=precision)
+        else:
+          parsed_dict[input_0] = tf.as_string(
+              field_dict[input_0], precision=precision)
+    elif fc.num_buckets > 0:
+      if parsed_dict[input_0].dtype == tf.string:
+        parsed_dict[input_0] = tf.strings.to_number(
+            parsed_dict[input_0], tf.int32, name='%s_str_2_int' % input_0)
+
+  def _preprocess_expr_feature(self, fc, field_dict, parsed_dict):
+    """Preprocess expr features: evaluate the expression."""
+    fea_name = fc.feature_name
+    prefix = "expr_"
+    for input_name in fc.input_names:
+        new_input_name = prefix + input_name
+        if field_dict[input_name].dtype == tf.string:
+            parsed_dict[new_input_name] = tf.strings.to_number(
+                field_dict[input_name], tf.float64, name='%s_str_2_int_for_expr' % new_input_name)
+        elif field_dict[input_name].dtype in [tf.int32, tf.int64, tf.double, tf.float32]:
+            parsed_dict[new_input_name] = tf.cast(field_dict[input_name], tf.float64)
+        else:
+            assert False, 'invalid input dtype[%s] for expr feature' % str(field_dict[input_name].dtype)
+
+    parsed_dict[fea_name] = eval(self._expr_codes[fea_name], globals(),
+                                 {'parsed_dict': parsed_dict})
+    self._appended_fields.append(fea_name)
+
+  def _preprocess_other_feature(self, fc, field_dict, parsed_dict):
+    """Pass through inputs of the other features."""
+    for input_name in fc.input_names:
+      parsed_dict[input_name] = field_dict[input_name]
+
   def _lookup_preprocess(self, fc, field_dict):
     """Preprocess function for lookup features.
 
@@ -609,58 +682,41 @@ class Input(six.with_metaclass(_meta_type, object)):
       output_dict: add { feature_name:SparseTensor} with
           other items similar as field_dict
     """
-    max_sel_num = fc.lookup_max_sel_elem_num
-
-    def _lookup(args, pad=True):
-      one_key, one_map = args[0], args[1]
-      if len(one_map.get_shape()) == 0:
-        one_map = tf.expand_dims(one_map, axis=0)
-      kv_map = tf.string_split(one_map, fc.separator).values
-      kvs = tf.string_split(kv_map, fc.kv_separator)
-      kvs = tf.reshape(kvs.values, [-1, 2], name='kv_split_reshape')
-      keys, vals = kvs[:, 0], kvs[:, 1]
-      sel_ids = tf.where(tf.equal(keys, one_key))
-      sel_ids = tf.squeeze(sel_ids, axis=1)
-      sel_vals = tf.gather(vals, sel_ids)
-      if not pad:
-        return sel_vals
-      n = tf.shape(sel_vals)[0]
-      sel_vals = tf.pad(sel_vals, [[0, max_sel_num - n]])
-      len_msk = tf.sequence_mask(n, max_sel_num)
-      indices = tf.range(max_sel_num, dtype=tf.int64)
-      indices = indices * tf.to_int64(indices < tf.to_int64(n))
-      return sel_vals, len_msk, indices
-
     key_field, map_field = fc.input_names[0], fc.input_names[1]
     key_fields, map_fields = field_dict[key_field], field_dict[map_field]
     if len(key_fields.get_shape()) == 0:
-      vals = _lookup((key_fields, map_fields), False)
-      n = tf.shape(vals)[0]
-      n = tf.to_int64(n)
-      indices_0 = tf.zeros([n], dtype=tf.int64)
-      indices_1 = tf.range(0, n, dtype=tf.int64)
-      indices = [
-          tf.expand_dims(indices_0, axis=1),
-          tf.expand_dims(indices_1, axis=1)
-      ]
-      indices = tf.concat(indices, axis=1)
-      return tf.sparse.SparseTensor(indices, vals, [1, n])
-
-    vals, masks, indices = tf.map_fn(
-        _lookup, [key_fields, map_fields], dtype=(tf.string, tf.bool, tf.int64))
-    batch_size = tf.to_int64(tf.shape(vals)[0])
-    vals = tf.boolean_mask(vals, masks)
-    indices_1 = tf.boolean_mask(indices, masks)
-    indices_0 = tf.range(0, batch_size, dtype=tf.int64)
-    indices_0 = tf.expand_dims(indices_0, axis=1)
-    indices_0 = indices_0 + tf.zeros([1, max_sel_num], dtype=tf.int64)
-    indices_0 = tf.boolean_mask(indices_0, masks)
-    indices = tf.concat(
-        [tf.expand_dims(indices_0, axis=1),
-         tf.expand_dims(indices_1, axis=1)],
-        axis=1)
-    shapes = tf.stack([batch_size, tf.reduce_max(indices_1) + 1])
-    return tf.sparse.SparseTensor(indices, vals, shapes)
+      key_fields = tf.expand_dims(key_fields, axis=0)
+      map_fields = tf.expand_dims(map_fields, axis=0)
+    elif len(key_fields.get_shape()) == 2:
+      # inputs of shape [batch_size, 1]
+      key_fields = tf.reshape(key_fields, [-1])
+      map_fields = tf.reshape(map_fields, [-1])
+
+    # split all maps of the batch at once, instead of one map_fn step per row
+    kv_map = tf.string_split(map_fields, fc.separator)
+    kvs = tf.string_split(kv_map.values, fc.kv_separator)
+    kvs = tf.reshape(kvs.values, [-1, 2], name='kv_split_reshape')
+    keys, vals = kvs[:, 0], kvs[:, 1]
+    row_ids = kv_map.indices[:, 0]
+    sel_msk = tf.equal(keys, tf.gather(key_fields, row_ids))
+    sel_vals = tf.boolean_mask(vals, sel_msk)
+    sel_rows = tf.boolean_mask(row_ids, sel_msk)
+    # selected values are ordered by row, the column of each value is
+    # its rank minus the rank of the first value selected in the same row
+    sel_ranks = tf.range(tf.size(sel_rows, out_type=tf.int64), dtype=tf.int64)
+    sel_cols = sel_ranks - tf.gather(
+        tf.segment_min(sel_ranks, sel_rows), sel_rows)
+    # keep at most lookup_max_sel_elem_num values per row
+    cap_msk = sel_cols < fc.lookup_max_sel_elem_num
+    sel_vals = tf.boolean_mask(sel_vals, cap_msk)
+    sel_rows = tf.boolean_mask(sel_rows, cap_msk)
+    sel_cols = tf.boolean_mask(sel_cols, cap_msk)
+    indices = tf.stack([sel_rows, sel_cols], axis=1)
+    batch_size = tf.cast(tf.shape(key_fields)[0], tf.int64)
+    max_sel_num = tf.reduce_max(
+        tf.concat([sel_cols + 1, tf.zeros([1], dtype=tf.int64)], axis=0))
+    return tf.sparse.SparseTensor(indices, sel_vals,
+                                  tf.stack([batch_size, max_sel_num]))
 
   @abstractmethod
   def _build(self, mode, params):
@@ -669,6 +725,38 @@ class Input(six.with_metaclass(_meta_type, object)):
   def _pre_build(self, mode, params):
     pass
 
+  def _tail_prefetch_size(self):
+    # the buffer is autotuned by tf.data unless prefetch_size is set
+    if self._data_config.HasField('prefetch_size'):
+      return self._prefetch_size
+    return tf.data.experimental.AUTOTUNE
+
+  def _dataset_options(self, mode):
+    """tf.data options of the dataset returned by the input_fn.
+
+    Options missing from the running tf version are skipped. In training,
+    unless data_config.deterministic is set, the parallel interleave and
+    maps may produce elements out of order, so that a slow input file or
+    batch no longer stalls the others; evaluation and prediction keep the
+    input order.
+    """
+    options = tf.data.Options()
+    optimization = options.experimental_optimization
+    for name in [
+        'map_and_batch_fusion', 'noop_elimination', 'shuffle_and_repeat_fusion',
+        'map_fusion', 'map_parallelization', 'parallel_batch'
+    ]:
+      if hasattr(optimization, name):
+        setattr(optimization, name, True)
+    if mode == tf.estimator.ModeKeys.TRAIN and \
+        not self._data_config.deterministic:
+      # renamed to deterministic in tf 2.6
+      if hasattr(options, 'deterministic'):
+        options.deterministic = False
+      elif hasattr(options, 'experimental_deterministic'):
+        options.experimental_deterministic = False
+    return options
+
   def create_input(self, export_config=None):
 
     def _input_fn(mode=None, params=None, config=None):
@@ -692,6 +780,12 @@ class Input(six.with_metaclass(_meta_type, object)):
         # build dataset from self._config.input_path
         self._mode = mode
         dataset = self._build(mode, params)
+        if hasattr(dataset, 'prefetch'):
+          # overlap the last transformations of _build with the train step
+          dataset = dataset.prefetch(buffer_size=self._tail_prefetch_size())
+          # tf.data.Options is not available before tf 1.13
+          if hasattr(tf.data, 'Options'):
+            dataset = dataset.with_options(self._dataset_options(mode))
         return dataset
       elif mode is None:  # serving_input_receiver_fn for export SavedModel
         if export_config.multi_placeholder:
@@ -699,7 +793,8 @@ class Input(six.with_metaclass(_meta_type, object)):
           return tf.estimator.export.ServingInputReceiver(features, inputs)
         else:
           inputs, features = self.create_placeholders(export_config)
-          print("built feature placeholders. features: {}".format(features.keys()))
+          logging.debug('built feature placeholders. features: %s',
+                        list(features.keys()))
           return tf.estimator.export.ServingInputReceiver(features, inputs)
 
     return _input_fn
@@ -1,10 +1,14 @@
 # -*- encoding:utf-8 -*-
 # Copyright (c) Alibaba, Inc. and its affiliates.
 import logging
+import multiprocessing
+import uuid
+from collections import OrderedDict
 
 import tensorflow as tf
 
 from easy_rec.python.input.input import Input
+from easy_rec.python.protos.dataset_pb2 import DatasetConfig
 from easy_rec.python.utils.input_utils import string_to_number
 
 try:
@@ -13,6 +17,32 @@ except Exception:
   pass
 
 
+def _decode_default(ftype):
+  """decode_csv default of a rtp feature column of type ftype.
+
+  Int columns are decoded as double like in string_to_number, as fg may
+  output them as floats, bool columns are decoded as strings. Numeric
+  defaults are empty, so an empty numeric value is an error as in
+  string_to_number.
+  """
+  if ftype in [DatasetConfig.INT32, DatasetConfig.INT64, DatasetConfig.DOUBLE]:
+    return tf.constant([], dtype=tf.float64)
+  elif ftype == DatasetConfig.FLOAT:
+    return tf.constant([], dtype=tf.float32)
+  return ''
+
+
+def _cast_decoded(field, ftype):
+  """Convert a column decoded with _decode_default to its final type."""
+  if ftype == DatasetConfig.INT32:
+    return tf.cast(field, tf.int32)
+  elif ftype == DatasetConfig.INT64:
+    return tf.cast(field, tf.int64)
+  elif ftype == DatasetConfig.BOOL:
+    return tf.logical_or(tf.equal(field, 'True'), tf.equal(field, 'true'))
+  return field
+
+
 class OdpsRTPInput(Input):
   """RTPInput for parsing rtp fg new input format on odps.
 
@@ -27,6 +57,10 @@ class OdpsRTPInput(Input):
      selected columns are labels
   """
 
+  # whether the rows could be parsed in batches, unbatched and shuffled,
+  # which needs _parse_table to output dense tensors only
+  _PARSE_BEFORE_SHUFFLE = True
+
   def __init__(self,
                data_config,
                feature_config,
@@ -37,53 +71,88 @@ class OdpsRTPInput(Input):
                                        task_index, task_num)
     logging.info('input_fields: %s label_fields: %s' %
                  (','.join(self._input_fields), ','.join(self._label_fields)))
+    # comma separated table paths, input_path is None on export
+    if self._input_path is not None and type(self._input_path) != list:
+      self._input_path = self._input_path.split(',')
+    # names and types of the fields
+    # in the generated feature column, labels excluded
+    label_fields = set(self._label_fields)
+    self._feature_fields = [
+        x for x in self._input_fields if x not in label_fields
+    ]
+    self._feature_types = [
+        t for x, t in zip(self._input_fields, self._input_field_types)
+        if x not in label_fields
+    ]
+    # positions of the effective fields in the generated feature column
+    feature_fids = {}
+    for fid, x in enumerate(self._feature_fields):
+      feature_fids.setdefault(x, fid)
+    self._feature_effective_fids = [
+        feature_fids[x] for x in self._effective_fields
+    ]
+    # TableRecordDataset defaults of the label columns
+    # and of the generated feature column
+    self._label_record_defaults = [
+        self.get_type_defaults(t, v)
+        for x, t, v in zip(self._input_fields, self._input_field_types,
+                           self._input_field_defaults)
+        if x in label_fields
+    ]
+    self._feature_record_default = self._data_config.separator.join([
+        str(self.get_type_defaults(t, v))
+        for x, t, v in zip(self._input_fields, self._input_field_types,
+                           self._input_field_defaults)
+        if x not in label_fields
+    ])
 
   def _parse_table(self, *fields):
-    fields = list(fields)
-    labels = fields[:-1]
+    # the label columns come first,
+    # the last column is the generated feature column
+    features_col = fields[-1]
 
     # only for features, labels excluded
-    record_types = [
-        t for x, t in zip(self._input_fields, self._input_field_types)
-        if x not in self._label_fields
-    ]
-    # assume that the last field is the generated feature column
-    print('field_delim = %s, input_field_name = %d' %
-          (self._data_config.separator, len(record_types)))
-    fields = tf.string_split(
-        fields[-1], self._data_config.separator, skip_empty=False)
-    tmp_fields = tf.reshape(fields.values, [-1, len(record_types)])
-    fields = []
-    for i in range(len(record_types)):
-      field = string_to_number(tmp_fields[:, i], record_types[i], i)
-      fields.append(field)
-
-    field_keys = [x for x in self._input_fields if x not in self._label_fields]
-    effective_fids = [field_keys.index(x) for x in self._effective_fields]
-    inputs = {field_keys[x]: fields[x] for x in effective_fids}
-
-    for x in range(len(self._label_fields)):
-      inputs[self._label_fields[x]] = labels[x]
+    record_types = self._feature_types
+    logging.debug('field_delim = %s, input_field_name = %d',
+                  self._data_config.separator, len(record_types))
+    if len(self._data_config.separator) == 1:
+      # all columns of the batch are parsed by one decode_csv op
+      feature_vals = tf.decode_csv(
+          features_col,
+          record_defaults=[_decode_default(t) for t in record_types],
+          field_delim=self._data_config.separator,
+          use_quote_delim=False,
+          name='decode_rtp_features')
+      feature_vals = [
+          _cast_decoded(field, t)
+          for field, t in zip(feature_vals, record_types)
+      ]
+    else:
+      tmp_fields = tf.string_split(
+          features_col, self._data_config.separator, skip_empty=False)
+      tmp_fields = tf.reshape(tmp_fields.values, [-1, len(record_types)])
+      # convert the columns of the same type together
+      type_fids = OrderedDict()
+      for fid, ftype in enumerate(record_types):
+        type_fids.setdefault(ftype, []).append(fid)
+      feature_vals = [None] * len(record_types)
+      for ftype, fids in type_fids.items():
+        tmp_vals = string_to_number(
+            tf.gather(tmp_fields, fids, axis=1), ftype, 'type_%d' % ftype)
+        for fid, field in zip(fids, tf.unstack(tmp_vals, axis=1)):
+          feature_vals[fid] = field
+
+    inputs = {
+        self._feature_fields[x]: feature_vals[x]
+        for x in self._feature_effective_fids
+    }
+    inputs.update(zip(self._label_fields, fields[:-1]))
     return inputs
 
   def _build(self, mode, params):
-    if type(self._input_path) != list:
-      self._input_path = [x for x in self._input_path.split(',')]
-
-    record_defaults = [
-        self.get_type_defaults(t, v)
-        for x, t, v in zip(self._input_fields, self._input_field_types,
-                           self._input_field_defaults)
-        if x in self._label_fields
+    record_defaults = self._label_record_defaults + [
+        self._feature_record_default
     ]
-    # the actual features are in one single column
-    record_defaults.append(
-        self._data_config.separator.join([
-            str(self.get_type_defaults(t, v))
-            for x, t, v in zip(self._input_fields, self._input_field_types,
-                               self._input_field_defaults)
-            if x not in self._label_fields
-        ]))
     selected_cols = self._data_config.selected_cols \
         if self._data_config.selected_cols else None
 
@@ -101,6 +170,21 @@ class OdpsRTPInput(Input):
           que_paths,
           record_defaults=record_defaults,
           selected_cols=selected_cols)
+    elif len(self._input_path) > 1:
+      # read the slices of the tables in parallel
+      def _read_table(table_path):
+        return tf.data.TableRecordDataset(
+            table_path,
+            record_defaults=record_defaults,
+            selected_cols=selected_cols,
+            slice_id=self._task_index,
+            slice_count=self._task_num)
+
+      dataset = tf.data.Dataset.from_tensor_slices(self._input_path)
+      dataset = dataset.interleave(
+          _read_table,
+          cycle_length=len(self._input_path),
+          num_parallel_calls=len(self._input_path))
     else:
       dataset = tf.data.TableRecordDataset(
           self._input_path,
@@ -109,33 +193,93 @@ class OdpsRTPInput(Input):
           slice_id=self._task_index,
           slice_count=self._task_num)
 
-    if mode == tf.estimator.ModeKeys.TRAIN:
-      if self._data_config.shuffle:
-        dataset = dataset.shuffle(
-            self._data_config.shuffle_buffer_size,
-            seed=2020,
-            reshuffle_each_iteration=True)
-      dataset = dataset.repeat(self.num_epochs)
+    # the parallelism is autotuned by tf.data unless num_parallel_calls is set
+    if self._data_config.HasField('num_parallel_calls'):
+      num_parallel_calls = self._data_config.num_parallel_calls
     else:
-      dataset = dataset.repeat(1)
+      num_parallel_calls = tf.data.experimental.AUTOTUNE
 
-    dataset = dataset.batch(batch_size=self._data_config.batch_size)
+    def _split_features(inputs):
+      # preprocess is necessary to transform data
+      # so that they could be feed into FeatureColumns
+      inputs = self._preprocess(inputs)
+      if mode != tf.estimator.ModeKeys.PREDICT:
+        return self._get_features(inputs), self._get_labels(inputs)
+      return self._get_features(inputs)
 
-    dataset = dataset.map(
-        self._parse_table,
-        num_parallel_calls=self._data_config.num_parallel_calls)
+    def _parse_batch(*fields):
+      return _split_features(self._parse_table(*fields))
 
-    # preprocess is necessary to transform data
-    # so that they could be feed into FeatureColumns
-    dataset = dataset.map(
-        map_func=self._preprocess,
-        num_parallel_calls=self._data_config.num_parallel_calls)
-
-    dataset = dataset.prefetch(buffer_size=self._prefetch_size)
-
-    if mode != tf.estimator.ModeKeys.PREDICT:
-      dataset = dataset.map(lambda x:
-                            (self._get_features(x), self._get_labels(x)))
+    batch_size = self._data_config.batch_size
+    parse_before_shuffle = self._PARSE_BEFORE_SHUFFLE and \
+        mode == tf.estimator.ModeKeys.TRAIN and \
+        (self._data_config.shuffle or self._data_config.cache_parsed)
+    if parse_before_shuffle:
+      # the rows are shuffled after parsing, the shuffle buffer then holds
+      # numeric columns instead of the long feature strings. with
+      # cache_parsed, the table is parsed once and the later epochs read
+      # the parsed rows from the cache.
+      dataset = dataset.batch(batch_size=batch_size)
+      dataset = dataset.map(
+          self._parse_table, num_parallel_calls=num_parallel_calls)
+      if self._data_config.cache_parsed:
+        dataset = dataset.cache(self._parsed_cache_path())
+      dataset = dataset.apply(tf.data.experimental.unbatch())
+      dataset = self._shuffle_and_repeat(dataset)
+      dataset = dataset.batch(batch_size=batch_size)
+      dataset = dataset.map(
+          _split_features, num_parallel_calls=num_parallel_calls)
     else:
-      dataset = dataset.map(lambda x: (self._get_features(x)))
+      # eval and predict read the data once
+      if mode == tf.estimator.ModeKeys.TRAIN:
+        if self._data_config.cache_parsed:
+          logging.warning('cache_parsed is not supported by %s' %
+                          type(self).__name__)
+        dataset = self._shuffle_and_repeat(dataset)
+      dataset = dataset.batch(batch_size=batch_size)
+      # parse, preprocess and split into features and labels in one map
+      dataset = dataset.map(_parse_batch, num_parallel_calls=num_parallel_calls)
+
+    # the tail prefetch and the dataset options are added by
+    # Input.create_input
     return dataset
+
+  def _parsed_cache_path(self):
+    """File prefix of the parsed rows cache, '' for an in memory cache.
+
+    Each worker caches its own slice, and a cache left by an earlier run
+    may come from another table, so the prefix is suffixed with the task
+    index and an id unique to this run.
+    """
+    if not self._data_config.cache_path:
+      return ''
+    return '%s_%d_%s' % (self._data_config.cache_path, self._task_index,
+                         uuid.uuid4().hex)
+
+  def _shuffle_and_repeat(self, dataset):
+    if self._data_config.shuffle:
+      # reshuffles every epoch, like shuffle(reshuffle_each_iteration=True)
+      return dataset.apply(
+          tf.data.experimental.shuffle_and_repeat(
+              self._data_config.shuffle_buffer_size,
+              count=self.num_epochs,
+              seed=2020))
+    return dataset.repeat(self.num_epochs)
+
+  def _dataset_options(self, mode):
+    """Add the buffer autotuning and threading options of the pipeline.
+
+    _parse_table works on whole batches, so batching stays in front of the
+    maps.
+    """
+    options = super(OdpsRTPInput, self)._dataset_options(mode)
+    optimization = options.experimental_optimization
+    if hasattr(optimization, 'autotune_buffers'):
+      optimization.autotune_buffers = True
+    # threading is named experimental_threading before tf 2.3
+    threading = getattr(options, 'threading', None) or \
+        getattr(options, 'experimental_threading', None)
+    if threading is not None:
+      threading.private_threadpool_size = multiprocessing.cpu_count()
+      threading.max_intra_op_parallelism = 1
+    return options
@@ -27,6 +27,9 @@ class OdpsRTPInputV2(OdpsRTPInput):
      selected columns are labels
   """
 
+  # rtp_fg may parse features to sparse tensors, which could not be unbatched
+  _PARSE_BEFORE_SHUFFLE = False
+
   def __init__(self,
                data_config,
                feature_config,
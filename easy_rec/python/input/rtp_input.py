@@ -170,8 +170,6 @@ class RTPInput(Input):
         map_func=self._preprocess,
         num_parallel_calls=self._data_config.num_parallel_calls)
 
-    dataset = dataset.prefetch(buffer_size=self._prefetch_size)
-
     if mode != tf.estimator.ModeKeys.PREDICT:
       dataset = dataset.map(lambda x:
                             (self._get_features(x), self._get_labels(x)))
@@ -30,10 +30,11 @@ class TFRecordInput(Input):
           dtype=t, shape=1, default_value=d)
 
   def _parse_tfrecord(self, example):
+    # example is a batch of serialized records, parse them in one op
     try:
-      inputs = tf.parse_single_example(example, features=self.feature_desc)
+      inputs = tf.parse_example(example, features=self.feature_desc)
     except AttributeError:
-      inputs = tf.io.parse_single_example(example, features=self.feature_desc)
+      inputs = tf.io.parse_example(example, features=self.feature_desc)
     return inputs
 
   def _build(self, mode, params):
@@ -71,15 +72,13 @@ class TFRecordInput(Input):
           file_paths, compression_type=data_compression_type)
       dataset = dataset.repeat(1)
 
+    dataset = dataset.batch(self._data_config.batch_size)
     dataset = dataset.map(
         self._parse_tfrecord, num_parallel_calls=num_parallel_calls)
-    dataset = dataset.batch(self._data_config.batch_size)
     dataset = dataset.prefetch(buffer_size=self._prefetch_size)
     dataset = dataset.map(
         map_func=self._preprocess, num_parallel_calls=num_parallel_calls)
 
-    dataset = dataset.prefetch(buffer_size=self._prefetch_size)
-
     if mode != tf.estimator.ModeKeys.PREDICT:
       dataset = dataset.map(lambda x:
                             (self._get_features(x), self._get_labels(x)))
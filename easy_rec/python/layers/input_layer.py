@@ -7,7 +7,7 @@ import tensorflow as tf
 
 from easy_rec.python.compat import regularizers
 from easy_rec.python.compat.feature_column import feature_column
-from easy_rec.python.feature_column.feature_column import FeatureColumnParser
+from easy_rec.python.feature_column.feature_column import get_feature_column_parser  # NOQA
 from easy_rec.python.feature_column.feature_group import FeatureGroup
 from easy_rec.python.layers import dnn
 from easy_rec.python.layers import seq_input_layer
@@ -55,7 +55,7 @@ class InputLayer(object):
           self._seq_feature_groups_config,
           use_embedding_variable=use_embedding_variable)
     wide_and_deep_dict = self.get_wide_deep_dict()
-    self._fc_parser = FeatureColumnParser(
+    self._fc_parser = get_feature_column_parser(
         feature_configs,
         wide_and_deep_dict,
         wide_output_dim,
@@ -6,7 +6,7 @@ import logging
 import tensorflow as tf
 
 from easy_rec.python.compat.feature_column import feature_column
-from easy_rec.python.feature_column.feature_column import FeatureColumnParser
+from easy_rec.python.feature_column.feature_column import get_feature_column_parser  # NOQA
 from easy_rec.python.protos.feature_config_pb2 import WideOrDeep
 
 if tf.__version__ >= '2.0':
@@ -23,7 +23,7 @@ class SeqInputLayer(object):
         x.group_name: x for x in feature_groups_config
     }
     wide_and_deep_dict = self.get_wide_deep_dict()
-    self._fc_parser = FeatureColumnParser(
+    self._fc_parser = get_feature_column_parser(
         feature_configs,
         wide_and_deep_dict,
         use_embedding_variable=use_embedding_variable)
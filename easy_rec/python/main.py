@@ -5,14 +5,25 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import fnmatch
+import hashlib
 import json
 import logging
 import math
+import operator
 import os
+import uuid
+from multiprocessing.pool import ThreadPool
 
 import six
 import tensorflow as tf
 from tensorflow.core.protobuf import saved_model_pb2
+from tensorflow.python.framework.ops import device
+from tensorflow.python.training import server_lib
+from tensorflow.python.training.device_setter import replica_device_setter
+from tensorflow.python.training.monitored_session import ChiefSessionCreator
+from tensorflow.python.training.monitored_session import MonitoredSession
+from tensorflow.python.training.monitored_session import WorkerSessionCreator
 
 import easy_rec
 from easy_rec.python.builders import strategy_builder
@@ -20,11 +31,13 @@ from easy_rec.python.compat import exporter
 from easy_rec.python.input.input import Input
 from easy_rec.python.model.easy_rec_estimator import EasyRecEstimator
 from easy_rec.python.model.easy_rec_model import EasyRecModel
+from easy_rec.python.protos.dataset_pb2 import DatasetConfig
 from easy_rec.python.protos.train_pb2 import DistributionStrategy
 from easy_rec.python.utils import config_util
 from easy_rec.python.utils import estimator_utils
 from easy_rec.python.utils import fg_util
 from easy_rec.python.utils import load_class
+from easy_rec.python.utils import proto_util
 from easy_rec.python.utils.export_big_model import export_big_model
 from easy_rec.python.utils.export_big_model import export_big_model_to_oss
 
@@ -51,6 +64,21 @@ FinalExporter = exporter.FinalExporter
 LatestExporter = exporter.LatestExporter
 BestExporter = exporter.BestExporter
 
+# input_type enum value => name of the Input subclass
+_INPUT_CLASS_NAMES = {y: x for x, y in DatasetConfig.InputType.items()}
+
+# input config digest => input_fn, so that the Input object and its
+# precomputed parsing plan are reused when the same input is built again,
+# such as the eval input of evaluate called in a loop
+_INPUT_FN_CACHE_SIZE = 16
+_input_fn_cache = {}
+
+# oneof train_path / eval_path fields which are passed as config objects
+_INPUT_OBJECT_NAMES = frozenset([
+    'kafka_train_input', 'kafka_eval_input', 'datahub_train_input',
+    'datahub_eval_input', 'hive_train_input', 'hive_eval_input'
+])
+
 
 def _get_input_fn(data_config,
                   feature_configs,
@@ -69,11 +97,17 @@ def _get_input_fn(data_config,
   Returns:
     subclass of Input
   """
-  input_class_map = {y: x for x, y in data_config.InputType.items()}
-  input_cls_name = input_class_map[data_config.input_type]
+  task_id, task_num = estimator_utils.get_task_index_and_num()
+  cache_key = (_input_config_digest(data_config, feature_configs, data_path,
+                                    export_config), task_id, task_num,
+               repr(sorted(kwargs.items())))
+  input_fn = _input_fn_cache.get(cache_key)
+  if input_fn is not None:
+    return input_fn
+
+  input_cls_name = _INPUT_CLASS_NAMES[data_config.input_type]
   input_class = Input.create_class(input_cls_name)
 
-  task_id, task_num = estimator_utils.get_task_index_and_num()
   input_obj = input_class(
       data_config,
       feature_configs,
@@ -82,9 +116,29 @@ def _get_input_fn(data_config,
       task_num=task_num,
       **kwargs)
   input_fn = input_obj.create_input(export_config)
+  if len(_input_fn_cache) >= _INPUT_FN_CACHE_SIZE:
+    _input_fn_cache.clear()
+  _input_fn_cache[cache_key] = input_fn
   return input_fn
 
 
+def _input_config_digest(*configs):
+  digest = hashlib.md5()
+  for config in configs:
+    if hasattr(config, 'SerializeToString'):
+      config_bytes = config.SerializeToString()
+    elif isinstance(config, (list, tuple)) or hasattr(config, 'MergeFrom'):
+      # repeated FeatureConfig fields
+      config_bytes = b''.join(
+          _input_config_digest(x).encode('utf-8') for x in config)
+    else:
+      config_bytes = str(config).encode('utf-8')
+    # prefix the length so that different configs never join to the same bytes
+    digest.update(('%d:' % len(config_bytes)).encode('utf-8'))
+    digest.update(config_bytes)
+  return digest.hexdigest()
+
+
 def _create_estimator(pipeline_config, distribution=None, params={}):
   model_config = pipeline_config.model_config
   train_config = pipeline_config.train_config
@@ -125,24 +179,92 @@ def _create_estimator(pipeline_config, distribution=None, params={}):
   return estimator, run_config
 
 
-def _create_eval_export_spec(pipeline_config, eval_data):
+def _get_input_fn_kwargs(pipeline_config):
+  input_fn_kwargs = {}
+  data_config = pipeline_config.data_config
+  if data_config.input_type == data_config.InputType.OdpsRTPInputV2:
+    input_fn_kwargs['fg_json_path'] = pipeline_config.fg_json_path
+  return input_fn_kwargs
+
+
+def _cache_input_fn(input_fn, model_dir):
+  """Cache the dataset of input_fn into files under model_dir.
+
+  The cache files are named by the task and an id unique to this run, so a
+  rerun on the same input path with new data does not read a stale cache,
+  and a partial cache or lockfile left by an interrupted run is never
+  reused. Cache files of previous runs of the same task are removed when
+  the task first evaluates.
+  """
+  _, task_type, task_index = estimator_utils.parse_tf_config()
+  cache_prefix = os.path.join(model_dir,
+                              'dataset_cache_%s_%d_' % (task_type, task_index))
+  run_id = uuid.uuid4().hex
+  stale_removed = []
+
+  def _cached_input_fn(mode=None, params=None, config=None):
+    dataset = input_fn(mode=mode, params=params, config=config)
+    if not hasattr(dataset, 'cache'):
+      # inputs such as OdpsInput return tensors instead of a dataset
+      return dataset
+    if not stale_removed:
+      for stale_path in tf.gfile.Glob(cache_prefix + '*'):
+        logging.info('remove stale dataset cache: %s' % stale_path)
+        tf.gfile.Remove(stale_path)
+      stale_removed.append(True)
+    dataset = dataset.cache('%s%s_%s' % (cache_prefix, run_id, mode))
+    return dataset.prefetch(buffer_size=tf.data.experimental.AUTOTUNE)
+
+  return _cached_input_fn
+
+
+def _create_eval_spec(pipeline_config,
+                      eval_data,
+                      exporters=None,
+                      cache_eval_dataset=False):
+  """Build the EvalSpec, exporters are only needed by train_and_evaluate.
+
+  cache_eval_dataset is set by the evaluation paths, so that predict does
+  not cache its input.
+  """
   data_config = pipeline_config.data_config
   # feature_configs = pipeline_config.feature_configs
   feature_configs = config_util.get_compatible_feature_configs(pipeline_config)
   eval_config = pipeline_config.eval_config
-  export_config = pipeline_config.export_config
   if eval_config.num_examples > 0:
     eval_steps = int(
         math.ceil(float(eval_config.num_examples) / data_config.batch_size))
-    logging.info('eval_steps = %d' % eval_steps)
+    logging.info('eval_steps = %d', eval_steps)
   else:
     eval_steps = None
-  input_fn_kwargs = {}
-  if data_config.input_type == data_config.InputType.OdpsRTPInputV2:
-    input_fn_kwargs['fg_json_path'] = pipeline_config.fg_json_path
-  # create eval input
+  # set throttle_secs to a small number, so that we can control evaluation
+  # interval steps by checkpoint saving steps
+  eval_input_fn = _get_input_fn(data_config, feature_configs, eval_data,
+                                **_get_input_fn_kwargs(pipeline_config))
+  if cache_eval_dataset and eval_config.cache_eval_dataset:
+    if eval_steps is None:
+      eval_input_fn = _cache_input_fn(eval_input_fn,
+                                      pipeline_config.model_dir)
+    else:
+      logging.warning('cache_eval_dataset is ignored as num_examples is set')
+  eval_spec = tf.estimator.EvalSpec(
+      name='val',
+      input_fn=eval_input_fn,
+      steps=eval_steps,
+      throttle_secs=10,
+      exporters=exporters)
+  return eval_spec
+
+
+def _create_eval_export_spec(pipeline_config, eval_data):
+  data_config = pipeline_config.data_config
+  # feature_configs = pipeline_config.feature_configs
+  feature_configs = config_util.get_compatible_feature_configs(pipeline_config)
+  export_config = pipeline_config.export_config
+  # create export input
   export_input_fn = _get_input_fn(data_config, feature_configs, None,
-                                  export_config, **input_fn_kwargs)
+                                  export_config,
+                                  **_get_input_fn_kwargs(pipeline_config))
   if export_config.exporter_type == 'final':
     exporters = [
         FinalExporter(name='final', serving_input_receiver_fn=export_input_fn)
@@ -156,18 +278,20 @@ def _create_eval_export_spec(pipeline_config, eval_data):
     ]
   elif export_config.exporter_type == 'best':
     logging.info(
-        'will use BestExporter, metric is %s, the bigger the better: %d' %
-        (export_config.best_exporter_metric, export_config.metric_bigger))
+        'will use BestExporter, metric is %s, the bigger the better: %d',
+        export_config.best_exporter_metric, export_config.metric_bigger)
+
+    metric_key = export_config.best_exporter_metric
+    if export_config.metric_bigger:
+      metric_better = operator.lt
+    else:
+      metric_better = operator.gt
 
     def _metric_cmp_fn(best_eval_result, current_eval_result):
-      logging.info('metric: best = %s current = %s' %
-                   (str(best_eval_result), str(current_eval_result)))
-      if export_config.metric_bigger:
-        return (best_eval_result[export_config.best_exporter_metric] <
-                current_eval_result[export_config.best_exporter_metric])
-      else:
-        return (best_eval_result[export_config.best_exporter_metric] >
-                current_eval_result[export_config.best_exporter_metric])
+      logging.info('metric: best = %s current = %s', best_eval_result,
+                   current_eval_result)
+      return metric_better(best_eval_result[metric_key],
+                           current_eval_result[metric_key])
 
     exporters = [
         BestExporter(
@@ -181,46 +305,44 @@ def _create_eval_export_spec(pipeline_config, eval_data):
   else:
     raise ValueError('Unknown exporter type %s' % export_config.exporter_type)
 
-  # set throttle_secs to a small number, so that we can control evaluation
-  # interval steps by checkpoint saving steps
-  eval_input_fn = _get_input_fn(data_config, feature_configs, eval_data,
-                                **input_fn_kwargs)
-  eval_spec = tf.estimator.EvalSpec(
-      name='val',
-      input_fn=eval_input_fn,
-      steps=eval_steps,
-      throttle_secs=10,
-      exporters=exporters)
-  return eval_spec
+  return _create_eval_spec(
+      pipeline_config, eval_data, exporters, cache_eval_dataset=True)
 
 
 def _check_model_dir(model_dir, continue_train):
-  if not continue_train:
-    if not gfile.IsDirectory(model_dir):
-      gfile.MakeDirs(model_dir)
-    else:
-      assert len(gfile.Glob(model_dir + '/model.ckpt-*.meta')) == 0, \
-          'model_dir[=%s] already exists and not empty(if you ' \
-          'want to continue train on current model_dir please ' \
-          'delete dir %s or specify --continue_train[internal use only])' % (
-              model_dir, model_dir)
-  else:
-    if not gfile.IsDirectory(model_dir):
-      logging.info('%s does not exists, create it automatically' % model_dir)
-      gfile.MakeDirs(model_dir)
+  if continue_train:
+    # MakeDirs does nothing if model_dir exists
+    gfile.MakeDirs(model_dir)
+    return
+  # listing a missing prefix on oss/hdfs may return an empty list instead
+  # of raising, so the existence is checked explicitly
+  if not gfile.IsDirectory(model_dir):
+    # just created, no need to look for checkpoints
+    gfile.MakeDirs(model_dir)
+    return
+  # list model_dir instead of Glob
+  model_dir_files = gfile.ListDirectory(model_dir)
+  ckpt_metas = fnmatch.filter(model_dir_files, 'model.ckpt-*.meta')
+  assert len(ckpt_metas) == 0, \
+      'model_dir[=%s] already exists and not empty(if you ' \
+      'want to continue train on current model_dir please ' \
+      'delete dir %s or specify --continue_train[internal use only])' % (
+          model_dir, model_dir)
 
 
 def _get_ckpt_path(pipeline_config, checkpoint_path):
   if checkpoint_path != '' and checkpoint_path is not None:
-    ckpt_path = checkpoint_path
-  elif gfile.IsDirectory(pipeline_config.model_dir):
-    ckpt_path = tf.train.latest_checkpoint(pipeline_config.model_dir)
-    logging.info('checkpoint_path is not specified, '
-                 'will use latest checkpoint %s from %s' %
-                 (ckpt_path, pipeline_config.model_dir))
-  else:
-    assert False, 'pipeline_config.model_dir(%s) does not exist' \
-                  % pipeline_config.model_dir
+    return checkpoint_path
+  # latest_checkpoint returns None for a missing model_dir, so model_dir
+  # only needs to be checked when no checkpoint is found
+  ckpt_path = tf.train.latest_checkpoint(pipeline_config.model_dir)
+  if ckpt_path is None:
+    assert gfile.IsDirectory(pipeline_config.model_dir), \
+        'pipeline_config.model_dir(%s) does not exist' \
+        % pipeline_config.model_dir
+  logging.info('checkpoint_path is not specified, '
+               'will use latest checkpoint %s from %s', ckpt_path,
+               pipeline_config.model_dir)
   return ckpt_path
 
 
@@ -255,15 +377,8 @@ def _get_input_object_by_name(pipeline_config, worker_type):
   """
   input_type = "{}_path".format(worker_type)
   input_name = pipeline_config.WhichOneof(input_type)
-  _dict = {"kafka_train_input": pipeline_config.kafka_train_input,
-           "kafka_eval_input": pipeline_config.kafka_eval_input,
-           "datahub_train_input": pipeline_config.datahub_train_input,
-           "datahub_eval_input": pipeline_config.datahub_eval_input,
-           "hive_train_input": pipeline_config.hive_train_input,
-           "hive_eval_input": pipeline_config.hive_eval_input
-           }
-  if input_name in _dict:
-    return _dict[input_name]
+  if input_name in _INPUT_OBJECT_NAMES:
+    return getattr(pipeline_config, input_name)
 
   if worker_type == "train":
     return pipeline_config.train_input_path
@@ -271,6 +386,33 @@ def _get_input_object_by_name(pipeline_config, worker_type):
     return pipeline_config.eval_input_path
 
 
+def _write_chief_files(pipeline_config, version_file, master_stat_file):
+  """Save the startup files of the chief into model_dir.
+
+  The files are independent, they are written concurrently as each one
+  is a round trip on remote filesystems such as OSS and HDFS.
+  """
+
+  def _save_config():
+    config_util.save_pipeline_config(pipeline_config, pipeline_config.model_dir)
+
+  def _write_version():
+    with gfile.GFile(version_file, 'w') as f:
+      f.write(easy_rec.__version__ + '\n')
+
+  def _remove_master_stat():
+    if gfile.Exists(master_stat_file):
+      gfile.Remove(master_stat_file)
+
+  pool = ThreadPool(3)
+  try:
+    pool.map(lambda write_fn: write_fn(),
+             [_save_config, _write_version, _remove_master_stat])
+  finally:
+    pool.close()
+    pool.join()
+
+
 def _train_and_evaluate_impl(pipeline_config, continue_train=False):
   train_config = pipeline_config.train_config
   data_config = pipeline_config.data_config
@@ -280,8 +422,8 @@ def _train_and_evaluate_impl(pipeline_config, continue_train=False):
   if train_config.train_distribute != DistributionStrategy.NoStrategy\
       and train_config.sync_replicas:
     logging.warning(
-        'will set sync_replicas to False, because train_distribute[%s] != NoStrategy'
-        % pipeline_config.train_config.train_distribute)
+        'will set sync_replicas to False, because train_distribute[%s] != NoStrategy',
+        pipeline_config.train_config.train_distribute)
     pipeline_config.train_config.sync_replicas = False
 
   train_data = _get_input_object_by_name(pipeline_config, 'train')
@@ -295,22 +437,16 @@ def _train_and_evaluate_impl(pipeline_config, continue_train=False):
   version_file = os.path.join(pipeline_config.model_dir, 'version')
   if estimator_utils.is_chief():
     _check_model_dir(pipeline_config.model_dir, continue_train)
-    config_util.save_pipeline_config(pipeline_config, pipeline_config.model_dir)
-    with gfile.GFile(version_file, 'w') as f:
-      f.write(easy_rec.__version__ + '\n')
-    if gfile.Exists(master_stat_file):
-      gfile.Remove(master_stat_file)
+    _write_chief_files(pipeline_config, version_file, master_stat_file)
 
   train_steps = pipeline_config.train_config.num_steps
   if train_steps <= 0:
     train_steps = None
     logging.warn('will train INFINITE number of steps')
   else:
-    logging.info('train_steps = %d' % train_steps)
+    logging.info('train_steps = %d', train_steps)
 
-  input_fn_kwargs = {}
-  if data_config.input_type == data_config.InputType.OdpsRTPInputV2:
-    input_fn_kwargs['fg_json_path'] = pipeline_config.fg_json_path
+  input_fn_kwargs = _get_input_fn_kwargs(pipeline_config)
 
   # create train input
   train_input_fn = _get_input_fn(data_config, feature_configs, train_data,
@@ -325,6 +461,48 @@ def _train_and_evaluate_impl(pipeline_config, continue_train=False):
   logging.info('Train and evaluate finish')
 
 
+def _write_eval_result(eval_result_file, eval_result, indent=None):
+  # skip binary data, such as summaries, and convert numpy values
+  # to python numbers
+  result_to_write = {
+      key: val.item()
+      for key, val in six.iteritems(eval_result)
+      if not isinstance(val, six.binary_type)
+  }
+  with gfile.GFile(eval_result_file, 'w') as ofile:
+    json.dump(result_to_write, ofile, indent=indent, sort_keys=True)
+
+
+def _start_eval_server(job_names):
+  """Start the tf server of this task for evaluating with parameter servers.
+
+  The cluster is defined by TF_CONFIG, ps tasks serve until they are killed.
+
+  Args:
+    job_names: jobs which run the evaluation, such as master and worker
+
+  Returns:
+    (server, cluster, job_name, task_index), all None if the task does not
+    evaluate with parameter servers
+  """
+  if 'TF_CONFIG' not in os.environ:
+    return None, None, None, None
+  tf_config = estimator_utils.chief_to_master()
+  job_name = tf_config['task']['type']
+  task_index = tf_config['task'].get('index', 0)
+  if job_name == 'ps':
+    cluster = tf.train.ClusterSpec(tf_config['cluster'])
+    server = server_lib.Server(cluster, job_name='ps', task_index=task_index)
+    server.join()
+  elif job_name in job_names and 'ps' in tf_config['cluster']:
+    cluster = tf.train.ClusterSpec(tf_config['cluster'])
+    server = server_lib.Server(
+        cluster, job_name=job_name, task_index=task_index)
+    print('server_target = %s' % server.target)
+    return server, cluster, job_name, task_index
+  return None, None, None, None
+
+
 def evaluate(pipeline_config,
              eval_checkpoint_path='',
              eval_data_path=None,
@@ -355,37 +533,23 @@ def evaluate(pipeline_config,
   if pipeline_config.fg_json_path:
     fg_util.load_fg_json_to_config(pipeline_config)
   if eval_data_path is not None:
-    logging.info('Evaluating on data: %s' % eval_data_path)
+    logging.info('Evaluating on data: %s', eval_data_path)
     if isinstance(eval_data_path, list):
       pipeline_config.eval_input_path = ','.join(eval_data_path)
     else:
       pipeline_config.eval_input_path = eval_data_path
   train_config = pipeline_config.train_config
 
-  if pipeline_config.WhichOneof('eval_path') == 'kafka_eval_input':
-    eval_data = pipeline_config.kafka_eval_input
-  else:
-    eval_data = pipeline_config.eval_input_path
-
-  server_target = None
-  if 'TF_CONFIG' in os.environ:
-    tf_config = estimator_utils.chief_to_master()
-    from tensorflow.python.training import server_lib
-    if tf_config['task']['type'] == 'ps':
-      cluster = tf.train.ClusterSpec(tf_config['cluster'])
-      server = server_lib.Server(
-          cluster, job_name='ps', task_index=tf_config['task']['index'])
-      server.join()
-    elif tf_config['task']['type'] == 'master':
-      if 'ps' in tf_config['cluster']:
-        cluster = tf.train.ClusterSpec(tf_config['cluster'])
-        server = server_lib.Server(cluster, job_name='master', task_index=0)
-        server_target = server.target
-        print('server_target = %s' % server_target)
+  eval_data = _get_input_object_by_name(pipeline_config, 'eval')
+
+  # server must stay referenced, the tf server stops when it is deleted
+  server, cluster, _, _ = _start_eval_server(['master'])
+  server_target = server.target if server is not None else None
 
   distribution = strategy_builder.build(train_config)
   estimator, run_config = _create_estimator(pipeline_config, distribution)
-  eval_spec = _create_eval_export_spec(pipeline_config, eval_data)
+  eval_spec = _create_eval_spec(
+      pipeline_config, eval_data, cache_eval_dataset=True)
   ckpt_path = _get_ckpt_path(pipeline_config, eval_checkpoint_path)
 
   if server_target:
@@ -393,10 +557,6 @@ def evaluate(pipeline_config,
     input_iter = eval_spec.input_fn(
         mode=tf.estimator.ModeKeys.EVAL).make_one_shot_iterator()
     input_feas, input_lbls = input_iter.get_next()
-    from tensorflow.python.training.device_setter import replica_device_setter
-    from tensorflow.python.framework.ops import device
-    from tensorflow.python.training.monitored_session import MonitoredSession
-    from tensorflow.python.training.monitored_session import ChiefSessionCreator
     with device(
         replica_device_setter(
             worker_device='/job:master/task:0', cluster=cluster)):
@@ -409,10 +569,12 @@ def evaluate(pipeline_config,
         master=server_target,
         checkpoint_filename_with_path=ckpt_path,
         config=session_config)
-    eval_metric_ops = estimator_spec.eval_metric_ops
-    update_ops = [eval_metric_ops[x][1] for x in eval_metric_ops.keys()]
-    metric_ops = {x: eval_metric_ops[x][0] for x in eval_metric_ops.keys()}
-    update_op = tf.group(update_ops)
+    update_ops = []
+    metric_ops = {}
+    for name, (metric_op, update_op) in estimator_spec.eval_metric_ops.items():
+      update_ops.append(update_op)
+      metric_ops[name] = metric_op
+    update_op = tf.group(*update_ops)
     with MonitoredSession(
         session_creator=chief_sess_creator,
         hooks=None,
@@ -434,20 +596,12 @@ def evaluate(pipeline_config,
   logging.info('Evaluate finish')
 
   print('eval_result = ', eval_result)
-  logging.info('eval_result = {0}'.format(eval_result))
+  logging.info('eval_result = %s', eval_result)
   # write eval result to file
   model_dir = pipeline_config.model_dir
   eval_result_file = os.path.join(model_dir, eval_result_filename)
-  logging.info('save eval result to file %s' % eval_result_file)
-  with gfile.GFile(eval_result_file, 'w') as ofile:
-    result_to_write = {}
-    for key in sorted(eval_result):
-      # skip logging binary data
-      if isinstance(eval_result[key], six.binary_type):
-        continue
-      # convert numpy float to python float
-      result_to_write[key] = eval_result[key].item()
-    ofile.write(json.dumps(result_to_write, indent=2))
+  logging.info('save eval result to file %s', eval_result_file)
+  _write_eval_result(eval_result_file, eval_result, indent=2)
   return eval_result
 
 
@@ -479,51 +633,24 @@ def distribute_evaluate(pipeline_config,
   """
   pipeline_config = config_util.get_configs_from_pipeline_file(pipeline_config)
   if eval_data_path is not None:
-    logging.info('Evaluating on data: %s' % eval_data_path)
+    logging.info('Evaluating on data: %s', eval_data_path)
     if isinstance(eval_data_path, list):
       pipeline_config.eval_input_path = ','.join(eval_data_path)
     else:
       pipeline_config.eval_input_path = eval_data_path
   train_config = pipeline_config.train_config
 
-  if pipeline_config.WhichOneof('eval_path') == 'kafka_eval_input':
-    eval_data = pipeline_config.kafka_eval_input
-  else:
-    eval_data = pipeline_config.eval_input_path
-
-  server_target = None
-  cur_job_name = None
-  if 'TF_CONFIG' in os.environ:
-    tf_config = estimator_utils.chief_to_master()
-
-    from tensorflow.python.training import server_lib
-    if tf_config['task']['type'] == 'ps':
-      cluster = tf.train.ClusterSpec(tf_config['cluster'])
-      server = server_lib.Server(
-          cluster, job_name='ps', task_index=tf_config['task']['index'])
-      server.join()
-    elif tf_config['task']['type'] == 'master':
-      if 'ps' in tf_config['cluster']:
-        cur_job_name = tf_config['task']['type']
-        cur_task_index = tf_config['task']['index']
-        cluster = tf.train.ClusterSpec(tf_config['cluster'])
-        server = server_lib.Server(
-            cluster, job_name=cur_job_name, task_index=cur_task_index)
-        server_target = server.target
-        print('server_target = %s' % server_target)
-    elif tf_config['task']['type'] == 'worker':
-      if 'ps' in tf_config['cluster']:
-        cur_job_name = tf_config['task']['type']
-        cur_task_index = tf_config['task']['index']
-        cluster = tf.train.ClusterSpec(tf_config['cluster'])
-        server = server_lib.Server(
-            cluster, job_name=cur_job_name, task_index=cur_task_index)
-        server_target = server.target
-        print('server_target = %s' % server_target)
+  eval_data = _get_input_object_by_name(pipeline_config, 'eval')
+
+  # server must stay referenced, the tf server stops when it is deleted
+  server, cluster, cur_job_name, cur_task_index = _start_eval_server(
+      ['master', 'worker'])
+  server_target = server.target if server is not None else None
 
   distribution = strategy_builder.build(train_config)
   estimator, run_config = _create_estimator(pipeline_config, distribution)
-  eval_spec = _create_eval_export_spec(pipeline_config, eval_data)
+  eval_spec = _create_eval_spec(
+      pipeline_config, eval_data, cache_eval_dataset=True)
   ckpt_path = _get_ckpt_path(pipeline_config, eval_checkpoint_path)
 
   if server_target:
@@ -531,12 +658,6 @@ def distribute_evaluate(pipeline_config,
     input_iter = eval_spec.input_fn(
         mode=tf.estimator.ModeKeys.EVAL).make_one_shot_iterator()
     input_feas, input_lbls = input_iter.get_next()
-    from tensorflow.python.training.device_setter import replica_device_setter
-    from tensorflow.python.framework.ops import device
-    from tensorflow.python.training.monitored_session import MonitoredSession
-    from tensorflow.python.training.monitored_session import ChiefSessionCreator
-    from tensorflow.python.training.monitored_session import WorkerSessionCreator
-    from easy_rec.python.utils.estimator_utils import EvaluateExitBarrierHook
     cur_work_device = '/job:' + cur_job_name + '/task:' + str(cur_task_index)
     with device(
         replica_device_setter(worker_device=cur_work_device, cluster=cluster)):
@@ -548,10 +669,13 @@ def distribute_evaluate(pipeline_config,
     if cur_job_name == 'master':
       metric_variables = tf.get_collection(tf.GraphKeys.METRIC_VARIABLES)
       model_ready_for_local_init_op = tf.variables_initializer(metric_variables)
-      global_variables = tf.global_variables()
-      remain_variables = list(
-          set(global_variables).difference(set(metric_variables)))
-      cur_saver = tf.train.Saver(var_list=remain_variables)
+      metric_variables_set = set(metric_variables)
+      # keep the graph order of the variables, a set difference does not
+      remain_variables = [
+          x for x in tf.global_variables() if x not in metric_variables_set
+      ]
+      # sharded: the variables on each ps are restored on that ps
+      cur_saver = tf.train.Saver(var_list=remain_variables, sharded=True)
       cur_scaffold = tf.train.Scaffold(
           saver=cur_saver,
           ready_for_local_init_op=model_ready_for_local_init_op)
@@ -563,20 +687,22 @@ def distribute_evaluate(pipeline_config,
     else:
       cur_sess_creator = WorkerSessionCreator(
           master=server_target, config=session_config)
-    eval_metric_ops = estimator_spec.eval_metric_ops
-    update_ops = [eval_metric_ops[x][1] for x in eval_metric_ops.keys()]
-    metric_ops = {x: eval_metric_ops[x][0] for x in eval_metric_ops.keys()}
-    update_op = tf.group(update_ops)
+    update_ops = []
+    metric_ops = {}
+    for name, (metric_op, update_op) in estimator_spec.eval_metric_ops.items():
+      update_ops.append(update_op)
+      metric_ops[name] = metric_op
+    update_op = tf.group(*update_ops)
     count = 0
-    cur_worker_num = len(tf_config['cluster']['worker']) + 1
+    cur_worker_num = cluster.num_tasks('worker') + 1
     if cur_job_name == 'master':
       cur_stop_grace_period_sesc = 120
-      cur_hooks = EvaluateExitBarrierHook(cur_worker_num, True, ckpt_path,
-                                          metric_ops)
+      cur_hooks = estimator_utils.EvaluateExitBarrierHook(
+          cur_worker_num, True, ckpt_path, metric_ops)
     else:
       cur_stop_grace_period_sesc = 10
-      cur_hooks = EvaluateExitBarrierHook(cur_worker_num, False, ckpt_path,
-                                          metric_ops)
+      cur_hooks = estimator_utils.EvaluateExitBarrierHook(
+          cur_worker_num, False, ckpt_path, metric_ops)
     with MonitoredSession(
         session_creator=cur_sess_creator,
         hooks=[cur_hooks],
@@ -601,20 +727,11 @@ def distribute_evaluate(pipeline_config,
   # write eval result to file
   model_dir = pipeline_config.model_dir
   eval_result_file = os.path.join(model_dir, eval_result_filename)
-  logging.info('save eval result to file %s' % eval_result_file)
+  logging.info('save eval result to file %s', eval_result_file)
   if cur_job_name == 'master':
     print('eval_result = ', eval_result)
-    logging.info('eval_result = {0}'.format(eval_result))
-    with gfile.GFile(eval_result_file, 'w') as ofile:
-      result_to_write = {}
-      for key in sorted(eval_result):
-        # skip logging binary data
-        if isinstance(eval_result[key], six.binary_type):
-          continue
-        # convert numpy float to python float
-        result_to_write[key] = eval_result[key].item()
-
-      ofile.write(json.dumps(result_to_write))
+    logging.info('eval_result = %s', eval_result)
+    _write_eval_result(eval_result_file, eval_result)
   return eval_result
 
 
@@ -641,17 +758,14 @@ def predict(pipeline_config, checkpoint_path='', data_path=None):
   if pipeline_config.fg_json_path:
     fg_util.load_fg_json_to_config(pipeline_config)
   if data_path is not None:
-    logging.info('Predict on data: %s' % data_path)
+    logging.info('Predict on data: %s', data_path)
     pipeline_config.eval_input_path = data_path
   train_config = pipeline_config.train_config
-  if pipeline_config.WhichOneof('eval_path') == 'kafka_eval_input':
-    eval_data = pipeline_config.kafka_eval_input
-  else:
-    eval_data = pipeline_config.eval_input_path
+  eval_data = _get_input_object_by_name(pipeline_config, 'eval')
 
   distribution = strategy_builder.build(train_config)
   estimator, _ = _create_estimator(pipeline_config, distribution)
-  eval_spec = _create_eval_export_spec(pipeline_config, eval_data)
+  eval_spec = _create_eval_spec(pipeline_config, eval_data)
 
   ckpt_path = _get_ckpt_path(pipeline_config, checkpoint_path)
 
@@ -706,7 +820,7 @@ def export(export_dir,
   # create estimator
   params = {'log_device_placement': verbose}
   if asset_files:
-    logging.info('will add asset files: %s' % asset_files)
+    logging.info('will add asset files: %s', asset_files)
     asset_file_dict = {}
     for asset_file in asset_files.split(','):
       asset_file = asset_file.strip()
@@ -720,9 +834,7 @@ def export(export_dir,
   # construct serving input fn
   export_config = pipeline_config.export_config
   data_config = pipeline_config.data_config
-  input_fn_kwargs = {}
-  if data_config.input_type == data_config.InputType.OdpsRTPInputV2:
-    input_fn_kwargs['fg_json_path'] = pipeline_config.fg_json_path
+  input_fn_kwargs = _get_input_fn_kwargs(pipeline_config)
   serving_input_fn = _get_input_fn(data_config, feature_configs, None,
                                    export_config, **input_fn_kwargs)
   if 'oss_path' in extra_params:
@@ -746,7 +858,6 @@ def export(export_dir,
       strip_default_attrs=True)
 
   # add export ts as version info
-  saved_model = saved_model_pb2.SavedModel()
   if type(final_export_dir) not in [type(''), type(u'')]:
     final_export_dir = final_export_dir.decode('utf-8')
   export_ts = [
@@ -755,12 +866,21 @@ def export(export_dir,
   export_ts = export_ts[-1]
   saved_pb_path = os.path.join(final_export_dir, 'saved_model.pb')
   with gfile.GFile(saved_pb_path, 'rb') as fin:
-    saved_model.ParseFromString(fin.read())
-  saved_model.meta_graphs[0].meta_info_def.meta_graph_version = export_ts
+    saved_model_bytes = fin.read()
+  # patch the version into the serialized bytes, so that the graph, which
+  # may be hundreds of MB, is not parsed and serialized again
+  saved_model_chunks = proto_util.set_meta_graph_version(
+      saved_model_bytes, export_ts)
+  if saved_model_chunks is None:
+    saved_model = saved_model_pb2.SavedModel()
+    saved_model.ParseFromString(saved_model_bytes)
+    saved_model.meta_graphs[0].meta_info_def.meta_graph_version = export_ts
+    saved_model_chunks = [saved_model.SerializeToString()]
   with gfile.GFile(saved_pb_path, 'wb') as fout:
-    fout.write(saved_model.SerializeToString())
+    for chunk in saved_model_chunks:
+      fout.write(chunk)
 
-  logging.info('model has been exported to %s successfully' % final_export_dir)
+  logging.info('model has been exported to %s successfully', final_export_dir)
   return final_export_dir
 
 
@@ -778,14 +898,12 @@ def export_checkpoint(
   feature_configs = config_util.get_compatible_feature_configs(pipeline_config)
   data_config = pipeline_config.data_config
 
-  input_fn_kwargs = {}
-  if data_config.input_type == data_config.InputType.OdpsRTPInputV2:
-    input_fn_kwargs['fg_json_path'] = pipeline_config.fg_json_path
+  input_fn_kwargs = _get_input_fn_kwargs(pipeline_config)
 
   # create estimator
   params = {'log_device_placement': verbose}
   if asset_files:
-    logging.info('will add asset files: %s' % asset_files)
+    logging.info('will add asset files: %s', asset_files)
     params['asset_files'] = asset_files
   estimator, _ = _create_estimator(pipeline_config, params=params)
 
@@ -13,7 +13,6 @@ import tensorflow as tf
 from tensorflow.python.client import session as tf_session
 from tensorflow.python.eager import context
 from tensorflow.python.framework import ops
-from tensorflow.python.ops import variables
 from tensorflow.python.saved_model import signature_constants
 from tensorflow.python.training import saver
 
@@ -34,9 +33,17 @@ from easy_rec.python.utils.multi_optimizer import MultiOptimizer
 if tf.__version__ >= '2.0':
   tf = tf.compat.v1
 
+# embedding variables, both unpartitioned and partitioned
+_EMBEDDING_WEIGHTS_RE = re.compile(
+    'embedding_weights:|/embedding_weights/part_')
+
 
 class EasyRecEstimator(tf.estimator.Estimator):
 
+  # serialized RTP fg configs, keyed by (path, mtime_nsec)
+  _FG_CONFIG_CACHE_SIZE = 8
+  _fg_config_cache = {}
+
   def __init__(self, pipeline_config, model_cls, run_config, params):
     self._pipeline_config = pipeline_config
     self._model_cls = model_cls
@@ -113,6 +120,8 @@ class EasyRecEstimator(tf.estimator.Estimator):
       with tf.control_dependencies([update_op]):
         loss = tf.identity(loss, name='total_loss')
 
+    trainable_vars = tf.trainable_variables()
+
     # build optimizer
     if len(self.train_config.optimizer_config) == 1:
       optimizer_config = self.train_config.optimizer_config[0]
@@ -126,7 +135,7 @@ class EasyRecEstimator(tf.estimator.Estimator):
           opt, learning_rate = optimizer_builder.build(tmp_config)
           tf.summary.scalar('learning_rate', learning_rate[0])
         all_opts.append(opt)
-      grouped_vars = model.get_grouped_vars()
+      grouped_vars = model.get_grouped_vars(trainable_vars)
       assert len(grouped_vars) == len(optimizer_config), \
           'the number of var group(%d) != the number of optimizers(%d)' \
           % (len(grouped_vars), len(optimizer_config))
@@ -197,9 +206,8 @@ class EasyRecEstimator(tf.estimator.Estimator):
       gradient_multipliers = {
           var: self.train_config.optimizer_config[0]
           .embedding_learning_rate_multiplier
-          for var in tf.trainable_variables()
-          if 'embedding_weights:' in var.name or
-          '/embedding_weights/part_' in var.name
+          for var in trainable_vars
+          if _EMBEDDING_WEIGHTS_RE.search(var.name)
       }
 
     # optimize loss
@@ -207,17 +215,16 @@ class EasyRecEstimator(tf.estimator.Estimator):
     # on the same device on which op is processes in forward process
     all_train_vars = []
     if len(self.train_config.freeze_gradient) > 0:
-      for one_var in tf.trainable_variables():
-        is_freeze = False
-        for x in self.train_config.freeze_gradient:
-          if re.search(x, one_var.name) is not None:
-            logging.info('will freeze gradients of %s' % one_var.name)
-            is_freeze = True
-            break
-        if not is_freeze:
+      freeze_patterns = [
+          re.compile(x) for x in self.train_config.freeze_gradient
+      ]
+      for one_var in trainable_vars:
+        if any(x.search(one_var.name) for x in freeze_patterns):
+          logging.info('will freeze gradients of %s', one_var.name)
+        else:
           all_train_vars.append(one_var)
     else:
-      all_train_vars = tf.trainable_variables()
+      all_train_vars = trainable_vars
 
     train_op = optimizers.optimize_loss(
         loss=loss,
@@ -267,14 +274,12 @@ class EasyRecEstimator(tf.estimator.Estimator):
     logging_dict.update(loss_dict)
     if metric_update_op_dict is not None:
       logging_dict.update(metric_update_op_dict)
-    tensor_order = logging_dict.keys()
+    tensor_order = tuple(logging_dict.keys())
+    format_template = ','.join(
+        '%s = %%s' % k.replace('%', '%%') for k in tensor_order)
 
     def format_fn(tensor_dict):
-      stats = []
-      for k in tensor_order:
-        tensor_value = tensor_dict[k]
-        stats.append('%s = %s' % (k, tensor_value))
-      return ','.join(stats)
+      return format_template % tuple(tensor_dict[k] for k in tensor_order)
 
     log_step_count_steps = self.train_config.log_step_count_steps
 
@@ -294,17 +299,20 @@ class EasyRecEstimator(tf.estimator.Estimator):
       var_list = (
           tf.get_collection(tf.GraphKeys.GLOBAL_VARIABLES) +
           tf.get_collection(tf.GraphKeys.SAVEABLE_OBJECTS))
-      initialize_var_list = [
-          x for x in var_list if 'WorkQueue' not in str(type(x))
-      ]
       # early_stop flag will not be saved in checkpoint
       # and could not be restored from checkpoint
       early_stop_var = find_early_stop_var(var_list)
+      initialize_var_list = []
+      saver_var_list = []
+      for x in var_list:
+        if 'WorkQueue' not in type(x).__name__:
+          initialize_var_list.append(x)
+        if x is not early_stop_var:
+          saver_var_list.append(x)
       # incompatiable shape restore will not be saved in checkpoint
       # but must be able to restore from checkpoint
       incompatiable_shape_restore = tf.get_collection('T_E_M_P_RESTROE')
       if early_stop_var is not None:
-        var_list = [x for x in var_list if x != early_stop_var]
         local_init_op = tf.group([
             tf.initializers.local_variables(),
             tf.initializers.variables([early_stop_var] +
@@ -319,7 +327,7 @@ class EasyRecEstimator(tf.estimator.Estimator):
         local_init_op = None
       scaffold = tf.train.Scaffold(
           saver=tf.train.Saver(
-              var_list=var_list,
+              var_list=saver_var_list,
               sharded=True,
               max_to_keep=self.train_config.keep_checkpoint_max),
           local_init_op=local_init_op,
@@ -331,7 +339,8 @@ class EasyRecEstimator(tf.estimator.Estimator):
           save_secs=self._config.save_checkpoints_secs,
           save_steps=self._config.save_checkpoints_steps,
           scaffold=scaffold,
-          write_graph=self.train_config.write_graph)
+          write_graph=self.train_config.write_graph,
+          async_save=self.train_config.async_checkpoint)
       chief_hooks = []
       if estimator_utils.is_chief():
         hooks.append(saver_hook)
@@ -368,10 +377,10 @@ class EasyRecEstimator(tf.estimator.Estimator):
       loss_tensor = loss_dict[loss_key]
       # add key-prefix to make loss metric key in the same family of train loss
       metric_dict['loss/loss/' + loss_key] = tf.metrics.mean(loss_tensor)
-    tf.logging.info('metric_dict keys: %s' % metric_dict.keys())
+    tf.logging.info('metric_dict keys: %s', list(metric_dict.keys()))
 
     end = time.time()
-    tf.logging.info('eval graph construct finished. Time %.3fs' % (end - start))
+    tf.logging.info('eval graph construct finished. Time %.3fs', end - start)
     return tf.estimator.EstimatorSpec(
         mode=tf.estimator.ModeKeys.EVAL,
         loss=loss,
@@ -395,31 +404,18 @@ class EasyRecEstimator(tf.estimator.Estimator):
       loss_tensor = loss_dict[loss_key]
       # add key-prefix to make loss metric key in the same family of train loss
       metric_dict['loss/loss/' + loss_key] = tf.metrics.mean(loss_tensor)
-    tf.logging.info('metric_dict keys: %s' % metric_dict.keys())
+    tf.logging.info('metric_dict keys: %s', list(metric_dict.keys()))
 
     end = time.time()
-    tf.logging.info('eval graph construct finished. Time %.3fs' % (end - start))
-    metric_name_list = []
-    for metric_i in self.eval_config.metrics_set:
-      metric_name_list.append(metric_i.WhichOneof('metric'))
-    all_var_list = []
-    metric_var_list = []
-    for var in variables._all_saveable_objects():
-      var_name = var.name
-      flag = True
-      for metric_i in metric_name_list:
-        if metric_i in var_name:
-          flag = False
-          break
-      if flag:
-        all_var_list.append(var)
-      else:
-        metric_var_list.append(var)
+    tf.logging.info('eval graph construct finished. Time %.3fs', end - start)
     global_variables = tf.global_variables()
     metric_variables = tf.get_collection(tf.GraphKeys.METRIC_VARIABLES)
     model_ready_for_local_init_op = tf.variables_initializer(metric_variables)
-    remain_variables = list(
-        set(global_variables).difference(set(metric_variables)))
+    metric_variables_set = set(metric_variables)
+    # keep the graph order of the variables, a set difference does not
+    remain_variables = [
+        x for x in global_variables if x not in metric_variables_set
+    ]
     cur_saver = tf.train.Saver(var_list=remain_variables)
     scaffold = tf.train.Scaffold(
         saver=cur_saver, ready_for_local_init_op=model_ready_for_local_init_op)
@@ -505,13 +501,39 @@ class EasyRecEstimator(tf.estimator.Estimator):
       fg_config_path: path to the RTP config file.
     """
     if fg_config is None:
-      with tf.gfile.GFile(fg_config_path, 'r') as f:
-        fg_config = json.load(f)
+      fg_config_str = EasyRecEstimator._load_rtp_fg_config(fg_config_path)
+    else:
+      fg_config_str = json.dumps(fg_config)
     col = ops.get_collection_ref(GraphKeys.RANK_SERVICE_FG_CONF)
     if len(col) == 0:
-      col.append(json.dumps(fg_config))
+      col.append(fg_config_str)
     else:
-      col[0] = json.dumps(fg_config)
+      col[0] = fg_config_str
+
+  @staticmethod
+  def _load_rtp_fg_config(fg_config_path):
+    """Load the RTP config file and return it as a JSON string.
+
+    model_fn is called once per train / eval / export graph, so the
+    serialized config is cached until the file is modified.
+    """
+    try:
+      mtime = tf.gfile.Stat(fg_config_path).mtime_nsec
+    except tf.errors.NotFoundError:
+      mtime = None
+
+    # filesystems without modification time are not cached
+    cache = EasyRecEstimator._fg_config_cache
+    cache_key = (fg_config_path, mtime)
+    fg_config_str = cache.get(cache_key) if mtime else None
+    if fg_config_str is None:
+      with tf.gfile.GFile(fg_config_path, 'r') as f:
+        fg_config_str = json.dumps(json.load(f))
+      if mtime:
+        if len(cache) >= EasyRecEstimator._FG_CONFIG_CACHE_SIZE:
+          cache.clear()
+        cache[cache_key] = fg_config_str
+    return fg_config_str
 
   @staticmethod
   def _write_rtp_inputs_to_col(features):
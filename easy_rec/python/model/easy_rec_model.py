@@ -334,9 +334,13 @@ class EasyRecModel(six.with_metaclass(_meta_type, object)):
     return restore_filter.CombineFilter(all_filters,
                                         restore_filter.Logical.AND), None
 
-  def get_grouped_vars(self):
+  def get_grouped_vars(self, trainable_vars=None):
     """Get grouped variables, each group will be optimized by a separate optimizer.
 
+    Args:
+      trainable_vars: list of trainable variables to be grouped,
+        default to tf.trainable_variables().
+
     Return:
        grouped_vars: list of list of variables
     """
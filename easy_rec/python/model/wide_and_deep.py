@@ -79,11 +79,15 @@ class WideAndDeep(RankModel):
 
     return self._prediction_dict
 
-  def get_grouped_vars(self):
+  def get_grouped_vars(self, trainable_vars=None):
     """Group the vars into different optimization groups.
 
     Each group will be optimized by a separate optimizer.
 
+    Args:
+      trainable_vars: list of trainable variables to be grouped,
+        default to tf.trainable_variables().
+
     Return:
       list of list of variables.
     """
@@ -92,7 +96,9 @@ class WideAndDeep(RankModel):
         + ' final_dnn should not be set.'
     wide_vars = []
     deep_vars = []
-    for tmp_var in tf.trainable_variables():
+    if trainable_vars is None:
+      trainable_vars = tf.trainable_variables()
+    for tmp_var in trainable_vars:
       if tmp_var.name.startswith('input_layer') and \
           (not tmp_var.name.startswith('input_layer_1')):
         wide_vars.append(tmp_var)
@@ -8,6 +8,7 @@ from google.protobuf import text_format
 from easy_rec.python.input.csv_input import CSVInput
 from easy_rec.python.input.csv_input_ex import CSVInputEx
 from easy_rec.python.protos.dataset_pb2 import DatasetConfig
+from easy_rec.python.protos.export_pb2 import ExportConfig
 from easy_rec.python.protos.feature_config_pb2 import FeatureConfig
 from easy_rec.python.utils import config_util
 from easy_rec.python.utils.test_utils import RunAsSubprocess
@@ -19,6 +20,16 @@ if tf.__version__ >= '2.0':
   tf = tf.compat.v1
 
 
+class _FixedNegativeSampler(object):
+  """Returns the same negative items for every batch."""
+
+  def __init__(self, sampled):
+    self._sampled = sampled
+
+  def get(self, ids):
+    return self._sampled
+
+
 class CSVInputTest(tf.test.TestCase):
 
   def __init__(self, methodName='CSVInputTest'):
@@ -323,6 +334,207 @@ class CSVInputTest(tf.test.TestCase):
       sess.run(init_op)
       feature_dict, label_dict = sess.run([features, labels])
 
+  def _create_placeholders(self, separator):
+    data_config_str = """
+      input_fields {
+        input_name: 'label'
+        input_type: FLOAT
+      }
+      input_fields {
+        input_name: 'field1'
+        input_type: STRING
+      }
+      input_fields {
+        input_name: 'field2'
+        input_type: FLOAT
+      }
+      label_fields: 'label'
+      batch_size: 32
+    """
+    feature_configs_str = ["""
+      input_names: 'field1'
+      feature_type: IdFeature
+      embedding_dim: 32
+      hash_bucket_size: 2000
+    """, """
+      input_names: 'field2'
+      feature_type: RawFeature
+    """]
+    dataset_config = DatasetConfig()
+    text_format.Merge(data_config_str, dataset_config)
+    dataset_config.separator = separator
+    feature_configs = []
+    for feature_config_str in feature_configs_str:
+      feature_config = FeatureConfig()
+      text_format.Merge(feature_config_str, feature_config)
+      feature_configs.append(feature_config)
+    csv_input = CSVInput(dataset_config, feature_configs, self._input_path)
+    return csv_input.create_placeholders(ExportConfig())
+
+  @RunAsSubprocess
+  def test_create_placeholders(self):
+    for separator in [',', ';,']:
+      inputs, features = self._create_placeholders(separator)
+      with self.test_session() as sess:
+        field1, field2 = sess.run(
+            [features['field1'], features['field2']],
+            feed_dict={inputs['features']: ['a,1.5', 'b,-2']})
+        assert list(field1) == [b'a', b'b']
+        self.assertAllClose(field2, [1.5, -2.0])
+        # numeric values are required
+        with self.assertRaises(tf.errors.InvalidArgumentError):
+          sess.run(
+              features['field2'], feed_dict={inputs['features']: ['a,']})
+
+  @RunAsSubprocess
+  def test_lookup_preprocess(self):
+    data_config_str = """
+      input_fields {
+        input_name: 'key'
+        input_type: STRING
+      }
+      input_fields {
+        input_name: 'kvs'
+        input_type: STRING
+      }
+      batch_size: 32
+    """
+    feature_config_str = """
+      input_names: 'key'
+      input_names: 'kvs'
+      feature_type: LookupFeature
+      embedding_dim: 8
+      hash_bucket_size: 100
+      separator: '|'
+      kv_separator: ':'
+      lookup_max_sel_elem_num: 2
+    """
+    dataset_config = DatasetConfig()
+    text_format.Merge(data_config_str, dataset_config)
+    feature_config = FeatureConfig()
+    text_format.Merge(feature_config_str, feature_config)
+    csv_input = CSVInput(dataset_config, [feature_config], self._input_path)
+
+    keys = ['a', 'b', 'c', 'a', 'd']
+    kvs = ['a:1|b:2|a:3', 'a:1|c:2', 'c:1|c:2|c:3|b:4', '', 'a:1']
+    # selections of the previous per key implementation
+    expect_indices, expect_vals = [], []
+    for row_id, (key, kv) in enumerate(zip(keys, kvs)):
+      sel_vals = [
+          x.split(':')[1] for x in kv.split('|') if x and x.split(':')[0] == key
+      ]
+      for col_id, val in enumerate(sel_vals[:2]):
+        expect_indices.append([row_id, col_id])
+        expect_vals.append(val.encode('utf-8'))
+
+    sel_vals = csv_input._lookup_preprocess(feature_config, {
+        'key': tf.constant(keys),
+        'kvs': tf.constant(kvs)
+    })
+    with self.test_session() as sess:
+      sel_vals = sess.run(sel_vals)
+    self.assertAllEqual(sel_vals.indices, expect_indices)
+    assert list(sel_vals.values) == expect_vals
+    self.assertAllEqual(sel_vals.dense_shape, [len(keys), 2])
+
+  @RunAsSubprocess
+  def test_raw_feature_with_negative_sampler(self):
+    data_config_str = """
+      input_fields {
+        input_name: 'user_raw'
+        input_type: FLOAT
+      }
+      input_fields {
+        input_name: 'item_id'
+        input_type: STRING
+      }
+      input_fields {
+        input_name: 'item_raw'
+        input_type: FLOAT
+      }
+      batch_size: 32
+    """
+    feature_configs_str = ["""
+      input_names: 'user_raw'
+      feature_type: RawFeature
+    """, """
+      input_names: 'item_id'
+      feature_type: IdFeature
+      embedding_dim: 8
+      hash_bucket_size: 100
+    """, """
+      input_names: 'item_raw'
+      feature_type: RawFeature
+    """]
+    dataset_config = DatasetConfig()
+    text_format.Merge(data_config_str, dataset_config)
+    feature_configs = []
+    for feature_config_str in feature_configs_str:
+      feature_config = FeatureConfig()
+      text_format.Merge(feature_config_str, feature_config)
+      feature_configs.append(feature_config)
+    csv_input = CSVInput(dataset_config, feature_configs, self._input_path)
+    # the sampler appends 3 negative items to the item fields only
+    dataset_config.negative_sampler.input_path = 'unused'
+    dataset_config.negative_sampler.num_sample = 3
+    dataset_config.negative_sampler.item_id_field = 'item_id'
+    csv_input._sampler = _FixedNegativeSampler({
+        'item_id': tf.constant(['n1', 'n2', 'n3']),
+        'item_raw': tf.constant([0.1, 0.2, 0.3])
+    })
+    csv_input._mode = tf.estimator.ModeKeys.TRAIN
+    parsed_dict = csv_input._preprocess({
+        'user_raw': tf.constant([1.0, 2.0]),
+        'item_id': tf.constant(['i1', 'i2']),
+        'item_raw': tf.constant([3.0, 4.0])
+    })
+    with self.test_session() as sess:
+      user_proj, item_proj = sess.run([
+          parsed_dict['user_raw_raw_proj_val'],
+          parsed_dict['item_raw_raw_proj_val']
+      ])
+    self.assertAllEqual(user_proj.dense_shape, [2, 1])
+    self.assertAllClose(user_proj.values, [1.0, 2.0])
+    self.assertAllEqual(item_proj.dense_shape, [5, 1])
+    self.assertAllEqual(item_proj.indices, [[i, 0] for i in range(5)])
+    self.assertAllClose(item_proj.values, [3.0, 4.0, 0.1, 0.2, 0.3])
+
+  @RunAsSubprocess
+  def test_multi_value_label_trailing_separator(self):
+    data_config_str = """
+      input_fields {
+        input_name: 'label'
+        input_type: STRING
+      }
+      input_fields {
+        input_name: 'field1'
+        input_type: STRING
+      }
+      label_fields: 'label'
+      label_sep: ','
+      label_dim: 2
+      batch_size: 32
+    """
+    feature_config_str = """
+      input_names: 'field1'
+      feature_type: IdFeature
+      embedding_dim: 8
+      hash_bucket_size: 100
+    """
+    dataset_config = DatasetConfig()
+    text_format.Merge(data_config_str, dataset_config)
+    feature_config = FeatureConfig()
+    text_format.Merge(feature_config_str, feature_config)
+    csv_input = CSVInput(dataset_config, [feature_config], self._input_path)
+    csv_input._mode = tf.estimator.ModeKeys.TRAIN
+    parsed_dict = csv_input._preprocess({
+        'label': tf.constant(['1,0,', '0,1']),
+        'field1': tf.constant(['a', 'b'])
+    })
+    with self.test_session() as sess:
+      labels = sess.run(parsed_dict['label'])
+    self.assertAllClose(labels, [[1.0, 0.0], [0.0, 1.0]])
+
 
 if __name__ == '__main__':
   tf.test.main()
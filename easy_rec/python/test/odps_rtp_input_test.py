@@ -0,0 +1,85 @@
+# -*- encoding:utf-8 -*-
+# Copyright (c) Alibaba, Inc. and its affiliates.
+import tensorflow as tf
+from google.protobuf import text_format
+
+from easy_rec.python.input.odps_rtp_input import OdpsRTPInput
+from easy_rec.python.protos.dataset_pb2 import DatasetConfig
+from easy_rec.python.protos.feature_config_pb2 import FeatureConfig
+
+if tf.__version__ >= '2.0':
+  from tensorflow.python.framework.ops import disable_eager_execution
+
+  disable_eager_execution()
+  tf = tf.compat.v1
+
+
+class OdpsRTPInputTest(tf.test.TestCase):
+
+  def _create_input(self, separator):
+    data_config_str = """
+      input_fields {
+        input_name: 'label'
+        input_type: INT64
+      }
+      input_fields {
+        input_name: 'cnt'
+        input_type: INT64
+      }
+      input_fields {
+        input_name: 'cate'
+        input_type: STRING
+      }
+      input_fields {
+        input_name: 'price'
+        input_type: FLOAT
+      }
+      label_fields: 'label'
+      batch_size: 32
+    """
+    feature_configs_str = ["""
+      input_names: 'cnt'
+      feature_type: RawFeature
+    """, """
+      input_names: 'cate'
+      feature_type: IdFeature
+      embedding_dim: 8
+      hash_bucket_size: 100
+    """, """
+      input_names: 'price'
+      feature_type: RawFeature
+    """]
+    data_config = DatasetConfig()
+    text_format.Merge(data_config_str, data_config)
+    data_config.separator = separator
+    feature_configs = []
+    for feature_config_str in feature_configs_str:
+      feature_config = FeatureConfig()
+      text_format.Merge(feature_config_str, feature_config)
+      feature_configs.append(feature_config)
+    return OdpsRTPInput(data_config, feature_configs, None)
+
+  def test_parse_table(self):
+    for separator in [',', '\002\003']:
+      rtp_input = self._create_input(separator)
+      features = tf.placeholder(tf.string, [None])
+      inputs = rtp_input._parse_table(tf.constant([1, 0], tf.int64), features)
+      with self.test_session() as sess:
+        feed_vals = ['3,a,1.5', '4.0,b,2']
+        feed_vals = [x.replace(',', separator[0]) for x in feed_vals]
+        cnt, cate, price = sess.run(
+            [inputs['cnt'], inputs['cate'], inputs['price']],
+            feed_dict={features: feed_vals})
+        self.assertAllEqual(cnt, [3, 4])
+        assert list(cate) == [b'a', b'b']
+        self.assertAllClose(price, [1.5, 2.0])
+        # empty numeric values are errors instead of zeros
+        for feed_val in ['3,a,', ',a,1.5']:
+          feed_val = feed_val.replace(',', separator[0])
+          with self.assertRaises(tf.errors.InvalidArgumentError):
+            sess.run([inputs['cnt'], inputs['price']],
+                     feed_dict={features: [feed_val]})
+
+
+if __name__ == '__main__':
+  tf.test.main()
@@ -4,8 +4,9 @@
 import configparser
 import logging
 import os
+import re
 import time
-import traceback
+from multiprocessing.pool import ThreadPool
 
 import oss2
 
@@ -33,6 +34,37 @@ except Exception:
   ODPS = None
   DataFrame = None
 
+# key = value lines of ini-like config files, section headers
+# and comments are skipped
+_CONFIG_ITEM_RE = re.compile(r'^\s*(\w+)\s*[=:]\s*(.*?)\s*$', re.M)
+
+# the max number of keys of an oss batch delete request
+_OSS_DELETE_BATCH_SIZE = 1000
+# the max number of concurrent datahub delete requests
+_DH_DELETE_THREAD_NUM = 16
+# the number of records of a datahub put_records request
+_DH_PUT_BATCH_SIZE = 500
+
+# oss2.Bucket instances, keyed by (key, secret, endpoint, bucket_name)
+_oss_buckets = {}
+
+
+def _load_config_items(config_path):
+  with open(config_path, 'r') as fin:
+    return dict(_CONFIG_ITEM_RE.findall(fin.read()))
+
+
+def _parallel_run(func, items):
+  # datahub has no batch delete api, the requests are latency bound
+  if len(items) == 0:
+    return
+  pool = ThreadPool(min(len(items), _DH_DELETE_THREAD_NUM))
+  try:
+    pool.map(func, items)
+  finally:
+    pool.close()
+    pool.join()
+
 
 class OdpsOSSConfig:
 
@@ -84,8 +116,6 @@ class OdpsOSSConfig:
     self.is_outer = True
 
   def load_dh_config(self, config_path):
-    import pdb
-    pdb.set_trace()
     configer = configparser.ConfigParser()
     configer.read(config_path, encoding='utf-8')
     self.dh_id = configer.get('datahub', 'access_id')
@@ -95,35 +125,28 @@ class OdpsOSSConfig:
     self.dh_project = configer.get('datahub', 'project')
 
   def load_oss_config(self, config_path):
-    with open(config_path, 'r') as fin:
-      for line_str in fin:
-        line_str = line_str.strip()
-        line_str = line_str.replace(' ', '')
-        if line_str.startswith('accessKeyID='):
-          self.oss_key = line_str[len('accessKeyID='):].strip()
-        elif line_str.startswith('accessKeySecret='):
-          self.oss_secret = line_str[len('accessKeySecret='):].strip()
-        elif line_str.startswith('endpoint='):
-          self.endpoint = line_str[len('endpoint='):].strip()
+    config_items = _load_config_items(config_path)
+    self.oss_key = config_items.get('accessKeyID', self.oss_key)
+    self.oss_secret = config_items.get('accessKeySecret', self.oss_secret)
+    self.endpoint = config_items.get('endpoint', self.endpoint)
 
   def load_odps_config(self, config_path):
     self.odps_config_path = config_path
-    with open(config_path, 'r') as fin:
-      for line_str in fin:
-        line_str = line_str.strip()
-        line_str = line_str.replace(' ', '')
-        if line_str.startswith('project_name='):
-          self.project_name = line_str[len('project_name='):]
-        if line_str.startswith('end_point='):
-          self.odps_endpoint = line_str[len('end_point='):]
+    config_items = _load_config_items(config_path)
+    self.project_name = config_items.get('project_name', self.project_name)
+    self.odps_endpoint = config_items.get('end_point', self.odps_endpoint)
 
   def clean_topic(self, dh_project):
     if not dh_project:
       logging.error('project is empty .')
-      topic_names = self.dh.list_topic(dh_project).topic_names
-      for topic_name in topic_names:
-        self.clean_subscription(topic_name)
-        self.dh.delete_topic(dh_project, topic_name)
+      return
+    topic_names = self.dh.list_topic(dh_project).topic_names
+
+    def _clean_one_topic(topic_name):
+      self.clean_subscription(topic_name)
+      self.dh.delete_topic(dh_project, topic_name)
+
+    _parallel_run(_clean_one_topic, topic_names)
 
   def clean_project(self):
     project_names = self.dh.list_project().project_names
@@ -138,8 +161,9 @@ class OdpsOSSConfig:
   def clean_subscription(self, topic_name):
     subscriptions = self.dh.list_subscription(self.dh_project, topic_name, '',
                                               1, 100).subscriptions
-    for subscription in subscriptions:
-      self.dh.delete_subscription(self.dh_project, topic_name, subscription)
+    _parallel_run(
+        lambda x: self.dh.delete_subscription(self.dh_project, topic_name, x),
+        subscriptions)
 
   def get_input_type(self, input_type):
     DhDict = {
@@ -167,8 +191,8 @@ class OdpsOSSConfig:
       logging.info('create project success!')
     except ResourceExistException:
       logging.info('project %s already exist!' % self.dh_project)
-    except Exception as ex:
-      logging.info(traceback.format_exc(ex))
+    except Exception:
+      logging.exception('create project %s failed', self.dh_project)
     record_schema = RecordSchema.from_lists(col, col_type)
     try:
       # project_name, topic_name, shard_count, life_cycle, record_schema, comment
@@ -177,9 +201,8 @@ class OdpsOSSConfig:
       logging.info('create tuple topic success!')
     except ResourceExistException:
       logging.info('topic %s already exist!' % self.dh_topic)
-    except Exception as ex:
-      logging.error('exception:', ex)
-      logging.error(traceback.format_exc())
+    except Exception:
+      logging.exception('create topic %s failed', self.dh_topic)
     try:
       self.dh.wait_shards_ready(self.dh_project, self.dh_topic)
       logging.info('shards all ready')
@@ -189,15 +212,15 @@ class OdpsOSSConfig:
       record_schema = topic_result.record_schema
       t = self.odps.get_table(self.odpsTable)
       with t.open_reader() as reader:
-        size = 0
         record_list = []
         for data in reader[0:1000]:
           record = TupleRecord(values=data.values, schema=record_schema)
           record_list.append(record)
-          if size % 1000:
+          if len(record_list) >= _DH_PUT_BATCH_SIZE:
             self.dh.put_records(self.dh_project, self.dh_topic, record_list)
             record_list = []
-          size += 1
+        if record_list:
+          self.dh.put_records(self.dh_project, self.dh_topic, record_list)
     except Exception as e:
       logging.error(e)
 
@@ -211,13 +234,17 @@ def get_oss_bucket(oss_key, oss_secret, endpoint, bucket_name):
     endpoint: oss endpoint
     bucket_name: oss bucket name
   Return:
-    oss2.Bucket instance
+    oss2.Bucket instance, shared by the calls with the same arguments
   """
   if oss_key is None or oss_secret is None:
     logging.info('oss_key or oss_secret is None')
     return None
-  auth = oss2.Auth(oss_key, oss_secret)
-  bucket = oss2.Bucket(auth, endpoint, bucket_name)
+  bucket_key = (oss_key, oss_secret, endpoint, bucket_name)
+  bucket = _oss_buckets.get(bucket_key)
+  if bucket is None:
+    auth = oss2.Auth(oss_key, oss_secret)
+    bucket = oss2.Bucket(auth, endpoint, bucket_name)
+    _oss_buckets[bucket_key] = bucket
   return bucket
 
 
@@ -230,7 +257,15 @@ def delete_oss_path(bucket, in_prefix, bucket_name):
     bucket_name: bucket_name
   """
   prefix = in_prefix.replace('oss://' + bucket_name + '/', '')
+  # one DeleteMultipleObjects request per _OSS_DELETE_BATCH_SIZE keys
+  keys = [prefix]
   for obj in oss2.ObjectIterator(bucket, prefix=prefix):
-    bucket.delete_object(obj.key)
-  bucket.delete_object(prefix)
+    if obj.key == prefix:
+      continue
+    keys.append(obj.key)
+    if len(keys) >= _OSS_DELETE_BATCH_SIZE:
+      bucket.batch_delete_objects(keys)
+      keys = []
+  if keys:
+    bucket.batch_delete_objects(keys)
   logging.info('delete oss path: %s, completed.' % in_prefix)
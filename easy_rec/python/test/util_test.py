@@ -1,9 +1,15 @@
 # -*- encoding:utf-8 -*-
 # Copyright (c) Alibaba, Inc. and its affiliates.
+import io
+import os
 
 import tensorflow as tf
+from tensorflow.core.protobuf import saved_model_pb2
 
+from easy_rec.python.feature_column import feature_column
+from easy_rec.python.utils import config_util
 from easy_rec.python.utils import estimator_utils
+from easy_rec.python.utils import proto_util
 from easy_rec.python.utils.expr_util import get_expression
 
 if tf.__version__ >= '2.0':
@@ -50,6 +56,67 @@ class UtilTest(tf.test.TestCase):
     result = get_expression("(age_level>3)|(item_age_level<1)", ["age_level", "item_age_level"])
     assert result == "tf.greater(parsed_dict['age_level'], 3) | tf.less(parsed_dict['item_age_level'], 1)"
 
+  def test_set_meta_graph_version(self):
+    saved_model = saved_model_pb2.SavedModel(saved_model_schema_version=1)
+    meta_graph = saved_model.meta_graphs.add()
+    meta_graph.meta_info_def.meta_graph_version = 'old'
+    meta_graph.meta_info_def.tags.append('serve')
+    meta_graph.graph_def.node.add(name='x', op='Placeholder')
+    chunks = proto_util.set_meta_graph_version(
+        saved_model.SerializeToString(), '1650000000')
+    patched_model = saved_model_pb2.SavedModel()
+    patched_model.ParseFromString(b''.join(chunks))
+    saved_model.meta_graphs[0].meta_info_def.meta_graph_version = '1650000000'
+    assert patched_model == saved_model
+
+    saved_model.meta_graphs.add()
+    assert proto_util.set_meta_graph_version(saved_model.SerializeToString(),
+                                             '1650000000') is None
+
+  def test_count_lines(self):
+    block_size = feature_column._READ_BLOCK_SIZE
+    # small blocks, so that lines cross block boundaries
+    feature_column._READ_BLOCK_SIZE = 4
+    try:
+      for data in [
+          b'', b'\n', b'a', b'abc\n', b'abcd\nefgh', b'abc\nde\n\nfghij\n',
+          b'\n\n\n\nx'
+      ]:
+        num_lines = feature_column._count_lines(io.BytesIO(data))
+        assert num_lines == sum(1 for _ in io.BytesIO(data)), \
+            'invalid line count of %r: %d' % (data, num_lines)
+    finally:
+      feature_column._READ_BLOCK_SIZE = block_size
+
+  def test_get_vocab_size(self):
+    vocab_path = os.path.join(self.get_temp_dir(), 'vocab.txt')
+    with open(vocab_path, 'w') as fout:
+      fout.write('a\nb\nc')
+    assert feature_column.get_vocab_size(vocab_path) == 3
+    assert not os.path.exists(vocab_path + '.linecount')
+
+  def test_pipeline_config_cache(self):
+    config_path = os.path.join(self.get_temp_dir(), 'cache_test.config')
+    with open(config_path, 'w') as fout:
+      fout.write('model_dir: "experiments/cache_test"\n'
+                 'train_config { num_steps: 100 }\n')
+    pipeline_config = config_util.get_configs_from_pipeline_file(config_path)
+    assert pipeline_config.train_config.num_steps == 100
+    # modifying the returned config must not change the cached config
+    pipeline_config.train_config.num_steps = 200
+    pipeline_config.model_dir = 'experiments/modified'
+    pipeline_config = config_util.get_configs_from_pipeline_file(config_path)
+    assert pipeline_config.train_config.num_steps == 100
+    assert pipeline_config.model_dir == 'experiments/cache_test'
+    # a modified file is parsed again
+    with open(config_path, 'w') as fout:
+      fout.write('model_dir: "experiments/cache_test"\n'
+                 'train_config { num_steps: 300 }\n')
+    mtime = os.path.getmtime(config_path) + 10
+    os.utime(config_path, (mtime, mtime))
+    pipeline_config = config_util.get_configs_from_pipeline_file(config_path)
+    assert pipeline_config.train_config.num_steps == 300
+
 
 if __name__ == '__main__':
   tf.test.main()
@@ -25,6 +25,9 @@ tf.app.flags.DEFINE_string('config_table', '', 'config table')
 
 FLAGS = tf.app.flags.FLAGS
 
+# number of config table records fetched per read
+_READ_BATCH_SIZE = 1024
+
 
 def main(argv):
   pipeline_config = config_util.get_configs_from_pipeline_file(
@@ -35,12 +38,12 @@ def main(argv):
   feature_info_map = {}
   while True:
     try:
-      record = reader.read()
-      feature_name = record[0][0]
-      feature_info_map[feature_name] = json.loads(record[0][1])
+      records = reader.read(_READ_BATCH_SIZE, allow_smaller_final_batch=True)
     except common_io.exception.OutOfRangeException:
       reader.close()
       break
+    for feature_name, feature_info in records:
+      feature_info_map[feature_name] = json.loads(feature_info)
 
   for feature_config in config_util.get_compatible_feature_configs(
       pipeline_config):
@@ -21,6 +21,10 @@ from easy_rec.python.protos.feature_config_pb2 import FeatureConfig
 if tf.__version__ >= '2.0':
   tf = tf.compat.v1
 
+# parsed pipeline configs, keyed by (path, mtime_nsec, auto_expand)
+_PIPELINE_CONFIG_CACHE_SIZE = 8
+_pipeline_config_cache = {}
+
 
 def get_configs_from_pipeline_file(pipeline_config_path, auto_expand=True):
   """Reads config from a file containing pipeline_pb2.EasyRecConfig.
@@ -37,10 +41,30 @@ def get_configs_from_pipeline_file(pipeline_config_path, auto_expand=True):
   if isinstance(pipeline_config_path, pipeline_pb2.EasyRecConfig):
     return pipeline_config_path
 
-  assert tf.gfile.Exists(
-      pipeline_config_path
-  ), 'pipeline_config_path [%s] not exists' % pipeline_config_path
+  try:
+    mtime = tf.gfile.Stat(pipeline_config_path).mtime_nsec
+  except tf.errors.NotFoundError:
+    mtime = None
+  assert mtime is not None, \
+      'pipeline_config_path [%s] not exists' % pipeline_config_path
+
+  # filesystems without modification time are not cached
+  cache_key = (pipeline_config_path, mtime, auto_expand)
+  cached_config = _pipeline_config_cache.get(cache_key) if mtime else None
+  if cached_config is None:
+    cached_config = _parse_pipeline_file(pipeline_config_path, auto_expand)
+    if mtime:
+      if len(_pipeline_config_cache) >= _PIPELINE_CONFIG_CACHE_SIZE:
+        _pipeline_config_cache.clear()
+      _pipeline_config_cache[cache_key] = cached_config
+
+  # the callers modify the returned config in place, so hand out a copy
+  pipeline_config = pipeline_pb2.EasyRecConfig()
+  pipeline_config.CopyFrom(cached_config)
+  return pipeline_config
+
 
+def _parse_pipeline_file(pipeline_config_path, auto_expand):
   pipeline_config = pipeline_pb2.EasyRecConfig()
   with tf.gfile.GFile(pipeline_config_path, 'r') as f:
     config_str = f.read()
@@ -8,6 +8,8 @@ import json
 import logging
 import os
 import re
+import sys
+import threading
 import time
 from distutils.version import LooseVersion
 
@@ -276,7 +278,8 @@ class CheckpointSaverHook(CheckpointSaverHook):
                checkpoint_basename='model.ckpt',
                scaffold=None,
                listeners=None,
-               write_graph=True):
+               write_graph=True,
+               async_save=False):
     """Initializes a `CheckpointSaverHook`.
 
     Args:
@@ -290,6 +293,10 @@ class CheckpointSaverHook(CheckpointSaverHook):
         Used for callbacks that run immediately before or after this hook saves
         the checkpoint.
       write_graph: whether to save graph.pbtxt.
+      async_save: save in a background thread, at most one save runs at a
+        time; the last save in end() is synchronous. Variables are not
+        snapshotted, so a checkpoint may mix values of several steps. An
+        error of a background save is raised at the next step.
 
     Raises:
       ValueError: One of `save_steps` or `save_secs` should be set.
@@ -304,6 +311,10 @@ class CheckpointSaverHook(CheckpointSaverHook):
         scaffold=scaffold,
         listeners=listeners)
     self._write_graph = write_graph
+    self._async_save = async_save
+    self._save_thread = None
+    self._save_should_stop = False
+    self._save_exc_info = None
 
   def after_create_session(self, session, coord):
     global_step = session.run(self._global_step_tensor)
@@ -329,8 +340,51 @@ class CheckpointSaverHook(CheckpointSaverHook):
   def before_run(self, run_context):  # pylint: disable=unused-argument
     return tf.train.SessionRunArgs(self._global_step_tensor)
 
+  def after_run(self, run_context, run_values):
+    self._raise_save_error()
+    super(CheckpointSaverHook, self).after_run(run_context, run_values)
+    # a listener of a finished background save requested to stop
+    if self._save_should_stop:
+      run_context.request_stop()
+
+  def end(self, session):
+    self._wait_save_thread()
+    self._raise_save_error()
+    # the session is closed after end, so the last save must finish here
+    self._async_save = False
+    super(CheckpointSaverHook, self).end(session)
+
+  def _wait_save_thread(self):
+    if self._save_thread is not None:
+      self._save_thread.join()
+      self._save_thread = None
+
+  def _raise_save_error(self):
+    """Re-raises the exception of a failed background save."""
+    if self._save_exc_info is not None:
+      exc_info, self._save_exc_info = self._save_exc_info, None
+      six.reraise(*exc_info)
+
   def _save(self, session, step):
     """Saves the latest checkpoint, returns should_stop."""
+    if not self._async_save:
+      return self._save_sync(session, step)
+
+    def _save_fn():
+      try:
+        if self._save_sync(session, step):
+          self._save_should_stop = True
+      except Exception:
+        self._save_exc_info = sys.exc_info()
+
+    self._wait_save_thread()
+    self._raise_save_error()
+    self._save_thread = threading.Thread(target=_save_fn)
+    self._save_thread.daemon = True
+    self._save_thread.start()
+    return self._save_should_stop
+
+  def _save_sync(self, session, step):
     logging.info('Saving checkpoints for %d into %s.', step, self._save_path)
 
     for l in self._listeners:  # noqa: E741
@@ -9,32 +9,63 @@ if tf.__version__ >= '2.0':
   tf = tf.compat.v1
 
 
+# defaults of the field types, already converted
+_TYPE_DEFAULTS = {
+    DatasetConfig.INT32: 0,
+    DatasetConfig.INT64: np.int64(0),
+    DatasetConfig.STRING: '',
+    DatasetConfig.BOOL: False,
+    DatasetConfig.FLOAT: 0.0,
+    DatasetConfig.DOUBLE: np.float64(0.0)
+}
+
+# converters from the configured default string to the field types
+_TYPE_CONVERTERS = {
+    DatasetConfig.INT32: int,
+    DatasetConfig.INT64: np.int64,
+    DatasetConfig.STRING: lambda x: x,
+    DatasetConfig.BOOL: lambda x: x.lower() == 'true',
+    DatasetConfig.FLOAT: float,
+    DatasetConfig.DOUBLE: np.float64
+}
+
+
 def get_type_defaults(field_type, default_val=''):
-  type_defaults = {
-      DatasetConfig.INT32: 0,
-      DatasetConfig.INT64: 0,
-      DatasetConfig.STRING: '',
-      DatasetConfig.BOOL: False,
-      DatasetConfig.FLOAT: 0.0,
-      DatasetConfig.DOUBLE: 0.0
-  }
-  assert field_type in type_defaults, 'invalid type: %s' % field_type
+  assert field_type in _TYPE_DEFAULTS, 'invalid type: %s' % field_type
   if default_val == '':
-    default_val = type_defaults[field_type]
-  if field_type == DatasetConfig.INT32:
-    return int(default_val)
-  elif field_type == DatasetConfig.INT64:
-    return np.int64(default_val)
-  elif field_type == DatasetConfig.STRING:
-    return default_val
-  elif field_type == DatasetConfig.BOOL:
-    return default_val.lower() == 'true'
-  elif field_type in [DatasetConfig.FLOAT]:
-    return float(default_val)
-  elif field_type in [DatasetConfig.DOUBLE]:
-    return np.float64(default_val)
-
-  return type_defaults[field_type]
+    return _TYPE_DEFAULTS[field_type]
+  return _TYPE_CONVERTERS[field_type](default_val)
+
+
+def _string_to_int(field, ftype, name):
+  # Int type is not supported in fg.
+  # If you specify INT32, INT64 in DatasetConfig, you need to perform a cast at here.
+  tmp_field = tf.string_to_number(
+      field, tf.double, name='field_as_int_%s' % name)
+  if ftype in [DatasetConfig.INT64]:
+    return tf.cast(tmp_field, tf.int64)
+  else:
+    return tf.cast(tmp_field, tf.int32)
+
+
+def _string_to_float(field, ftype, name):
+  out_type = tf.float32 if ftype == DatasetConfig.FLOAT else tf.float64
+  return tf.string_to_number(field, out_type, name='field_as_flt_%s' % name)
+
+
+def _string_to_bool(field, ftype, name):
+  return tf.logical_or(tf.equal(field, 'True'), tf.equal(field, 'true'))
+
+
+# string field converters of the field types
+_STRING_CONVERTERS = {
+    DatasetConfig.INT32: _string_to_int,
+    DatasetConfig.INT64: _string_to_int,
+    DatasetConfig.STRING: lambda field, ftype, name: field,
+    DatasetConfig.FLOAT: _string_to_float,
+    DatasetConfig.DOUBLE: _string_to_float,
+    DatasetConfig.BOOL: _string_to_bool
+}
 
 
 def string_to_number(field, ftype, name=''):
@@ -46,24 +77,5 @@ def string_to_number(field, ftype, name=''):
     name: field name for
   Returns: A name for the operation (optional).
   """
-  tmp_field = field
-  if ftype in [DatasetConfig.INT32, DatasetConfig.INT64]:
-    # Int type is not supported in fg.
-    # If you specify INT32, INT64 in DatasetConfig, you need to perform a cast at here.
-    tmp_field = tf.string_to_number(
-        field, tf.double, name='field_as_int_%s' % name)
-    if ftype in [DatasetConfig.INT64]:
-      tmp_field = tf.cast(tmp_field, tf.int64)
-    else:
-      tmp_field = tf.cast(tmp_field, tf.int32)
-  elif ftype in [DatasetConfig.FLOAT]:
-    tmp_field = tf.string_to_number(
-        field, tf.float32, name='field_as_flt_%s' % name)
-  elif ftype in [DatasetConfig.DOUBLE]:
-    tmp_field = tf.string_to_number(
-        field, tf.float64, name='field_as_flt_%s' % name)
-  elif ftype in [DatasetConfig.BOOL]:
-    tmp_field = tf.logical_or(tf.equal(field, 'True'), tf.equal(field, 'true'))
-  else:
-    assert 'invalid types: %s' % str(ftype)
-  return tmp_field
+  assert ftype in _STRING_CONVERTERS, 'invalid types: %s' % str(ftype)
+  return _STRING_CONVERTERS[ftype](field, ftype, name)
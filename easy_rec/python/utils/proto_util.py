@@ -2,6 +2,17 @@
 # Copyright (c) Alibaba, Inc. and its affiliates.
 import logging
 
+import six
+
+# SavedModel.meta_graphs, length delimited field 2
+_SAVED_MODEL_META_GRAPHS_TAG = b'\x12'
+# MetaGraphDef.meta_info_def and MetaInfoDef.meta_graph_version,
+# length delimited field 1
+_META_INFO_DEF_TAG = b'\x0a'
+_META_GRAPH_VERSION_TAG = b'\x0a'
+# large fields are returned in chunks to avoid copying them at once
+_WRITE_CHUNK_SIZE = 64 * 1024 * 1024
+
 
 def copy_obj(proto_obj):
   """Make a copy of proto_obj so that later modifications of tmp_obj will have no impact on proto_obj.
@@ -87,3 +98,83 @@ def is_cache_from_redis(name, redis_cache_names):
         logging.info('embedding %s will be cached[specified by %s]' % (name, y))
         return True
   return False
+
+
+def _decode_varint(data, pos):
+  result = 0
+  shift = 0
+  while True:
+    byte = six.indexbytes(data, pos)
+    pos += 1
+    result |= (byte & 0x7f) << shift
+    if not byte & 0x80:
+      return result, pos
+    shift += 7
+
+
+def _encode_varint(value):
+  out = bytearray()
+  while value > 0x7f:
+    out.append((value & 0x7f) | 0x80)
+    value >>= 7
+  out.append(value)
+  return bytes(out)
+
+
+def set_meta_graph_version(saved_model_bytes, meta_graph_version):
+  """Set meta_graphs[0].meta_info_def.meta_graph_version of a SavedModel.
+
+  Only the framing of the top level fields is decoded. A meta_info_def
+  holding just the version is appended to the meta graph; protobuf merges
+  it into the existing meta_info_def and keeps the last meta_graph_version.
+  The graph and the other fields are copied without being parsed.
+
+  Args:
+    saved_model_bytes: serialized SavedModel
+    meta_graph_version: the version string to set
+  Return:
+    iterator of the byte chunks of the new SavedModel, or None if the
+    SavedModel does not hold exactly one meta graph
+  """
+  meta_graph_spans = []
+  pos = 0
+  while pos < len(saved_model_bytes):
+    field_start = pos
+    tag, pos = _decode_varint(saved_model_bytes, pos)
+    wire_type = tag & 0x7
+    if wire_type == 0:
+      _, pos = _decode_varint(saved_model_bytes, pos)
+    elif wire_type == 1:
+      pos += 8
+    elif wire_type == 2:
+      size, pos = _decode_varint(saved_model_bytes, pos)
+      if tag >> 3 == 2:
+        meta_graph_spans.append((field_start, pos, pos + size))
+      pos += size
+    elif wire_type == 5:
+      pos += 4
+    else:
+      return None
+  if len(meta_graph_spans) != 1 or pos != len(saved_model_bytes):
+    return None
+
+  if isinstance(meta_graph_version, six.text_type):
+    meta_graph_version = meta_graph_version.encode('utf-8')
+  meta_info_def = _META_GRAPH_VERSION_TAG + _encode_varint(
+      len(meta_graph_version)) + meta_graph_version
+  patch = _META_INFO_DEF_TAG + _encode_varint(
+      len(meta_info_def)) + meta_info_def
+
+  field_start, payload_start, payload_end = meta_graph_spans[0]
+
+  def _iter_chunks():
+    yield saved_model_bytes[:field_start]
+    yield _SAVED_MODEL_META_GRAPHS_TAG + _encode_varint(
+        payload_end - payload_start + len(patch))
+    for chunk_start in range(payload_start, payload_end, _WRITE_CHUNK_SIZE):
+      yield saved_model_bytes[chunk_start:min(chunk_start + _WRITE_CHUNK_SIZE,
+                                              payload_end)]
+    yield patch
+    yield saved_model_bytes[payload_end:]
+
+  return _iter_chunks()
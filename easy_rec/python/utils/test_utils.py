@@ -4,33 +4,45 @@
 
 isort:skip_file
 """
-from future import standard_library
-standard_library.install_aliases()
 import yaml
 import glob
 import json
 import logging
 import os
 import random
+import secrets
+import shlex
 import shutil
-import string
 import subprocess
+import sys
 import time
 from multiprocessing import Process
 from subprocess import getstatusoutput
 from tensorflow.python.platform import gfile
-import numpy as np
 from easy_rec.python.protos.train_pb2 import DistributionStrategy
 from easy_rec.python.utils import config_util
 from easy_rec.python.protos.pipeline_pb2 import EasyRecConfig
 
 TEST_DIR = './tmp/easy_rec_test'
 
+# run the commands with the interpreter running the tests
+_PYTHON = shlex.quote(sys.executable)
+
+# use the libyaml based loader and dumper if available
+_YamlLoader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+_YamlDumper = getattr(yaml, 'CSafeDumper', yaml.SafeDumper)
+
+# available gpus, keyed by the TEST_DEVICES environment variable
+_available_gpus = {}
+
+# (update time, listening tcp ports), refreshed every few seconds
+_LISTEN_PORTS_CACHE_SECS = 2
+_listen_ports = (0, set())
+
 
 def get_hdfs_tmp_dir(test_dir):
   """Create a randomly of directory  in HDFS."""
-  tmp_name = ''.join(
-      [random.choice(string.ascii_letters + string.digits) for i in range(8)])
+  tmp_name = secrets.token_hex(4)
   assert isinstance(test_dir, str)
   test_rand_dir = os.path.join(test_dir, tmp_name)
   gfile.MkDir(test_rand_dir)
@@ -38,16 +50,18 @@ def get_hdfs_tmp_dir(test_dir):
 
 
 def get_tmp_dir():
-  tmp_name = ''.join(
-      [random.choice(string.ascii_letters + string.digits) for i in range(8)])
   if os.environ.get('TEST_DIR', '') != '':
     global TEST_DIR
     TEST_DIR = os.environ['TEST_DIR']
-  dir_name = os.path.join(TEST_DIR, tmp_name)
-  if os.path.exists(dir_name):
-    shutil.rmtree(dir_name)
-  os.makedirs(dir_name)
-  return dir_name
+  while True:
+    tmp_name = secrets.token_hex(4)
+    dir_name = os.path.join(TEST_DIR, tmp_name)
+    try:
+      os.makedirs(dir_name)
+      return dir_name
+    except FileExistsError:
+      # the directory belongs to another test, try another name
+      logging.info('tmp dir %s exists, retry...' % dir_name)
 
 
 def clear_all_tmp_dirs():
@@ -63,22 +77,35 @@ def set_gpu_id(gpu_id_str):
 
 
 def get_available_gpus():
-  if 'TEST_DEVICES' in os.environ:
-    gpus = os.environ['TEST_DEVICES'].split(',')
-  else:
-    gpus = glob.glob('/dev/nvidia[0-9]*')
-    gpus = [gpu.replace('/dev/nvidia', '') for gpu in gpus]
-  logging.info('available gpus %s' % gpus)
-  return gpus
+  test_devices = os.environ.get('TEST_DEVICES', None)
+  gpus = _available_gpus.get(test_devices)
+  if gpus is None:
+    if test_devices is not None:
+      gpus = test_devices.split(',')
+    else:
+      gpus = glob.glob('/dev/nvidia[0-9]*')
+      gpus = [gpu.replace('/dev/nvidia', '') for gpu in gpus]
+    logging.info('available gpus %s' % gpus)
+    _available_gpus[test_devices] = gpus
+  return list(gpus)
+
 
+def run_cmd(cmd_str, log_file, env=None):
+  """Run a cmd, given as a command line string or an argument list.
 
-def run_cmd(cmd_str, log_file):
-  """Run a shell cmd."""
-  cmd_str = cmd_str.replace('\r', ' ').replace('\n', ' ')
-  logging.info('RUNCMD: %s > %s 2>&1 ' % (cmd_str, log_file))
+  Args:
+    cmd_str: command line string or argument list.
+    log_file: file to which stdout and stderr are redirected.
+    env: environment variables of the cmd, default to os.environ.
+  """
+  if isinstance(cmd_str, str):
+    cmd_args = shlex.split(cmd_str)
+  else:
+    cmd_args = list(cmd_str)
+  logging.info('RUNCMD: %s > %s 2>&1 ' % (' '.join(cmd_args), log_file))
   with open(log_file, 'w') as lfile:
     return subprocess.Popen(
-        cmd_str, stdout=lfile, stderr=subprocess.STDOUT, shell=True)
+        cmd_args, stdout=lfile, stderr=subprocess.STDOUT, env=env)
 
 
 def RunAsSubprocess(f):
@@ -123,9 +150,8 @@ def _replace_data_for_test(data_path):
 
   # if there are multiple keyword detected, use the longest one
   if len(releated_datasets) > 0:
-    score = [len(k) for k in releated_datasets]
-    best_match = np.argmax(score)
-    data_path = test_data[releated_datasets[best_match]]
+    best_match = max(releated_datasets, key=len)
+    data_path = test_data[best_match]
 
     change = True
   assert change, 'Failed to replace data with test data'
@@ -149,6 +175,13 @@ def _load_config_for_test(pipeline_config_path, test_dir, total_steps=50):
   return pipeline_config
 
 
+def _set_single_worker_config(pipeline_config):
+  train_config = pipeline_config.train_config
+  train_config.train_distribute = 0
+  train_config.num_gpus_per_worker = 1
+  train_config.sync_replicas = False
+
+
 def test_datahub_train_eval(pipeline_config_path,
                             test_dir,
                             process_pipeline_func=None,
@@ -172,16 +205,14 @@ def test_datahub_train_eval(pipeline_config_path,
     pipeline_config = _load_config_for_test(pipeline_config_path, test_dir,
                                             total_steps)
 
-  pipeline_config.train_config.train_distribute = 0
-  pipeline_config.train_config.num_gpus_per_worker = 1
-  pipeline_config.train_config.sync_replicas = False
+  _set_single_worker_config(pipeline_config)
   if process_pipeline_func is not None:
     assert callable(process_pipeline_func)
     pipeline_config = process_pipeline_func(pipeline_config)
   config_util.save_pipeline_config(pipeline_config, test_dir)
   test_pipeline_config_path = os.path.join(test_dir, 'pipeline.config')
-  train_cmd = 'python3 -m easy_rec.python.train_eval --pipeline_config_path %s %s' % (
-      test_pipeline_config_path, hyperparam_str)
+  train_cmd = '%s -m easy_rec.python.train_eval --pipeline_config_path %s %s' % (
+      _PYTHON, test_pipeline_config_path, hyperparam_str)
   proc = run_cmd(train_cmd, '%s/log_%s.txt' % (test_dir, 'master'))
   proc.wait()
   if proc.returncode != 0:
@@ -221,16 +252,14 @@ def test_single_train_eval(pipeline_config_path,
     pipeline_config = _load_config_for_test(pipeline_config_path, test_dir,
                                             total_steps)
 
-  pipeline_config.train_config.train_distribute = 0
-  pipeline_config.train_config.num_gpus_per_worker = 1
-  pipeline_config.train_config.sync_replicas = False
+  _set_single_worker_config(pipeline_config)
   if process_pipeline_func is not None:
     assert callable(process_pipeline_func)
     pipeline_config = process_pipeline_func(pipeline_config)
   config_util.save_pipeline_config(pipeline_config, test_dir)
   test_pipeline_config_path = os.path.join(test_dir, 'pipeline.config')
-  train_cmd = 'python -m easy_rec.python.train_eval --pipeline_config_path %s %s' % (
-      test_pipeline_config_path, hyperparam_str)
+  train_cmd = '%s -m easy_rec.python.train_eval --pipeline_config_path %s %s' % (
+      _PYTHON, test_pipeline_config_path, hyperparam_str)
   proc = run_cmd(train_cmd, '%s/log_%s.txt' % (test_dir, 'master'))
   proc.wait()
   if proc.returncode != 0:
@@ -245,8 +274,9 @@ def test_feature_selection(pipeline_config):
   model_dir = pipeline_config.model_dir
   pipeline_config_path = os.path.join(model_dir, 'pipeline.config')
   output_dir = os.path.join(model_dir, 'feature_selection')
-  cmd = 'python -m easy_rec.python.tools.feature_selection --config_path %s ' \
-        '--output_dir %s --topk 5 --visualize true' % (pipeline_config_path, output_dir)
+  cmd = '%s -m easy_rec.python.tools.feature_selection --config_path %s ' \
+        '--output_dir %s --topk 5 --visualize true' % (
+            _PYTHON, pipeline_config_path, output_dir)
   proc = run_cmd(cmd, os.path.join(model_dir, 'log_feature_selection.txt'))
   proc.wait()
   if proc.returncode != 0:
@@ -261,7 +291,7 @@ def yaml_replace(train_yaml_path,
                  test_export_dir=None):
   with open(train_yaml_path, 'r', encoding='utf-8') as _file:
     sample = _file.read()
-    x = yaml.load(sample)
+    x = yaml.load(sample, Loader=_YamlLoader)
     _command = x['app']['command']
     if test_export_dir is not None:
       _command = _command.replace(pipline_config_path,
@@ -272,78 +302,75 @@ def yaml_replace(train_yaml_path,
                                   test_pipeline_config_path)
     x['app']['command'] = _command
 
-  with open(train_yaml_path, 'w', encoding='utf-8') as _file:
-    yaml.dump(x, _file)
-
-
-def test_hdfs_train_eval(pipeline_config_path,
-                         train_yaml_path,
-                         test_dir,
-                         process_pipeline_func=None,
-                         hyperparam_str='',
-                         total_steps=2000):
-
+  # write to a temporary file first, so that the yaml is never half written
+  tmp_yaml_path = train_yaml_path + '.tmp'
+  with open(tmp_yaml_path, 'w', encoding='utf-8') as _file:
+    yaml.dump(x, _file, Dumper=_YamlDumper)
+  os.replace(tmp_yaml_path, train_yaml_path)
+
+
+def _test_hdfs_submit(task_name,
+                      pipeline_config_path,
+                      yaml_path,
+                      test_dir,
+                      load_config_func,
+                      process_pipeline_func=None,
+                      test_export_path=None):
+  """Save the test pipeline config, point the yaml to it and el_submit it."""
   gpus = get_available_gpus()
   if len(gpus) > 0:
     set_gpu_id(gpus[0])
   else:
     set_gpu_id(None)
-  logging.info('testing pipeline config %s' % pipeline_config_path)
-  logging.info('train_yaml_path %s' % train_yaml_path)
+  logging.info('testing %s pipeline config %s' %
+               (task_name, pipeline_config_path))
+  logging.info('%s_yaml_path %s' % (task_name, yaml_path))
   if 'TF_CONFIG' in os.environ:
     del os.environ['TF_CONFIG']
-  pipeline_config = _load_config_for_test(pipeline_config_path, test_dir,
-                                          total_steps)
-  logging.info('model_dir in pipeline_config has been modified')
-  pipeline_config.train_config.train_distribute = 0
-  pipeline_config.train_config.num_gpus_per_worker = 1
-  pipeline_config.train_config.sync_replicas = False
+  pipeline_config = load_config_func(pipeline_config_path)
   if process_pipeline_func is not None:
     assert callable(process_pipeline_func)
     pipeline_config = process_pipeline_func(pipeline_config)
   config_util.save_pipeline_config(pipeline_config, test_dir)
   test_pipeline_config_path = os.path.join(test_dir, 'pipeline.config')
-  yaml_replace(train_yaml_path, pipeline_config_path, test_pipeline_config_path)
+  yaml_replace(yaml_path, pipeline_config_path, test_pipeline_config_path,
+               test_export_path)
   logging.info('test_pipeline_config_path is %s' % test_pipeline_config_path)
-  train_cmd = 'el_submit -yaml %s' % train_yaml_path
-  proc = subprocess.Popen(train_cmd.split(), stderr=subprocess.STDOUT)
+  submit_cmd = 'el_submit -yaml %s' % yaml_path
+  proc = subprocess.Popen(submit_cmd.split(), stderr=subprocess.STDOUT)
   proc.wait()
   if proc.returncode != 0:
-    logging.error('train %s failed' % test_pipeline_config_path)
-    logging.error('train_yaml %s failed' % train_yaml_path)
+    logging.error('%s %s failed' % (task_name, test_pipeline_config_path))
+    logging.error('%s_yaml %s failed' % (task_name, yaml_path))
   return proc.returncode == 0
 
 
+def test_hdfs_train_eval(pipeline_config_path,
+                         train_yaml_path,
+                         test_dir,
+                         process_pipeline_func=None,
+                         hyperparam_str='',
+                         total_steps=2000):
+
+  def _load_config(pipeline_config_path):
+    pipeline_config = _load_config_for_test(pipeline_config_path, test_dir,
+                                            total_steps)
+    logging.info('model_dir in pipeline_config has been modified')
+    _set_single_worker_config(pipeline_config)
+    return pipeline_config
+
+  return _test_hdfs_submit('train', pipeline_config_path, train_yaml_path,
+                           test_dir, _load_config, process_pipeline_func)
+
+
 def test_hdfs_eval(pipeline_config_path,
                    eval_yaml_path,
                    test_dir,
                    process_pipeline_func=None,
                    hyperparam_str=''):
-
-  gpus = get_available_gpus()
-  if len(gpus) > 0:
-    set_gpu_id(gpus[0])
-  else:
-    set_gpu_id(None)
-  logging.info('testing export pipeline config %s' % pipeline_config_path)
-  logging.info('eval_yaml_path %s' % eval_yaml_path)
-  if 'TF_CONFIG' in os.environ:
-    del os.environ['TF_CONFIG']
-  pipeline_config = _Load_config_for_test_eval(pipeline_config_path)
-  if process_pipeline_func is not None:
-    assert callable(process_pipeline_func)
-    pipeline_config = process_pipeline_func(pipeline_config)
-  config_util.save_pipeline_config(pipeline_config, test_dir)
-  test_pipeline_config_path = os.path.join(test_dir, 'pipeline.config')
-  yaml_replace(eval_yaml_path, pipeline_config_path, test_pipeline_config_path)
-  logging.info('test_pipeline_config_path is %s' % test_pipeline_config_path)
-  eval_cmd = 'el_submit -yaml %s' % eval_yaml_path
-  proc = subprocess.Popen(eval_cmd.split(), stderr=subprocess.STDOUT)
-  proc.wait()
-  if proc.returncode != 0:
-    logging.error('eval %s failed' % test_pipeline_config_path)
-    logging.error('eval_yaml %s failed' % eval_yaml_path)
-  return proc.returncode == 0
+  return _test_hdfs_submit('eval', pipeline_config_path, eval_yaml_path,
+                           test_dir, _Load_config_for_test_eval,
+                           process_pipeline_func)
 
 
 def test_hdfs_export(pipeline_config_path,
@@ -351,53 +378,58 @@ def test_hdfs_export(pipeline_config_path,
                      test_dir,
                      process_pipeline_func=None,
                      hyperparam_str=''):
-
-  gpus = get_available_gpus()
-  if len(gpus) > 0:
-    set_gpu_id(gpus[0])
-  else:
-    set_gpu_id(None)
-  logging.info('testing export pipeline config %s' % pipeline_config_path)
-  logging.info('export_yaml_path %s' % export_yaml_path)
-  if 'TF_CONFIG' in os.environ:
-    del os.environ['TF_CONFIG']
-  pipeline_config = _Load_config_for_test_eval(pipeline_config_path)
-  if process_pipeline_func is not None:
-    assert callable(process_pipeline_func)
-    pipeline_config = process_pipeline_func(pipeline_config)
-  config_util.save_pipeline_config(pipeline_config, test_dir)
-  test_pipeline_config_path = os.path.join(test_dir, 'pipeline.config')
   test_export_path = os.path.join(test_dir, 'export_dir')
-  yaml_replace(export_yaml_path, pipeline_config_path,
-               test_pipeline_config_path, test_export_path)
-  logging.info('test_pipeline_config_path is %s' % test_pipeline_config_path)
-  eval_cmd = 'el_submit -yaml %s' % export_yaml_path
-  proc = subprocess.Popen(eval_cmd.split(), stderr=subprocess.STDOUT)
-  proc.wait()
-  if proc.returncode != 0:
-    logging.error('export %s failed' % test_pipeline_config_path)
-    logging.error('export_yaml %s failed' % export_yaml_path)
-  return proc.returncode == 0
-
-
-def _ports_in_use(ports):
-  ports_str = ''
-  for i, port in enumerate(ports):
-    if i > 0:
-      ports_str += '|'
-    ports_str += '0.0.0.0:%d|127.0.0.1:%d' % (port, port)
-  stat, output = getstatusoutput('netstat -tlnp | grep -E %s' % ports_str)
-  return stat == 0
+  return _test_hdfs_submit('export', pipeline_config_path, export_yaml_path,
+                           test_dir, _Load_config_for_test_eval,
+                           process_pipeline_func, test_export_path)
+
+
+def _get_listen_ports():
+  global _listen_ports
+  update_ts, listen_ports = _listen_ports
+  if time.time() - update_ts > _LISTEN_PORTS_CACHE_SECS:
+    listen_ports = set()
+    if os.path.exists('/proc/net/tcp'):
+      # local_address is hex_ip:hex_port, state 0A is TCP_LISTEN
+      for proc_file in ['/proc/net/tcp', '/proc/net/tcp6']:
+        if not os.path.exists(proc_file):
+          continue
+        with open(proc_file, 'r') as fin:
+          next(fin)
+          for line_str in fin:
+            line_toks = line_str.split()
+            if line_toks[3] == '0A':
+              listen_ports.add(int(line_toks[1].rsplit(':', 1)[1], 16))
+    else:
+      stat, output = getstatusoutput('netstat -tln')
+      for line_str in output.split('\n'):
+        line_toks = line_str.split()
+        if len(line_toks) >= 6 and line_toks[5] == 'LISTEN':
+          listen_ports.add(int(line_toks[3].rsplit(':', 1)[1]))
+    _listen_ports = (time.time(), listen_ports)
+  return listen_ports
 
 
 def _get_ports(num_worker):
   port_base = int(os.environ.get('PORT_BASE', 10000))
-  num_try = 10
-  for i in range(num_try):
-    ports = np.random.randint(port_base, port_base + 5000, size=num_worker)
-    if not _ports_in_use(ports):
-      return ports
-    logging.info('ports %s in use, retry...' % ports)
+  listen_ports = _get_listen_ports()
+  free_ports = [
+      port for port in range(port_base, port_base + 5000)
+      if port not in listen_ports
+  ]
+  return random.sample(free_ports, num_worker)
+
+
+def _get_task_env(tf_config, task_type, task_index, gpu_id_str):
+  """Build the environment of one task, os.environ is not modified."""
+  task_env = os.environ.copy()
+  task_env['TF_CONFIG'] = json.dumps(
+      dict(tf_config, task={
+          'type': task_type,
+          'index': task_index
+      }))
+  task_env['CUDA_VISIBLE_DEVICES'] = '' if gpu_id_str is None else gpu_id_str
+  return task_env
 
 
 def _ps_worker_train(pipeline_config_path,
@@ -417,30 +449,28 @@ def _ps_worker_train(pipeline_config_path,
   }
   tf_config = {'cluster': cluster}
   procs = {}
-  tf_config['task'] = {'type': chief_or_master, 'index': 0}
-  os.environ['TF_CONFIG'] = json.dumps(tf_config)
-  set_gpu_id(gpus[0])
-  train_cmd = 'python -m easy_rec.python.train_eval --pipeline_config_path %s' % pipeline_config_path
+  train_cmd = '%s -m easy_rec.python.train_eval --pipeline_config_path %s' % (
+      _PYTHON, pipeline_config_path)
   procs[chief_or_master] = run_cmd(
-      train_cmd, '%s/log_%s.txt' % (test_dir, chief_or_master))
-  tf_config['task'] = {'type': 'ps', 'index': 0}
-  os.environ['TF_CONFIG'] = json.dumps(tf_config)
-  set_gpu_id('')
-  procs['ps'] = run_cmd(train_cmd, '%s/log_%s.txt' % (test_dir, 'ps'))
+      train_cmd,
+      '%s/log_%s.txt' % (test_dir, chief_or_master),
+      env=_get_task_env(tf_config, chief_or_master, 0, gpus[0]))
+  procs['ps'] = run_cmd(
+      train_cmd,
+      '%s/log_%s.txt' % (test_dir, 'ps'),
+      env=_get_task_env(tf_config, 'ps', 0, ''))
 
   for idx in range(num_worker - 1):
-    tf_config['task'] = {'type': 'worker', 'index': idx}
-    os.environ['TF_CONFIG'] = json.dumps(tf_config)
-    set_gpu_id(gpus[idx + 1])
     worker_name = 'worker_%d' % idx
-    procs[worker_name] = run_cmd(train_cmd,
-                                 '%s/log_%s.txt' % (test_dir, worker_name))
+    procs[worker_name] = run_cmd(
+        train_cmd,
+        '%s/log_%s.txt' % (test_dir, worker_name),
+        env=_get_task_env(tf_config, 'worker', idx, gpus[idx + 1]))
   if num_evaluator > 0:
-    tf_config['task'] = {'type': 'evaluator', 'index': 0}
-    os.environ['TF_CONFIG'] = json.dumps(tf_config)
-    set_gpu_id('')
-    procs['evaluator'] = run_cmd(train_cmd,
-                                 '%s/log_%s.txt' % (test_dir, 'evaluator'))
+    procs['evaluator'] = run_cmd(
+        train_cmd,
+        '%s/log_%s.txt' % (test_dir, 'evaluator'),
+        env=_get_task_env(tf_config, 'evaluator', 0, ''))
 
   return procs
 
@@ -457,14 +487,14 @@ def _multi_worker_mirror_train(pipeline_config_path, test_dir, num_worker):
       }
   }
   procs = {}
-  train_cmd = 'python -m easy_rec.python.train_eval --pipeline_config_path %s' % pipeline_config_path
+  train_cmd = '%s -m easy_rec.python.train_eval --pipeline_config_path %s' % (
+      _PYTHON, pipeline_config_path)
   for idx in range(num_worker):
-    tf_config['task'] = {'type': 'worker', 'index': idx}
-    os.environ['TF_CONFIG'] = json.dumps(tf_config)
-    set_gpu_id(gpus[idx])
     worker_name = 'worker_%d' % idx
-    procs[worker_name] = run_cmd(train_cmd,
-                                 '%s/log_%s.txt' % (test_dir, worker_name))
+    procs[worker_name] = run_cmd(
+        train_cmd,
+        '%s/log_%s.txt' % (test_dir, worker_name),
+        env=_get_task_env(tf_config, 'worker', idx, gpus[idx]))
   return procs
 
 